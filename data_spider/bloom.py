@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+布隆过滤器
+用于记录已见过的电影链接，内存占用只取决于容量和误判率，可持久化到文件
+作者：电影推荐系统团队
+日期：2025-06-30
+"""
+
+import os
+import math
+import struct
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger('bloom')
+
+# 文件头：魔数、位数组长度、哈希函数个数、容量、已加入数量
+_MAGIC = b'BLM1'
+_HEADER = struct.Struct('<4sQIQQ')
+
+
+class BloomFilter(object):
+	"""布隆过滤器（线程安全）"""
+
+	def __init__(self, capacity=1000000, error_rate=0.001):
+		"""
+		初始化布隆过滤器
+
+		参数:
+			capacity: 预计加入的元素数量
+			error_rate: 达到容量时的误判率
+		"""
+		if capacity <= 0 or not 0 < error_rate < 1:
+			raise ValueError('capacity必须为正数，error_rate必须在0和1之间')
+		self.capacity = capacity
+		self.error_rate = error_rate
+		# 最优位数 m = -n*ln(p)/(ln2)^2，哈希函数个数 k = m/n*ln2
+		self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+		self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+		self.bits = bytearray((self.num_bits + 7) // 8)
+		self.count = 0
+		self._lock = threading.Lock()
+		self._warned = False
+
+	def _positions(self, item):
+		"""双重哈希生成k个位置"""
+		if isinstance(item, str):
+			item = item.encode('utf-8')
+		digest = hashlib.blake2b(item, digest_size=16).digest()
+		h1, h2 = struct.unpack('<QQ', digest)
+		h2 |= 1
+		m = self.num_bits
+		return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+	def __contains__(self, item):
+		bits = self.bits
+		return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+	def add(self, item):
+		"""
+		加入元素
+
+		参数:
+			item: 字符串或字节串
+
+		返回:
+			bool: 元素此前不在过滤器中返回True（可能因误判返回False）
+		"""
+		positions = self._positions(item)
+		with self._lock:
+			bits = self.bits
+			added = False
+			for pos in positions:
+				mask = 1 << (pos & 7)
+				if not bits[pos >> 3] & mask:
+					bits[pos >> 3] |= mask
+					added = True
+			if added:
+				self.count += 1
+				if self.count > self.capacity and not self._warned:
+					self._warned = True
+					logger.warning(f"布隆过滤器已超过容量 {self.capacity}，误判率将高于 {self.error_rate}")
+			return added
+
+	@property
+	def size_bytes(self):
+		"""位数组占用的字节数"""
+		return len(self.bits)
+
+	def save(self, path):
+		"""
+		保存到文件（先写临时文件再替换，避免中断时损坏）
+
+		参数:
+			path: 文件路径
+		"""
+		tmp_path = path + '.tmp'
+		with self._lock:
+			with open(tmp_path, 'wb') as f:
+				f.write(_HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, self.capacity, self.count))
+				f.write(struct.pack('<d', self.error_rate))
+				f.write(self.bits)
+				f.flush()
+				os.fsync(f.fileno())
+		os.replace(tmp_path, path)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		从文件加载
+
+		参数:
+			path: 文件路径
+
+		返回:
+			BloomFilter: 布隆过滤器
+		"""
+		with open(path, 'rb') as f:
+			magic, num_bits, num_hashes, capacity, count = _HEADER.unpack(f.read(_HEADER.size))
+			if magic != _MAGIC:
+				raise ValueError(f"{path} 不是布隆过滤器文件")
+			error_rate, = struct.unpack('<d', f.read(8))
+			bits = bytearray(f.read())
+		if len(bits) != (num_bits + 7) // 8:
+			raise ValueError(f"{path} 文件不完整")
+		bloom = cls.__new__(cls)
+		bloom.capacity = capacity
+		bloom.error_rate = error_rate
+		bloom.num_bits = num_bits
+		bloom.num_hashes = num_hashes
+		bloom.bits = bits
+		bloom.count = count
+		bloom._lock = threading.Lock()
+		bloom._warned = count > capacity
+		return bloom
+
+	@classmethod
+	def open(cls, path, capacity=1000000, error_rate=0.001):
+		"""
+		加载已有的过滤器文件，文件不存在或损坏时新建
+
+		参数:
+			path: 文件路径
+			capacity: 新建时的容量
+			error_rate: 新建时的误判率
+
+		返回:
+			BloomFilter: 布隆过滤器
+		"""
+		if path and os.path.exists(path):
+			try:
+				return cls.load(path)
+			except Exception as e:
+				logger.error(f"加载布隆过滤器 {path} 失败，将新建: {str(e)}")
+		return cls(capacity, error_rate)
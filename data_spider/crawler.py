@@ -0,0 +1,642 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+并发爬虫引擎
+提供线程池抓取、按主机限速、失败重试退避、可持久化的URL队列（断点续爬）
+以及抓取耗时与吞吐量统计
+作者：电影推荐系统团队
+日期：2025-06-20
+"""
+
+import os
+import time
+import random
+import hashlib
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger('crawler')
+
+# 默认的爬虫状态文件
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATE_PATH = os.path.join(CURRENT_DIR, 'crawl_state.db')
+
+DEFAULT_HEADERS = {
+	'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+		'(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+}
+
+
+def page_filename(url):
+	"""
+	保存页面时使用的文件名（本地替身服务器按同样规则查找）
+
+	参数:
+		url: 页面URL
+
+	返回:
+		str: 文件名
+	"""
+	parts = urlsplit(url)
+	key = parts.path + ('?' + parts.query if parts.query else '')
+	return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html'
+
+
+class Frontier(object):
+	"""基于SQLite的持久化URL队列，进程中断后可从上次位置继续"""
+
+	def __init__(self, path=DEFAULT_STATE_PATH):
+		"""
+		初始化URL队列
+
+		参数:
+			path: SQLite状态文件路径
+		"""
+		self.path = path
+		self._lock = threading.Lock()
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS frontier (
+				url TEXT PRIMARY KEY,
+				kind TEXT NOT NULL,
+				meta TEXT,
+				status TEXT NOT NULL DEFAULT 'pending',
+				attempts INTEGER NOT NULL DEFAULT 0,
+				updated REAL
+			)
+		""")
+		self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_status ON frontier(status)')
+		# 每个页面上次抓取的缓存校验信息与内容摘要（增量抓取用）
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS page_state (
+				url TEXT PRIMARY KEY,
+				etag TEXT,
+				last_modified TEXT,
+				digest TEXT,
+				checked REAL
+			)
+		""")
+		# 每部电影上次入库时的信息摘要，用于识别新出现或有变化的电影
+		self.conn.execute("""
+			CREATE TABLE IF NOT EXISTS link_state (
+				link TEXT PRIMARY KEY,
+				digest TEXT NOT NULL,
+				updated REAL
+			)
+		""")
+		# 上次运行中断时正在抓取的URL重新排队
+		self.conn.execute("UPDATE frontier SET status='pending' WHERE status='running'")
+		self.conn.commit()
+
+	def add(self, url, kind, meta=''):
+		"""
+		加入URL（已存在则忽略）
+
+		参数:
+			url: 页面URL
+			kind: 页面类型（由处理函数解释）
+			meta: 附加信息
+
+		返回:
+			bool: 是否为新加入的URL
+		"""
+		with self._lock:
+			cur = self.conn.execute(
+				'INSERT OR IGNORE INTO frontier(url, kind, meta, updated) VALUES (?, ?, ?, ?)',
+				(url, kind, meta, time.time())
+			)
+			self.conn.commit()
+			return cur.rowcount > 0
+
+	def add_many(self, items):
+		"""
+		批量加入URL（已存在的忽略）
+
+		参数:
+			items: [(url, kind, meta), ...]
+
+		返回:
+			int: 新加入的数量
+		"""
+		now = time.time()
+		with self._lock:
+			before = self.conn.total_changes
+			self.conn.executemany(
+				'INSERT OR IGNORE INTO frontier(url, kind, meta, updated) VALUES (?, ?, ?, ?)',
+				[(url, kind, meta, now) for url, kind, meta in items]
+			)
+			self.conn.commit()
+			return self.conn.total_changes - before
+
+	def requeue(self, url, kind, meta=''):
+		"""
+		加入URL，已完成的URL重新置为待抓取（用于周期性刷新的入口页）
+
+		参数:
+			url: 页面URL
+			kind: 页面类型
+			meta: 附加信息
+		"""
+		with self._lock:
+			self.conn.execute(
+				"INSERT INTO frontier(url, kind, meta, updated) VALUES (?, ?, ?, ?) "
+				"ON CONFLICT(url) DO UPDATE SET status='pending', attempts=0, updated=excluded.updated "
+				"WHERE status != 'running'",
+				(url, kind, meta, time.time())
+			)
+			self.conn.commit()
+
+	def requeue_kind(self, kind):
+		"""
+		将某类已完成的URL全部重新置为待抓取
+
+		参数:
+			kind: 页面类型
+
+		返回:
+			int: 重新排队的URL数量
+		"""
+		with self._lock:
+			cur = self.conn.execute(
+				"UPDATE frontier SET status='pending', attempts=0, updated=? WHERE kind=? AND status='done'",
+				(time.time(), kind)
+			)
+			self.conn.commit()
+			return cur.rowcount
+
+	def page_state(self, url):
+		"""
+		获取页面上次抓取的状态
+
+		返回:
+			tuple: (etag, last_modified, digest)，从未抓取过时返回None
+		"""
+		with self._lock:
+			return self.conn.execute(
+				'SELECT etag, last_modified, digest FROM page_state WHERE url=?', (url,)
+			).fetchone()
+
+	def save_page_state(self, url, etag, last_modified, digest):
+		"""保存页面的缓存校验信息与内容摘要"""
+		with self._lock:
+			self.conn.execute(
+				'INSERT OR REPLACE INTO page_state(url, etag, last_modified, digest, checked) VALUES (?, ?, ?, ?, ?)',
+				(url, etag, last_modified, digest, time.time())
+			)
+			self.conn.commit()
+
+	def link_changed(self, link, digest):
+		"""
+		判断电影是否为新出现或信息有变化（只查询，入库提交后再用save_link_states记录）
+
+		参数:
+			link: 电影详情链接
+			digest: 电影信息摘要
+
+		返回:
+			bool: 新出现或有变化返回True
+		"""
+		with self._lock:
+			row = self.conn.execute('SELECT digest FROM link_state WHERE link=?', (link,)).fetchone()
+			return row is None or row[0] != digest
+
+	def save_link_states(self, items):
+		"""
+		记录已入库电影的信息摘要
+
+		参数:
+			items: [(link, digest), ...]
+		"""
+		now = time.time()
+		with self._lock:
+			self.conn.executemany(
+				'INSERT OR REPLACE INTO link_state(link, digest, updated) VALUES (?, ?, ?)',
+				[(link, digest, now) for link, digest in items]
+			)
+			self.conn.commit()
+
+	def claim(self):
+		"""
+		取出一个待抓取的URL并标记为抓取中
+
+		返回:
+			tuple: (url, kind, meta, attempts)，队列为空时返回None
+		"""
+		with self._lock:
+			row = self.conn.execute(
+				"SELECT url, kind, meta, attempts FROM frontier WHERE status='pending' "
+				"ORDER BY updated LIMIT 1"
+			).fetchone()
+			if row is None:
+				return None
+			self.conn.execute(
+				"UPDATE frontier SET status='running', updated=? WHERE url=?", (time.time(), row[0])
+			)
+			self.conn.commit()
+			return row
+
+	def done(self, url):
+		"""标记URL抓取完成"""
+		self._set_status(url, 'done')
+
+	def retry(self, url):
+		"""URL处理失败，放回队尾稍后重试"""
+		self._set_status(url, 'pending')
+
+	def failed(self, url):
+		"""标记URL抓取失败（不再重试）"""
+		self._set_status(url, 'failed')
+
+	def _set_status(self, url, status):
+		with self._lock:
+			self.conn.execute(
+				'UPDATE frontier SET status=?, attempts=attempts+1, updated=? WHERE url=?',
+				(status, time.time(), url)
+			)
+			self.conn.commit()
+
+	def counts(self):
+		"""
+		统计各状态的URL数量
+
+		返回:
+			dict: 状态 -> 数量
+		"""
+		with self._lock:
+			rows = self.conn.execute('SELECT status, COUNT(*) FROM frontier GROUP BY status').fetchall()
+		return dict(rows)
+
+	def close(self):
+		"""关闭状态文件"""
+		with self._lock:
+			self.conn.close()
+
+
+class HostRateLimiter(object):
+	"""按主机限速：同一主机两次请求之间至少间隔interval秒（附加随机抖动）"""
+
+	def __init__(self, interval=5.0, jitter=0.5):
+		"""
+		初始化限速器
+
+		参数:
+			interval: 同一主机的最小请求间隔（秒）
+			jitter: 间隔的随机抖动比例（0.5表示在interval的±50%内浮动）
+		"""
+		self.interval = interval
+		self.jitter = jitter
+		self._lock = threading.Lock()
+		self._next = {}
+
+	def wait(self, url):
+		"""
+		等待直到允许请求该URL所在主机
+
+		参数:
+			url: 即将请求的URL
+		"""
+		host = urlsplit(url).netloc
+		with self._lock:
+			now = time.monotonic()
+			slot = max(now, self._next.get(host, now))
+			gap = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+			self._next[host] = slot + gap
+		delay = slot - now
+		if delay > 0:
+			time.sleep(delay)
+
+
+class FetchError(Exception):
+	"""页面抓取失败，permanent为真时表示无需再试（如404）"""
+
+	def __init__(self, message, permanent=False):
+		super().__init__(message)
+		self.permanent = permanent
+
+
+class CrawlStats(object):
+	"""抓取耗时与吞吐量统计"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.started = time.time()
+		self.latencies = []
+		self.bytes = 0
+		self.pages = 0
+		self.errors = 0
+		self.retries = 0
+		self.not_modified = 0
+		self.unchanged = 0
+		self.parsed = 0
+		self.status_codes = {}
+
+	def record(self, elapsed, size, status):
+		"""记录一次成功的请求"""
+		with self._lock:
+			self.pages += 1
+			self.bytes += size
+			self.latencies.append(elapsed)
+			self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+	def record_outcome(self, outcome):
+		"""
+		记录页面处理结果
+
+		参数:
+			outcome: not_modified（304）、unchanged（内容摘要未变）或parsed（已解析）
+		"""
+		with self._lock:
+			setattr(self, outcome, getattr(self, outcome) + 1)
+
+	def record_retry(self):
+		"""记录一次重试"""
+		with self._lock:
+			self.retries += 1
+
+	def record_error(self):
+		"""记录一次最终失败"""
+		with self._lock:
+			self.errors += 1
+
+	def report(self):
+		"""
+		生成统计报告
+
+		返回:
+			dict: 页数、错误数、吞吐量、延迟百分位等
+		"""
+		with self._lock:
+			latencies = sorted(self.latencies)
+			elapsed = time.time() - self.started
+
+			def pct(p):
+				if not latencies:
+					return 0.0
+				return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))]
+
+			return {
+				'elapsed': round(elapsed, 3),
+				'pages': self.pages,
+				'errors': self.errors,
+				'retries': self.retries,
+				'not_modified': self.not_modified,
+				'unchanged': self.unchanged,
+				'parsed': self.parsed,
+				'bytes': self.bytes,
+				'pages_per_sec': round(self.pages / elapsed, 3) if elapsed else 0.0,
+				'p50_ms': round(pct(50) * 1000, 1),
+				'p95_ms': round(pct(95) * 1000, 1),
+				'max_ms': round((latencies[-1] if latencies else 0) * 1000, 1),
+				'status_codes': dict(self.status_codes),
+			}
+
+
+class Fetcher(object):
+	"""带重试与指数退避的页面下载器，每个线程复用一个HTTP会话"""
+
+	def __init__(self, limiter, stats, retries=3, backoff=2.0, timeout=15, save_dir=None):
+		"""
+		初始化下载器
+
+		参数:
+			limiter: HostRateLimiter对象
+			stats: CrawlStats对象
+			retries: 最大重试次数
+			backoff: 退避基数（秒），第n次重试等待 backoff * 2**n 秒（附加随机抖动）
+			timeout: 请求超时时间（秒）
+			save_dir: 若指定，抓到的页面同时保存到该目录，供本地替身服务器使用
+		"""
+		self.limiter = limiter
+		self.stats = stats
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.save_dir = save_dir
+		self._local = threading.local()
+		if save_dir:
+			os.makedirs(save_dir, exist_ok=True)
+
+	def _session(self):
+		session = getattr(self._local, 'session', None)
+		if session is None:
+			session = requests.Session()
+			session.headers.update(DEFAULT_HEADERS)
+			self._local.session = session
+		return session
+
+	def fetch(self, url, headers=None):
+		"""
+		下载页面
+
+		参数:
+			url: 页面URL
+			headers: 附加请求头
+
+		返回:
+			requests.Response: 响应对象（状态码200或304）
+
+		异常:
+			FetchError: 重试次数用完仍失败
+		"""
+		last_error = None
+		for attempt in range(self.retries + 1):
+			if attempt:
+				self.stats.record_retry()
+				time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+			self.limiter.wait(url)
+			start = time.perf_counter()
+			try:
+				response = self._session().get(url, headers=headers, timeout=self.timeout)
+			except requests.RequestException as e:
+				last_error = str(e)
+				logger.warning(f"请求失败 {url} (尝试 {attempt + 1}/{self.retries + 1}): {last_error}")
+				continue
+			elapsed = time.perf_counter() - start
+			if response.status_code in (200, 304):
+				self.stats.record(elapsed, len(response.content), response.status_code)
+				if self.save_dir and response.status_code == 200:
+					with open(os.path.join(self.save_dir, page_filename(url)), 'wb') as f:
+						f.write(response.content)
+				return response
+			last_error = f"HTTP {response.status_code}"
+			logger.warning(f"请求失败 {url} (尝试 {attempt + 1}/{self.retries + 1}): {last_error}")
+			if response.status_code == 404:
+				self.stats.record_error()
+				raise FetchError(f"{url}: {last_error}", permanent=True)
+		self.stats.record_error()
+		raise FetchError(f"{url}: {last_error}")
+
+
+class Crawler(object):
+	"""并发爬虫：从持久化队列取URL，交给处理函数解析，处理函数返回新发现的URL"""
+
+	def __init__(self, frontier, fetcher, handlers, workers=4, max_attempts=3, digests=None, conditional=False,
+			sinks=None):
+		"""
+		初始化爬虫
+
+		参数:
+			frontier: Frontier对象
+			fetcher: Fetcher对象
+			handlers: 页面类型 -> 处理函数 handler(url, meta, response)，
+			          返回新URL列表 [(url, kind, meta), ...]
+			workers: 工作线程数
+			max_attempts: 单个URL最多尝试的轮数（每轮内部还有Fetcher的重试）
+			digests: 页面类型 -> 内容摘要函数 digest(content_bytes)，默认对整个页面做SHA1
+			conditional: 是否发送条件请求（If-None-Match/If-Modified-Since），
+			             并跳过内容摘要与上次相同的页面
+			sinks: 页面类型 -> 处理函数写入数据的BatchSink；指定时该类页面的数据行全部提交后
+			       才保存页面状态、加入新URL并标记完成，写入失败的页面按失败重试
+		"""
+		self.frontier = frontier
+		self.fetcher = fetcher
+		self.handlers = handlers
+		self.workers = workers
+		self.max_attempts = max_attempts
+		self.digests = digests or {}
+		self.conditional = conditional
+		self.sinks = sinks or {}
+		self._active = 0
+		self._cond = threading.Condition()
+		self._stop = threading.Event()
+
+	def stop(self):
+		"""请求停止（正在处理的页面完成后退出）"""
+		self._stop.set()
+		with self._cond:
+			self._cond.notify_all()
+
+	def _next(self):
+		"""取下一个URL；队列暂时为空但仍有页面在处理时等待，全部完成时返回None"""
+		with self._cond:
+			while not self._stop.is_set():
+				item = self.frontier.claim()
+				if item is not None:
+					self._active += 1
+					return item
+				if self._active == 0:
+					self._cond.notify_all()
+					return None
+				self._cond.wait(1.0)
+			return None
+
+	def _finish(self):
+		with self._cond:
+			self._active -= 1
+			self._cond.notify_all()
+
+	def _worker(self):
+		while True:
+			item = self._next()
+			if item is None:
+				return
+			self._process(*item)
+
+	def _process(self, url, kind, meta, attempts):
+		"""处理一个页面；页面完成或失败时（可能在写入线程中）调用_finish"""
+		handler = self.handlers.get(kind)
+		if handler is None:
+			logger.error(f"未知的页面类型 {kind}: {url}")
+			self.frontier.failed(url)
+			self._finish()
+			return
+		stats = self.fetcher.stats
+		try:
+			state = self.frontier.page_state(url) if self.conditional else None
+			headers = {}
+			if state:
+				if state[0]:
+					headers['If-None-Match'] = state[0]
+				if state[1]:
+					headers['If-Modified-Since'] = state[1]
+			response = self.fetcher.fetch(url, headers=headers)
+			if response.status_code == 304:
+				stats.record_outcome('not_modified')
+				self._complete(url)
+				return
+			digest_func = self.digests.get(kind)
+			digest = digest_func(response.content) if digest_func else hashlib.sha1(response.content).hexdigest()
+			etag = response.headers.get('ETag')
+			last_modified = response.headers.get('Last-Modified')
+			if state and state[2] == digest:
+				stats.record_outcome('unchanged')
+				self._complete(url, (etag, last_modified, digest))
+				return
+			sink = self.sinks.get(kind)
+			if sink is None:
+				discovered = handler(url, meta, response) or []
+				stats.record_outcome('parsed')
+				self._complete(url, (etag, last_modified, digest), discovered)
+				return
+			with sink.group() as group:
+				discovered = handler(url, meta, response) or []
+			stats.record_outcome('parsed')
+		except Exception as e:
+			self._fail(url, attempts, e)
+			return
+		# 页面状态和新URL只在本页数据提交后记录，写入失败或进程中断时该页面会被重新抓取
+		group.close(
+			lambda: self._complete(url, (etag, last_modified, digest), discovered),
+			lambda: self._fail(url, attempts, Exception('数据写入失败'))
+		)
+
+	def _complete(self, url, page_state=None, discovered=()):
+		"""保存页面状态、加入新发现的URL并标记完成"""
+		try:
+			if page_state:
+				self.frontier.save_page_state(url, *page_state)
+			if discovered:
+				self.frontier.add_many(discovered)
+			self.frontier.done(url)
+		finally:
+			self._finish()
+
+	def _fail(self, url, attempts, error):
+		"""页面处理失败：未达到次数上限时放回队尾稍后再试"""
+		try:
+			logger.error(f"处理页面失败 {url}: {str(error)}")
+			if getattr(error, 'permanent', False) or attempts + 1 >= self.max_attempts:
+				self.frontier.failed(url)
+			else:
+				self.frontier.retry(url)
+		finally:
+			self._finish()
+
+	def run(self, report_interval=60):
+		"""
+		运行爬虫直到队列为空或被停止
+
+		参数:
+			report_interval: 打印进度报告的间隔（秒）
+
+		返回:
+			dict: 抓取统计报告
+		"""
+		threads = []
+		for i in range(self.workers):
+			thread = threading.Thread(target=self._worker, name=f'crawler-{i}', daemon=True)
+			thread.start()
+			threads.append(thread)
+		last_report = time.time()
+		try:
+			while any(thread.is_alive() for thread in threads):
+				for thread in threads:
+					thread.join(1.0)
+				if time.time() - last_report >= report_interval:
+					last_report = time.time()
+					logger.info(f"抓取进度: {self.fetcher.stats.report()} 队列: {self.frontier.counts()}")
+		except KeyboardInterrupt:
+			logger.info("收到中断信号，等待正在处理的页面完成后退出（进度已保存）")
+			self.stop()
+			for thread in threads:
+				thread.join()
+		report = self.fetcher.stats.report()
+		report['frontier'] = self.frontier.counts()
+		logger.info(f"抓取结束: {report}")
+		return report
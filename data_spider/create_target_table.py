@@ -9,15 +9,28 @@
 """
 
 import pymysql as MySQLdb
+from pymysql.cursors import SSCursor
 import datetime
 import os
 import sys
+import time
 import logging
+import argparse
+import tempfile
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from bloom import BloomFilter
+
+# MySQL唯一键冲突的错误码
+ER_DUP_ENTRY = 1062
 
 # 获取当前脚本路径
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
-LOGS_DIR = os.path.join(PROJECT_ROOT, 'logs')
+# 与web_server.logger一致，环境变量MOVIE_RECOMMENDER_LOG_DIR可指定日志目录
+LOGS_DIR = os.environ.get('MOVIE_RECOMMENDER_LOG_DIR') or os.path.join(PROJECT_ROOT, 'logs')
 
 # 确保日志目录存在
 if not os.path.exists(LOGS_DIR):
@@ -37,12 +50,217 @@ logging.basicConfig(
 )
 logger = logging.getLogger('data_processing')
 
+# 布隆过滤器参数，ETL_BLOOM_PATH非空时过滤器持久化，后续运行跳过已处理过的链接
+BLOOM_CAPACITY = int(os.environ.get("ETL_BLOOM_CAPACITY", "5000000"))
+BLOOM_ERROR_RATE = float(os.environ.get("ETL_BLOOM_ERROR_RATE", "0.0001"))
+BLOOM_PATH = os.environ.get("ETL_BLOOM_PATH", "")
+
+# 每个事务写入的行数，也是每次从源表取出的行数
+CHUNK_SIZE = int(os.environ.get("ETL_CHUNK_SIZE", "2000"))
+# 增量导入的水位表，记录每个源表已处理到的最大id
+WATERMARK_TABLE = "etl_watermark"
+
+# 批量导入时暂存TSV文件的目录
+STAGE_DIR = os.environ.get("ETL_STAGE_DIR", "") or tempfile.gettempdir()
+
+# 清洗数据的进程数，1表示在主进程中清洗
+WORKERS = int(os.environ.get("ETL_WORKERS", str(os.cpu_count() or 1)))
+# 进度日志的最短间隔（秒）
+PROGRESS_INTERVAL = 10.0
+
+
+def chunked(iterable, size):
+	"""
+	将可迭代对象按size切分为列表
+	
+	参数:
+		iterable: 可迭代对象
+		size: 每块的元素数
+	"""
+	iterator = iter(iterable)
+	while True:
+		chunk = list(islice(iterator, size))
+		if not chunk:
+			break
+		yield chunk
+
+
+def has_num(s):
+	"""
+	检查字符串是否包含数字
+	
+	参数:
+		s: 要检查的字符串
+		
+	返回:
+		bool: 是否包含数字
+	"""
+	return any(char.isdigit() for char in s)
+
+
+def normalize_row(row):
+	"""
+	清洗一行源表数据（纯函数，可在子进程中执行）
+	
+	参数:
+		row: 源表行（标题、评分、评分人数、链接、时间、主演）
+		
+	返回:
+		tuple: 与INSERT语句占位符对应的参数元组
+	"""
+	link = ''.join(row[3]).strip() if row[3] else ''
+	
+	# 处理标题
+	title = ''.join(row[0]).strip() if row[0] else ''
+	
+	# 处理评分
+	s = ''.join(row[1]).strip() if row[1] else ''
+	score = float(s) if has_num(s) else None
+	
+	# 处理评分人数
+	n = ''.join(row[2]).strip() if row[2] else ''
+	if n:
+		# 只保留数字
+		num_str = ''.join(c for c in n if c.isdigit())
+		num = int(num_str) if num_str else None
+	else:
+		num = None
+		score = None
+	
+	# 处理时间和地区信息
+	other_release = None
+	temp_time = ''.join(row[4]).strip() if row[4] else ''
+	
+	# 如果数据中含有数字，提取日期和地区
+	if has_num(temp_time):
+		time_str = ''.join(c for c in temp_time if c.isdigit() or c == '-')
+		address = ''.join(c for c in temp_time if not (c.isdigit() or c in '()-'))
+	else:
+		time_str = None
+		if '()' in temp_time:
+			address = ''.join(c for c in temp_time if c not in '()')
+		else:
+			address = None
+			other_release = temp_time
+	
+	# 处理演员信息
+	actor_str = row[5] if len(row) > 5 else ''
+	if actor_str:
+		# 将字符串转换为列表
+		actors = actor_str.replace(']', '').replace('[', '').replace("'", "").split(",")
+		actors = [element.strip() for element in actors]
+		
+		# 含数字的部分（年份、片长等）按原顺序追加到other_release
+		extra = [element for element in actors if has_num(element)]
+		if extra:
+			other_release = ';'.join(([other_release] if other_release else []) + extra)
+		
+		actor = ','.join(element for element in actors if not has_num(element))
+	else:
+		actor = ''
+	
+	return (title, score, num, link, time_str, address, other_release, actor)
+
+
+def normalize_chunk(rows):
+	"""清洗一块数据，保持原有顺序"""
+	return [normalize_row(row) for row in rows]
+
+
+def normalize_keyed_chunk(rows):
+	"""
+	清洗一块带id的源表数据（增量导入用），跳过没有链接的行
+	
+	参数:
+		rows: 源表行（标题、评分、评分人数、链接、时间、主演、id），按id升序
+		
+	返回:
+		tuple: (本块最大id, 本块行数, 参数元组列表, 各参数元组对应的源表id)
+	"""
+	kept = [row for row in rows if row[3] and row[3].strip()]
+	return rows[-1][6], len(rows), [normalize_row(row) for row in kept], [row[6] for row in kept]
+
+
+def tsv_field(value):
+	"""
+	按LOAD DATA默认格式转义一个字段（制表符分隔，反斜杠转义，NULL写作\\N）
+	
+	参数:
+		value: 字段值
+		
+	返回:
+		str: 转义后的文本
+	"""
+	if value is None:
+		return '\\N'
+	return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+		.replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def ordered_map(executor, fn, iterable, prefetch):
+	"""
+	按输入顺序返回executor中fn的结果，最多同时提交prefetch个任务
+	（Executor.map会一次性提交全部输入，流式导入时内存会无限增长）
+	
+	参数:
+		executor: 进程池
+		fn: 可序列化的函数
+		iterable: 输入
+		prefetch: 同时在执行或排队的任务数
+	"""
+	pending = deque()
+	for item in iterable:
+		pending.append(executor.submit(fn, item))
+		if len(pending) >= prefetch:
+			yield pending.popleft().result()
+	while pending:
+		yield pending.popleft().result()
+
+
+class ImportProgress(object):
+	"""导入进度与吞吐量统计"""
+	
+	def __init__(self, interval=PROGRESS_INTERVAL):
+		"""
+		初始化统计
+		
+		参数:
+			interval: 进度日志的最短间隔（秒）
+		"""
+		self.interval = interval
+		self.started = time.time()
+		self._last_report = self.started
+		self.read = 0
+		self.skipped = 0
+		self.written = 0
+		self.failed = 0
+	
+	def summary(self):
+		"""
+		统计摘要
+		
+		返回:
+			str: 读取、跳过、写入、失败行数及每秒写入行数
+		"""
+		elapsed = time.time() - self.started
+		rate = self.written / elapsed if elapsed else 0.0
+		return (f"读取 {self.read} 行，重复或无链接跳过 {self.skipped} 行，写入 {self.written} 行，"
+			f"失败 {self.failed} 行，用时 {elapsed:.1f} 秒（{rate:.0f} 行/秒）")
+	
+	def report(self, force=False):
+		"""距上次输出超过interval秒时输出进度"""
+		now = time.time()
+		if force or now - self._last_report >= self.interval:
+			self._last_report = now
+			logger.info(f"导入进度: {self.summary()}")
+
 class DataHandle(object):
 	"""数据处理类，用于创建表和导入数据"""
 	
 	def __init__(self):
 		"""初始化数据处理类"""
-		pass
+		# 最近一次init_connection的参数，用于建立流式读取连接
+		self.conn_params = {}
 	
 	def init_connection(self, host='127.0.0.1', user='root', passwd='', db=''):
 		"""
@@ -65,6 +283,7 @@ class DataHandle(object):
 				db=db,
 				charset='utf8mb4'
 			)
+			self.conn_params = {'host': host, 'user': user, 'passwd': passwd, 'db': db}
 			logger.info(f"成功连接到数据库 {db}")
 			return conn
 		except Exception as e:
@@ -120,7 +339,8 @@ class DataHandle(object):
 					actors VARCHAR(1000),
 					director VARCHAR(100),
 					category VARCHAR(100),
-					PRIMARY KEY(id)
+					PRIMARY KEY(id),
+					UNIQUE KEY idx_link(link)
 				) DEFAULT CHARSET=utf8mb4;
 				""" % tablename
 				
@@ -136,134 +356,474 @@ class DataHandle(object):
 		finally:
 			cur.close()
 	
-	def data_insert(self, conn, table, oldtable):
+	def data_insert(self, conn, table, oldtable, seen=None, chunk_size=CHUNK_SIZE, workers=WORKERS):
 		"""
 		从旧表导入数据到新表
+		用服务端游标流式读取源表，去重后按chunk_size分块在进程池中清洗，
+		再按块executemany写入，一块一个事务
 		
 		参数:
-			conn: 数据库连接
+			conn: 数据库连接（用于写入）
 			table: 目标表名
 			oldtable: 源表名
+			seen: 以前的导入中已写入链接的布隆过滤器（只加入本次已提交的行），可为None
+			chunk_size: 每个事务写入的行数
+			workers: 清洗数据的进程数
+			
+		返回:
+			ImportProgress: 导入统计，连接失败时为None
 		"""
 		if conn == -1:
 			logger.error("无效的数据库连接")
-			return
-			
+			return None
+		
+		# 流式读取要占用整个连接直到读完，因此读写使用不同的连接
+		read_conn = self.open_stream_connection()
+		if read_conn == -1:
+			self.close_db(conn)
+			return None
+		
 		cur = conn.cursor()
+		read_cur = read_conn.cursor()
+		insert_sql = """
+			INSERT INTO {} 
+			(title, score, num, link, time, address, other_release, actors) 
+			VALUES (%s, %s, %s, %s, STR_TO_DATE(%s, '%%Y-%%m-%%d'), %s, %s, %s);
+			""".format(table)
+		# 本次读到的链接，用于源表内去重（布隆过滤器内存占用固定，可能极少量误判为重复）
+		links_seen = BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+		progress = ImportProgress()
 		try:
 			# 设置字符集
 			cur.execute("SET NAMES utf8mb4")
+			read_cur.execute(f"SELECT title, score, num, link, time, actors FROM {oldtable}")
 			
-			i = 0
-			limit = 1
-			links_seen = set()  # 用于去重
-			processed_count = 0
+			rows = self.unique_rows(self.stream_rows(read_cur, chunk_size), links_seen, progress, seen)
+			for chunk in self.normalized_chunks(chunked(rows, chunk_size), workers):
+				written = self.write_chunk(conn, cur, insert_sql, chunk, progress)
+				# 只有已提交的行才记入持久过滤器，写入失败的电影下次导入时重试
+				if seen is not None:
+					for row in written:
+						seen.add(row[3])
+				progress.report()
 			
-			# 逐条处理数据
-			while True:
-				# 从源表查询数据
-				query = f"SELECT * FROM {oldtable} LIMIT {i}, {limit};"
-				cur.execute(query)
-				row = cur.fetchall()
-				i += 1
-				
-				# 无数据时结束循环
-				if not row:
-					break
-				
-				# 获取电影链接并去重
-				link = ''.join(row[0][3]).strip() if row[0][3] else ''
+			logger.info(f"数据导入完成: {progress.summary()}")
 			
-				if not link or link in links_seen:
-					continue
-					
-				links_seen.add(link)
-			
-				# 处理标题
-				title = ''.join(row[0][0]).strip() if row[0][0] else ''
-				
-				# 处理评分
-				s = ''.join(row[0][1]).strip() if row[0][1] else ''
-				score = float(s) if self.has_num(s) else None
+		except Exception as e:
+			logger.error(f"数据处理过程中发生错误: {str(e)}")
+		finally:
+			read_cur.close()
+			self.close_db(read_conn)
+			if cur:
+				cur.close()
+				logger.info("数据库游标已关闭")
+			self.close_db(conn)
+		return progress
+
+	def open_stream_connection(self):
+		"""
+		按init_connection的参数再建一个使用服务端游标（SSCursor）的连接
+		
+		返回:
+			MySQLdb.Connection: 数据库连接对象，或-1表示连接失败
+		"""
+		try:
+			return MySQLdb.connect(cursorclass=SSCursor, charset='utf8mb4', **self.conn_params)
+		except Exception as e:
+			logger.error(f"建立流式读取连接失败: {str(e)}")
+			return -1
+
+	def stream_rows(self, cursor, chunk_size):
+		"""
+		逐块从服务端游标取出源表数据
+		
+		参数:
+			cursor: 已执行查询的SSCursor
+			chunk_size: 每次取出的行数
+		"""
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if not rows:
+				break
+			for row in rows:
+				yield row
+
+	def unique_rows(self, rows, links_seen, progress, committed=None):
+		"""
+		按电影链接去重（布隆过滤器只在主进程中维护）
+		
+		参数:
+			rows: 源表行（标题、评分、评分人数、链接、时间、主演）
+			links_seen: 本次已读到链接的布隆过滤器
+			progress: ImportProgress对象
+			committed: 以前已写入链接的布隆过滤器（只查询，不在此加入）
+		"""
+		for row in rows:
+			progress.read += 1
+			link = ''.join(row[3]).strip() if row[3] else ''
+			if not link or (committed is not None and link in committed) or not links_seen.add(link):
+				progress.skipped += 1
+				continue
+			yield row
+
+	def normalized_chunks(self, chunks, workers, fn=normalize_chunk):
+		"""
+		清洗各块数据，workers大于1时在进程池中并行执行，输出顺序与输入一致
+		
+		参数:
+			chunks: 源表行列表的可迭代对象
+			workers: 进程数
+			fn: 清洗一块数据的模块级函数
+		"""
+		if workers <= 1:
+			for chunk in chunks:
+				yield fn(chunk)
+			return
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			for chunk in ordered_map(executor, fn, chunks, workers * 2):
+				yield chunk
+
+	def write_chunk(self, conn, cur, insert_sql, chunk, progress, watermark=None, row_ids=None):
+		"""
+		在一个事务中写入一批数据，整批失败时逐行重试以找出问题行
+		
+		参数:
+			conn: 数据库连接
+			cur: conn的游标
+			insert_sql: 单行INSERT语句
+			chunk: 参数元组列表
+			progress: ImportProgress对象
+			watermark: (源表名, 本块最大id)，与数据在同一事务中更新水位
+			row_ids: 各行对应的源表id；逐行写入有失败时水位只推进到第一个失败行之前（未指定时不推进）
 			
-				# 处理评分人数
-				n = ''.join(row[0][2]).strip() if row[0][2] else ''
-				if n:
-					# 只保留数字
-					num_str = ''.join(c for c in n if c.isdigit())
-					num = int(num_str) if num_str else None
+		返回:
+			list: 已在表中的行（本次提交的，以及因链接重复而已存在的）
+		"""
+		try:
+			if chunk:
+				cur.executemany(insert_sql, chunk)
+			if watermark:
+				self.save_watermark(cur, *watermark)
+			conn.commit()
+			progress.written += len(chunk)
+			return chunk
+		except Exception as e:
+			conn.rollback()
+			logger.warning(f"批量写入 {len(chunk)} 行失败，改为逐行写入: {str(e)}")
+		
+		written = []
+		first_failed = None
+		for index, row in enumerate(chunk):
+			try:
+				cur.execute(insert_sql, row)
+				conn.commit()
+				progress.written += 1
+				written.append(row)
+			except MySQLdb.IntegrityError as e:
+				conn.rollback()
+				if e.args and e.args[0] == ER_DUP_ENTRY:
+					# 以前的导入已写入该电影（过滤器未保存时会再次读到）
+					progress.skipped += 1
+					written.append(row)
 				else:
-					num = None
-					score = None
+					progress.failed += 1
+					first_failed = index if first_failed is None else first_failed
+					logger.error(f"插入数据失败 {row[3]}: {str(e)}")
+			except Exception as e:
+				conn.rollback()
+				progress.failed += 1
+				first_failed = index if first_failed is None else first_failed
+				logger.error(f"插入数据失败 {row[3]}: {str(e)}")
+		if watermark:
+			source, last_id = watermark
+			if first_failed is not None:
+				# 失败的行（如锁等待超时）留给下次增量导入重试
+				last_id = row_ids[first_failed] - 1 if row_ids else None
+			if last_id is not None:
+				self.save_watermark(cur, source, last_id)
+				conn.commit()
+		return written
 
-				# 处理时间和地区信息
-				other_release = None
-				temp_time = ''.join(row[0][4]).strip() if row[0][4] else ''
-				
-				# 如果数据中含有数字，提取日期和地区
-				if self.has_num(temp_time):
-					time_str = ''.join(c for c in temp_time if c.isdigit() or c == '-')
-					address = ''.join(c for c in temp_time if not (c.isdigit() or c in '()-'))
-				else:
-					time_str = None
-					if '()' in temp_time:
-						address = ''.join(c for c in temp_time if c not in '()')
-					else:
-						address = None
-						other_release = temp_time
+	def data_upsert(self, conn, table, oldtable, chunk_size=CHUNK_SIZE, workers=WORKERS):
+		"""
+		增量导入：只处理源表中id大于水位的行，按链接（idx_link）插入新电影或更新已有电影的评分和评分人数
+		水位与每块数据在同一事务中提交，中断后重新运行从上次提交处继续，重复处理的行结果相同
+		
+		参数:
+			conn: 数据库连接（用于写入）
+			table: 目标表名
+			oldtable: 源表名
+			chunk_size: 每个事务写入的行数
+			workers: 清洗数据的进程数
+		"""
+		if conn == -1:
+			logger.error("无效的数据库连接")
+			return
+		
+		read_conn = self.open_stream_connection()
+		if read_conn == -1:
+			self.close_db(conn)
+			return
+		
+		cur = conn.cursor()
+		read_cur = read_conn.cursor()
+		upsert_sql = """
+			INSERT INTO {} 
+			(title, score, num, link, time, address, other_release, actors) 
+			VALUES (%s, %s, %s, %s, STR_TO_DATE(%s, '%%Y-%%m-%%d'), %s, %s, %s)
+			ON DUPLICATE KEY UPDATE score = VALUES(score), num = VALUES(num);
+			""".format(table)
+		progress = ImportProgress()
+		try:
+			cur.execute("SET NAMES utf8mb4")
+			self.ensure_source_key(cur, oldtable)
+			self.ensure_link_key(cur, table)
+			self.ensure_watermark_table(cur)
+			conn.commit()
 			
-				# 处理演员信息
-				actor_str = row[0][5] if len(row[0]) > 5 else ''
-				if actor_str:
-					# 将字符串转换为列表
-					actors = actor_str.replace(']', '').replace('[', '').replace("'", "").split(",")
-					actors = [element.strip() for element in actors]
-					
-					# 提取数字信息到other_release
-					for element in list(actors):  # 使用列表副本进行迭代
-						if self.has_num(element):
-							if other_release:
-								other_release = other_release + ';' + element
-							else:
-								other_release = element
-							actors.remove(element)
+			last_id = self.load_watermark(cur, oldtable)
+			logger.info(f"从水位 {oldtable}.id > {last_id} 开始增量导入")
+			read_cur.execute(
+				f"SELECT title, score, num, link, time, actors, id FROM {oldtable} WHERE id > %s ORDER BY id",
+				(last_id,)
+			)
 			
-					actor = ','.join(actors)
-				else:
-					actor = ''
-				
-				# 插入数据到新表
-				try:
-					insert_sql = """
-					INSERT INTO {} 
-					(title, score, num, link, time, address, other_release, actors) 
-					VALUES (%s, %s, %s, %s, STR_TO_DATE(%s, '%%Y-%%m-%%d'), %s, %s, %s);
-					""".format(table)
-					
-					cur.execute(insert_sql, (
-						title, score, num, link, time_str, 
-						address, other_release, actor
-					))
-					conn.commit()
-					processed_count += 1
-					
-					if processed_count % 100 == 0:
-						logger.info(f"已处理 {processed_count} 条记录")
-						
-				except Exception as e:
-					logger.error(f"插入数据失败: {str(e)}")
-					conn.rollback()
+			chunks = chunked(self.stream_rows(read_cur, chunk_size), chunk_size)
+			for last_id, count, chunk, row_ids in self.normalized_chunks(chunks, workers, normalize_keyed_chunk):
+				progress.read += count
+				progress.skipped += count - len(chunk)
+				# 有行写入失败后水位停在第一个失败行之前，之后的块照常写入但不再推进水位（重复处理结果相同）
+				watermark = (oldtable, last_id) if not progress.failed else None
+				self.write_chunk(conn, cur, upsert_sql, chunk, progress, watermark, row_ids)
+				progress.report()
 			
-			logger.info(f"数据导入完成，共处理 {processed_count} 条记录")
+			if progress.failed:
+				logger.warning(f"增量导入完成，{progress.failed} 行写入失败，水位停在第一个失败行之前，下次运行时重试: {progress.summary()}")
+			else:
+				logger.info(f"增量导入完成，水位 {last_id}: {progress.summary()}")
 			
 		except Exception as e:
-			logger.error(f"数据处理过程中发生错误: {str(e)}")
+			logger.error(f"增量导入过程中发生错误: {str(e)}")
 		finally:
-			if cur:
-				cur.close()
-				logger.info("数据库游标已关闭")
+			read_cur.close()
+			self.close_db(read_conn)
+			cur.close()
+			self.close_db(conn)
+
+	def data_bulk_load(self, conn, table, oldtable, chunk_size=CHUNK_SIZE, workers=WORKERS):
+		"""
+		批量导入（首次导入或全量重建）：清洗后的数据流式写入暂存TSV文件，
+		用LOAD DATA LOCAL INFILE载入影子表，载入后再建唯一索引，最后用RENAME TABLE原子替换目标表，
+		服务在切换前后看到的都是完整的电影表
+		已有电影沿用原来的id、导演和类型，seek_movie和like_movie中的movie_id仍然有效；
+		从复制导演和类型到替换完成期间锁住两张表（LOCK TABLES），其间enrich.py回写和增量导入的写入等待切换后写入新表
+		
+		参数:
+			conn: 数据库连接（用于建表和切换）
+			table: 目标表名（需已存在，由create_table创建）
+			oldtable: 源表名
+			chunk_size: 每块清洗的行数
+			workers: 清洗数据的进程数
+		"""
+		if conn == -1:
+			logger.error("无效的数据库连接")
+			return
+		
+		shadow = f"{table}_shadow"
+		retired = f"{table}_old"
+		cur = conn.cursor()
+		stage_path = None
+		progress = ImportProgress()
+		try:
+			cur.execute("SET NAMES utf8mb4")
+			cur.execute(f"SHOW COLUMNS FROM {oldtable} LIKE 'id'")
+			source_max_id = None
+			if cur.fetchall():
+				cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {oldtable}")
+				source_max_id = cur.fetchone()[0]
+			
+			stage_path = self.stage_rows(oldtable, chunk_size, workers, progress)
+			if stage_path is None:
+				return
+			logger.info(f"暂存文件已写好: {progress.summary()}")
+			
+			# 影子表与目标表结构相同，但先去掉唯一索引，载入完成后再建
+			cur.execute(f"DROP TABLE IF EXISTS {shadow}")
+			cur.execute(f"CREATE TABLE {shadow} LIKE {table}")
+			cur.execute(f"ALTER TABLE {shadow} DROP INDEX idx_link")
+			# 新电影的id排在已有id之后，之后用已有id覆盖时不会冲突
+			cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+			cur.execute(f"ALTER TABLE {shadow} AUTO_INCREMENT = {int(cur.fetchone()[0])}")
+			
+			started = time.time()
+			loaded = self.load_stage(stage_path, shadow)
+			logger.info(f"已载入影子表 {shadow} {loaded} 行，用时 {time.time() - started:.1f} 秒")
+			
+			started = time.time()
+			cur.execute(f"ALTER TABLE {shadow} ADD UNIQUE KEY idx_link(link)")
+			cur.execute(f"DROP TABLE IF EXISTS {retired}")
+			logger.info(f"已建立索引，用时 {time.time() - started:.1f} 秒")
+			
+			# 锁内复制已有电影的id、导演和类型并替换（RENAME需要MySQL 8.0.13+），之后提交的写入不会丢失；
+			# LOCK TABLES下语句中的表名须与加锁时一致，UPDATE不使用别名
+			started = time.time()
+			cur.execute(f"LOCK TABLES {table} WRITE, {shadow} WRITE")
+			try:
+				cur.execute(f"""
+					UPDATE {shadow} JOIN {table} ON {shadow}.link = {table}.link
+					SET {shadow}.id = {table}.id, {shadow}.director = {table}.director, {shadow}.category = {table}.category
+					""")
+				conn.commit()
+				cur.execute(f"RENAME TABLE {table} TO {retired}, {shadow} TO {table}")
+			finally:
+				cur.execute("UNLOCK TABLES")
+			cur.execute(f"DROP TABLE {retired}")
+			logger.info(f"已沿用已有电影的id并用 {shadow} 替换 {table}，写入阻塞 {time.time() - started:.1f} 秒")
+			
+			# 之后的增量导入从本次读取的位置继续
+			if source_max_id is not None:
+				self.ensure_watermark_table(cur)
+				self.save_watermark(cur, oldtable, source_max_id)
+				conn.commit()
+			
+		except Exception as e:
+			conn.rollback()
+			logger.error(f"批量导入过程中发生错误，{table} 未被替换: {str(e)}")
+		finally:
+			if stage_path and os.path.exists(stage_path):
+				os.remove(stage_path)
+			cur.close()
 			self.close_db(conn)
 
+	def stage_rows(self, oldtable, chunk_size, workers, progress):
+		"""
+		流式读取源表，去重清洗后写入暂存TSV文件
+		
+		参数:
+			oldtable: 源表名
+			chunk_size: 每块清洗的行数
+			workers: 清洗数据的进程数
+			progress: ImportProgress对象
+			
+		返回:
+			str: 暂存文件路径，失败时为None
+		"""
+		read_conn = self.open_stream_connection()
+		if read_conn == -1:
+			return None
+		read_cur = read_conn.cursor()
+		fd, stage_path = tempfile.mkstemp(prefix=f"{oldtable}_", suffix='.tsv', dir=STAGE_DIR)
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+				read_cur.execute(f"SELECT title, score, num, link, time, actors FROM {oldtable}")
+				rows = self.unique_rows(self.stream_rows(read_cur, chunk_size),
+					BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE), progress)
+				for chunk in self.normalized_chunks(chunked(rows, chunk_size), workers):
+					f.writelines('\t'.join(tsv_field(v) for v in row) + '\n' for row in chunk)
+					progress.written += len(chunk)
+					progress.report()
+		except Exception:
+			os.remove(stage_path)
+			raise
+		finally:
+			read_cur.close()
+			self.close_db(read_conn)
+		return stage_path
+
+	def load_stage(self, stage_path, table):
+		"""
+		用LOAD DATA LOCAL INFILE把暂存文件载入表中（需要服务端开启local_infile）
+		
+		参数:
+			stage_path: 暂存文件路径
+			table: 表名
+			
+		返回:
+			int: 载入的行数
+		"""
+		conn = MySQLdb.connect(charset='utf8mb4', local_infile=True, **self.conn_params)
+		cur = conn.cursor()
+		try:
+			loaded = cur.execute(
+				f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+				"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+				"(title, score, num, link, @time, address, other_release, actors) "
+				"SET time = STR_TO_DATE(@time, '%%Y-%%m-%%d')",
+				(stage_path,)
+			)
+			conn.commit()
+			return loaded
+		finally:
+			cur.close()
+			conn.close()
+
+	def ensure_source_key(self, cur, oldtable):
+		"""
+		源表（爬虫写入，没有主键）缺少id列时添加自增id，已有行按存储顺序编号，之后写入的行id递增
+		
+		参数:
+			cur: 数据库游标
+			oldtable: 源表名
+		"""
+		cur.execute(f"SHOW COLUMNS FROM {oldtable} LIKE 'id'")
+		if not cur.fetchall():
+			cur.execute(f"ALTER TABLE {oldtable} ADD COLUMN id INT UNSIGNED NOT NULL AUTO_INCREMENT, ADD UNIQUE KEY idx_id(id)")
+			logger.info(f"已为源表 {oldtable} 添加自增id列")
+
+	def ensure_link_key(self, cur, table):
+		"""
+		确保目标表有链接唯一索引idx_link（按链接更新依赖它；表中已有重复链接时添加会失败）
+		
+		参数:
+			cur: 数据库游标
+			table: 目标表名
+		"""
+		cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name = 'idx_link'")
+		if not cur.fetchall():
+			cur.execute(f"ALTER TABLE {table} ADD UNIQUE KEY idx_link(link)")
+			logger.info(f"已为表 {table} 添加唯一索引 idx_link")
+
+	def ensure_watermark_table(self, cur):
+		"""创建水位表（与sql/init_tables.sql中的定义一致）"""
+		cur.execute(f"""
+			CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+				source VARCHAR(64) NOT NULL,
+				last_id BIGINT UNSIGNED NOT NULL DEFAULT 0,
+				updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+				PRIMARY KEY(source)
+			) DEFAULT CHARSET=utf8mb4;
+			""")
+
+	def load_watermark(self, cur, source):
+		"""
+		读取源表的水位
+		
+		参数:
+			cur: 数据库游标
+			source: 源表名
+			
+		返回:
+			int: 已处理到的最大id，没有记录时为0
+		"""
+		cur.execute(f"SELECT last_id FROM {WATERMARK_TABLE} WHERE source = %s", (source,))
+		row = cur.fetchone()
+		return int(row[0]) if row else 0
+
+	def save_watermark(self, cur, source, last_id):
+		"""
+		更新源表的水位（不提交，由调用方与数据一起提交）
+		
+		参数:
+			cur: 数据库游标
+			source: 源表名
+			last_id: 已处理到的最大id
+		"""
+		cur.execute(
+			f"INSERT INTO {WATERMARK_TABLE} (source, last_id) VALUES (%s, %s) "
+			f"ON DUPLICATE KEY UPDATE last_id = GREATEST(last_id, VALUES(last_id))",
+			(source, last_id)
+		)
+
 	def has_num(self, s):
 		"""
 		检查字符串是否包含数字
@@ -274,10 +834,18 @@ class DataHandle(object):
 		返回:
 			bool: 是否包含数字
 		"""
-		return any(char.isdigit() for char in s)
+		return has_num(s)
 
 def main():
 	"""主函数"""
+	parser = argparse.ArgumentParser(description='将爬虫数据清洗后导入电影表')
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument('--incremental', action='store_true',
+		help='增量导入：只处理上次导入之后新增的行，并更新已有电影的评分和评分人数')
+	mode.add_argument('--bulk', action='store_true',
+		help='批量导入：经暂存文件LOAD DATA载入影子表后原子替换电影表（用于首次导入或全量重建）')
+	args = parser.parse_args()
+	
 	# 初始化数据处理对象
 	data = DataHandle()
 	
@@ -299,7 +867,20 @@ def main():
 		data.create_table(conn, table)
 		
 		# 导入数据
-		data.data_insert(conn, table, old_table)
+		if args.incremental:
+			data.data_upsert(conn, table, old_table)
+			return
+		if args.bulk:
+			data.data_bulk_load(conn, table, old_table)
+			return
+		seen = BloomFilter.open(BLOOM_PATH, BLOOM_CAPACITY, BLOOM_ERROR_RATE) if BLOOM_PATH else None
+		progress = data.data_insert(conn, table, old_table, seen)
+		if seen is not None and progress is not None:
+			if progress.failed:
+				# 有失败行时不保存，下次导入重新检查本次读到的全部链接（已写入的按重复跳过）
+				logger.warning(f"有 {progress.failed} 行写入失败，未保存布隆过滤器 {BLOOM_PATH}")
+			else:
+				seen.save(BLOOM_PATH)
 	else:
 		logger.error("无法连接到数据库，程序终止")
 		sys.exit(1)
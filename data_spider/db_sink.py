@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量入库模块
+缓存解析出的数据行，按数量或时间阈值用executemany分批写入，一批一个事务；
+同一页面的数据行可归为一组（RowGroup），组内所有行提交后再执行后续动作（如标记页面完成）
+作者：电影推荐系统团队
+日期：2025-06-24
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('db_sink')
+
+
+class RowGroup(object):
+	"""一组数据行（通常来自同一页面）：全部提交后执行on_commit，任一行所在批次失败则执行on_failure"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._pending = 0
+		self._failed = False
+		self._deferred = []
+		self._callbacks = None
+
+	def defer(self, action):
+		"""
+		登记一个只在组内全部行提交后执行的动作（批次失败时丢弃）
+
+		参数:
+			action: 无参函数
+		"""
+		with self._lock:
+			self._deferred.append(action)
+
+	def close(self, on_commit, on_failure):
+		"""
+		组内不再加入新行，登记回调（没有待写入的行时立即执行）
+
+		参数:
+			on_commit: 全部行提交后调用（在执行写入的线程中）
+			on_failure: 有行写入失败时调用
+		"""
+		with self._lock:
+			self._callbacks = (on_commit, on_failure)
+			callbacks = self._take_callbacks()
+		self._fire(callbacks)
+
+	def _add(self):
+		with self._lock:
+			self._pending += 1
+
+	def _settle(self, ok):
+		with self._lock:
+			self._pending -= 1
+			self._failed = self._failed or not ok
+			callbacks = self._take_callbacks()
+		self._fire(callbacks)
+
+	def _take_callbacks(self):
+		"""已关闭且没有待写入的行时取出回调（只取一次）"""
+		if self._callbacks is None or self._pending:
+			return None
+		callbacks, self._callbacks = self._callbacks, None
+		return callbacks
+
+	def _fire(self, callbacks):
+		if callbacks is None:
+			return
+		on_commit, on_failure = callbacks
+		try:
+			if self._failed:
+				on_failure()
+				return
+			for action in self._deferred:
+				action()
+			on_commit()
+		except Exception as e:
+			logger.error(f"数据行提交后的回调失败: {str(e)}")
+
+
+class BatchSink(object):
+	"""线程安全的批量写入器"""
+
+	def __init__(self, conn, sql, batch_size=500, flush_interval=5.0, on_written=None):
+		"""
+		初始化批量写入器
+
+		参数:
+			conn: 数据库连接（只由写入器使用）
+			sql: 单行的INSERT语句（executemany参数化形式）
+			batch_size: 每个事务写入的行数，缓存达到该数量时写入
+			flush_interval: 距上次写入超过该秒数时写入（由后台线程检查）
+			on_written: 若指定，批内逐行执行，提交后对每行调用 on_written(row, 影响行数)
+		"""
+		self.conn = conn
+		self.sql = sql
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.on_written = on_written
+		self._rows = []
+		self._groups = []
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._write_lock = threading.Lock()
+		self._last_flush = time.monotonic()
+		self._closed = threading.Event()
+		self.started = time.time()
+		self.rows_written = 0
+		self.rows_failed = 0
+		self.batches = 0
+		self._timer = threading.Thread(target=self._flush_periodically, name='db-sink-flush', daemon=True)
+		self._timer.start()
+
+	@contextmanager
+	def group(self):
+		"""
+		在with块内由当前线程加入的行归入同一个RowGroup
+
+		返回:
+			RowGroup: 行组，with块结束后调用其close登记回调
+		"""
+		group = RowGroup()
+		previous = getattr(self._local, 'group', None)
+		self._local.group = group
+		try:
+			yield group
+		finally:
+			self._local.group = previous
+
+	def current_group(self):
+		"""当前线程所在的行组，不在group()块内时为None"""
+		return getattr(self._local, 'group', None)
+
+	def add(self, row):
+		"""
+		加入一行数据，缓存满时在调用线程中写入
+
+		参数:
+			row: 与sql占位符对应的参数元组
+		"""
+		group = self.current_group()
+		if group is not None:
+			group._add()
+		with self._lock:
+			self._rows.append(row)
+			self._groups.append(group)
+			if len(self._rows) < self.batch_size:
+				return
+			rows, self._rows = self._rows, []
+			groups, self._groups = self._groups, []
+		self._write(rows, groups)
+
+	def flush(self):
+		"""立即写入所有缓存的数据"""
+		with self._lock:
+			rows, self._rows = self._rows, []
+			groups, self._groups = self._groups, []
+		if rows:
+			self._write(rows, groups)
+
+	def _flush_periodically(self):
+		while not self._closed.wait(min(1.0, self.flush_interval)):
+			if time.monotonic() - self._last_flush >= self.flush_interval:
+				self.flush()
+
+	def _write(self, rows, groups):
+		"""在一个事务中写入一批数据，提交或回滚后结算各行所属的行组"""
+		with self._write_lock:
+			cursor = self.conn.cursor()
+			ok = False
+			affected = None
+			try:
+				if self.on_written:
+					affected = []
+					for row in rows:
+						cursor.execute(self.sql, row)
+						affected.append(cursor.rowcount)
+				else:
+					cursor.executemany(self.sql, rows)
+				self.conn.commit()
+				self.rows_written += len(rows)
+				self.batches += 1
+				ok = True
+			except Exception as e:
+				self.conn.rollback()
+				self.rows_failed += len(rows)
+				logger.error(f"批量写入 {len(rows)} 行失败: {str(e)}")
+			finally:
+				cursor.close()
+				self._last_flush = time.monotonic()
+			if affected is not None and ok:
+				for row, count in zip(rows, affected):
+					try:
+						self.on_written(row, count)
+					except Exception as e:
+						logger.error(f"写入回调失败: {str(e)}")
+			for group in groups:
+				if group is not None:
+					group._settle(ok)
+
+	def close(self):
+		"""写入剩余数据并停止后台线程"""
+		self._closed.set()
+		self._timer.join()
+		self.flush()
+		logger.info(f"批量写入结束: {self.report()}")
+
+	def report(self):
+		"""
+		写入统计
+
+		返回:
+			dict: 写入行数、失败行数、批次数、每秒行数
+		"""
+		elapsed = time.time() - self.started
+		return {
+			'rows_written': self.rows_written,
+			'rows_failed': self.rows_failed,
+			'batches': self.batches,
+			'rows_per_sec': round(self.rows_written / elapsed, 1) if elapsed else 0.0,
+		}
@@ -4,9 +4,28 @@
 import urllib.request
 import requests
 from lxml import etree
+import os
 import time
 import random
+import argparse
+import hashlib
+import logging
+import threading
 import pymysql
+from pymysql.constants import CLIENT
+
+from crawler import Frontier, HostRateLimiter, CrawlStats, Fetcher, Crawler, DEFAULT_STATE_PATH
+from db_sink import BatchSink
+from bloom import BloomFilter
+from enrich import parse_detail, make_detail_handler, UPDATE_SQL
+
+# 已抓取详情页的电影链接（布隆过滤器）
+DETAIL_BLOOM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'detail_seen.bloom')
+
+# 豆瓣站点地址，测试时可指向本地替身服务器
+DOUBAN_BASE = 'https://movie.douban.com'
+
+logger = logging.getLogger('douban')
 '''
 获取所有主题下的全部链接地址
 获取每个主题下有多少页内容  (没有输入，输出字典)
@@ -45,15 +64,33 @@ tag = urllib.request.quote(u'爱情')
 url_1 = 'https://movie.douban.com/tag/{}?start=0&type=T'.format(tag)
 
 class douban(object):
-	def __init__(self,*args,**kwargs):
+	def __init__(self, batch_size=500, flush_interval=5.0, *args, **kwargs):
 		self.conn = pymysql.connect(host='localhost', port=3306, user='root', password='186386', db='douban', charset='utf8')
-		self.cursor = self.conn.cursor()
-		self.sql_info = "INSERT IGNORE INTO `douban_mov` VALUES(%s,%s,%s,%s,%s,%s)"
+		self.sql_info = "INSERT IGNORE INTO `douban_mov`(title, score, num, link, time, actors) VALUES(%s,%s,%s,%s,%s,%s)"
+		# 解析结果先缓存，按批写入（多个抓取线程共用）
+		self.sink = BatchSink(self.conn, self.sql_info, batch_size=batch_size, flush_interval=flush_interval)
+
+	def close(self):
+		'''
+		写入剩余数据并关闭连接
+		'''
+		self.sink.close()
+		self.conn.close()
+		return self.sink.report()
 
 	def search(self,content):
 		'''
 		爬取页面内电影信息
 		'''
+		for row in self.parse(content):
+			self.sink.add(row)
+
+	def parse(self,content):
+		'''
+		解析页面内电影信息，返回 [(电影名, 评分, 评价人数, 详情链接, 上映时间, 主演), ...]
+		'''
+		rows = []
+		textslist = []
 		try:
 			selector = etree.HTML(content)
 			textslist = selector.xpath('//div[contains(@class,"grid-16-8 clearfix")]/div[1]/div[2]/table')
@@ -90,67 +127,189 @@ class douban(object):
 						lists = u' '
 
 					print(lists)
-					try:
-						self.cursor.execute(self.sql_info,(str(lists['电影名']),str(lists['评分']),str(lists['评价人数']),str(lists['详情链接']), str(lists['上映时间']),str(lists['主演'])))
-						self.conn.commit()
-					except Exception as e:
-						print(e)
+					rows.append((str(lists['电影名']),str(lists['评分']),str(lists['评价人数']),str(lists['详情链接']), str(lists['上映时间']),str(lists['主演'])))
 		except Exception as e:
 			pass
+		return rows
 
 	#从列表页中找到每部电影链接，进去抓详情
 	def get_detail(self,url):
 		'''
 		抓取每页详细信息
 		'''
+		detail = []
 		try:
 			detail_contents = requests.get(url)
-			detail_contents =detail_contents.content.decode('utf-8')
-			selector = etree.HTML(detail_contents)
-		except Exception as e:
-			print(e)
-			detail = []
-		try:
-			detail_director = selector.xpath('//*[@id="info"]/span[1]/span[2]/a/text()')   # 导演
-			detail_time = selector.xpath('//span[contains(@property,"v:runtime")]/text()')   # 片长
-			detail_type_1 = selector.xpath('//*[@id="info"]/span[5]/text()')   # 类型
-			detail_type_2 = selector.xpath('//*[@id="info"]/span[6]/text()')
-			detail_type_3 = selector.xpath('//*[@id="info"]/span[7]/text()')
+			parsed = parse_detail(detail_contents.content)
 		except Exception as e:
 			print(e)
-		if detail_director:
-			detail_director = detail_director[0] if detail_director else ''
-			detail_time = detail_time[0] if detail_time else ''
-			detail_type_1 = detail_type_1[0] if detail_type_1 else ''
-			detail_type_2 = detail_type_2[0] if detail_type_2 else ''
-			detail_type_3 = detail_type_3[0] if detail_type_3 else ''
-			type = detail_type_1 + u' ' + detail_type_2 + u' ' + detail_type_3
+			return detail
+		if parsed:
 			detail.append({
-				'导演' : detail_director,
-				'片长' : detail_time,
-				'类型' : type,
+				'导演' : parsed['director'],
+				'片长' : parsed['runtime'],
+				'类型' : parsed['category'],
 			})
-		else:
-			pass
 		return detail
 
+def tag_url(tag, start=0, base=DOUBAN_BASE):
+	'''
+	主题列表页地址
+	'''
+	return '{0}/tag/{1}?start={2}&type=T'.format(base, urllib.request.quote(tag), start)
+
+def page_count(content):
+	'''
+	从主题首页解析总页数（分页不足10页时按实际分页链接计算）
+	'''
+	selector = etree.HTML(content)
+	num = selector.xpath('//*[@id="content"]/div/div[1]/div[3]/a[10]/text()')
+	if not num:
+		num = selector.xpath('//*[@id="content"]/div/div[1]/div[3]/a/text()')
+		num = [n for n in num if n.strip().isdigit()][-1:]
+	return int(num[0]) if num else 1
+
+def list_digest(content):
+	'''
+	列表页内容摘要：只取电影列表部分，忽略广告、时间戳等每次都会变化的内容
+	'''
+	try:
+		selector = etree.HTML(content)
+		tables = selector.xpath('//div[contains(@class,"grid-16-8 clearfix")]/div[1]/div[2]/table')
+		if tables:
+			return hashlib.sha1(b''.join(etree.tostring(t, encoding='utf-8') for t in tables)).hexdigest()
+	except Exception as e:
+		logger.warning('计算页面摘要失败: {}'.format(e))
+	return hashlib.sha1(content).hexdigest()
+
+def make_link_lookup(conn):
+	'''
+	返回 existing(links)：查询哪些链接已在douban_movie中（多个抓取线程共用一个自动提交的连接）
+	'''
+	lock = threading.Lock()
+	def existing(links):
+		if not links:
+			return set()
+		with lock:
+			cur = conn.cursor()
+			try:
+				cur.execute('SELECT link FROM douban_movie WHERE link IN ({})'.format(','.join(['%s'] * len(links))), links)
+				return {row[0] for row in cur.fetchall()}
+			finally:
+				cur.close()
+	return existing
+
+def make_handlers(run, frontier, base=DOUBAN_BASE, detail_kind=None, detail_seen=None, known_links=None):
+	'''
+	各类页面的处理函数：主题首页解析总页数并加入其余列表页，列表页解析电影信息入库
+	只有新出现或信息有变化的电影才会入库，其信息摘要在所在批次提交后才记录（由Crawler的sinks分组）；
+	若指定detail_kind，同时为它们加入详情页：只加入known_links确认已在douban_movie中的链接
+	（其余的由ETL导入后运行enrich.py补全），detail_seen（布隆过滤器）中已有的链接不再抓取详情页
+	'''
+	def store(content):
+		changed = []
+		candidates = []
+		for row in run.parse(content):
+			link = row[3]
+			digest = hashlib.sha1('\t'.join(row).encode('utf-8')).hexdigest()
+			if link and not frontier.link_changed(link, digest):
+				continue
+			run.sink.add(row)
+			if link:
+				changed.append((link, digest))
+			if link and detail_kind and (detail_seen is None or link not in detail_seen):
+				candidates.append(link)
+		if candidates and known_links is not None:
+			known = known_links(candidates)
+			candidates = [link for link in candidates if link in known]
+		discovered = [(link, detail_kind, '') for link in candidates]
+		group = run.sink.current_group()
+		if changed and group is not None:
+			# 不在行组内时不记录摘要，下次运行重新入库（INSERT IGNORE）
+			group.defer(lambda: frontier.save_link_states(changed))
+		return discovered
+
+	def on_index(url, tag, response):
+		content = response.content.decode('utf-8')
+		pages = page_count(content)
+		logger.info('主题 {} 共 {} 页'.format(tag, pages))
+		return store(content) + [(tag_url(tag, i * 20, base), 'list', tag) for i in range(1, pages)]
+
+	def on_list(url, tag, response):
+		return store(response.content.decode('utf-8'))
+
+	return {'index': on_index, 'list': on_list}
+
+def main():
+	parser = argparse.ArgumentParser(description='豆瓣电影并发爬虫（支持断点续爬）')
+	parser.add_argument('--workers', type=int, default=4, help='抓取线程数')
+	parser.add_argument('--interval', type=float, default=5.0, help='同一主机的最小请求间隔（秒）')
+	parser.add_argument('--retries', type=int, default=3, help='单次抓取的最大重试次数')
+	parser.add_argument('--state', default=DEFAULT_STATE_PATH, help='断点续爬状态文件')
+	parser.add_argument('--base-url', default=DOUBAN_BASE, help='站点地址，可指向本地替身服务器')
+	parser.add_argument('--save-pages', help='将抓到的页面保存到该目录（供本地替身服务器回放）')
+	parser.add_argument('--refresh', action='store_true', help='重新抓取所有主题首页')
+	parser.add_argument('--incremental', action='store_true',
+		help='增量刷新：重新检查所有已抓取的主题页和列表页，使用条件请求并跳过未变化的页面')
+	parser.add_argument('--bloom', default=DETAIL_BLOOM_PATH, help='已抓取详情页链接的布隆过滤器文件')
+	parser.add_argument('--bloom-capacity', type=int, default=5000000, help='布隆过滤器容量')
+	parser.add_argument('--bloom-error-rate', type=float, default=0.001, help='布隆过滤器误判率')
+	parser.add_argument('--details', action='store_true',
+		help='同时抓取新出现或有变化电影的详情页，补全douban_movie的导演和类型')
+	parser.add_argument('--batch-size', type=int, default=500, help='每个事务写入的行数')
+	parser.add_argument('--flush-interval', type=float, default=5.0, help='缓存数据的最长写入间隔（秒）')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	random.seed(100)
+	frontier = Frontier(args.state)
+	for tag in theme_page().tags:
+		if args.refresh or args.incremental:
+			frontier.requeue(tag_url(tag, 0, args.base_url), 'index', tag)
+		else:
+			frontier.add(tag_url(tag, 0, args.base_url), 'index', tag)
+	if args.incremental:
+		frontier.requeue_kind('list')
+	stats = CrawlStats()
+	fetcher = Fetcher(HostRateLimiter(args.interval), stats, retries=args.retries, save_dir=args.save_pages)
+	run = douban(batch_size=args.batch_size, flush_interval=args.flush_interval)
+	detail_seen = BloomFilter.open(args.bloom, args.bloom_capacity, args.bloom_error_rate)
+	detail_sink = None
+	lookup_conn = None
+	known_links = None
+	if args.details:
+		# 详情写回使用独立连接，避免与列表页写入的事务交错；FOUND_ROWS使影响行数按匹配行计算
+		detail_conn = pymysql.connect(host='localhost', port=3306, user='root', password='186386', db='douban',
+			charset='utf8mb4', client_flag=CLIENT.FOUND_ROWS)
+		# 只有UPDATE确实更新到douban_movie中的电影后才记入过滤器
+		detail_sink = BatchSink(detail_conn, UPDATE_SQL.format('douban_movie'), batch_size=args.batch_size,
+			flush_interval=args.flush_interval,
+			on_written=lambda row, affected: affected and detail_seen.add(row[2]))
+		lookup_conn = pymysql.connect(host='localhost', port=3306, user='root', password='186386', db='douban',
+			charset='utf8mb4', autocommit=True)
+		known_links = make_link_lookup(lookup_conn)
+	handlers = make_handlers(run, frontier, args.base_url, detail_kind='detail' if args.details else None,
+		detail_seen=detail_seen, known_links=known_links)
+	if detail_sink:
+		handlers['detail'] = make_detail_handler(detail_sink)
+	sinks = {'index': run.sink, 'list': run.sink}
+	if detail_sink:
+		sinks['detail'] = detail_sink
+	crawler = Crawler(frontier, fetcher, handlers, workers=args.workers,
+		digests={'index': list_digest, 'list': list_digest}, conditional=args.incremental, sinks=sinks)
+	try:
+		report = crawler.run()
+	finally:
+		report_sink = run.close()
+		if detail_sink:
+			detail_sink.close()
+			detail_sink.conn.close()
+			lookup_conn.close()
+		frontier.close()
+		detail_seen.save(args.bloom)
+	print(report)
+	print(report_sink)
+
 #让程序run起来
-random.seed(100)
-page = theme_page()
-page_list = page.get_total_num()
-print(page_list)
-run = douban()
-for page_info in page_list:   # 遍历所有主题
-	tags = page_info['主题']
-	page = page_info['总页数']
-	tag = urllib.request.quote(tags)
-	threads = []
-	for i in range(int(page)):    # 每个主题下的所有页数
-		url = 'https://movie.douban.com/tag/{0}?start={1}&type=T'.format(tag, i * 20)
-		s = requests.get(url)
-		s = s.content.decode('utf-8')
-		lists = run.search(s)
-		sleep_time_mix = random.randint(30, 70)
-		time.sleep(sleep_time_mix)
-	sleep_time_max = random.randint(600, 3000)
-	time.sleep(sleep_time_max)
+if __name__ == '__main__':
+	main()
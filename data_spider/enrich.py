@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+电影详情补全
+为douban_movie中缺少导演/类型的电影抓取详情页，解析后分批写回
+生产者按主键分段读出待补全的电影放入持久化队列，抓取线程池并发消费，
+中断后重新运行会跳过已完成的详情页
+作者：电影推荐系统团队
+日期：2025-07-03
+"""
+
+import os
+import sys
+import logging
+import argparse
+from urllib.parse import urlsplit, urlunsplit
+
+import pymysql as MySQLdb
+from lxml import etree
+
+from crawler import Frontier, HostRateLimiter, CrawlStats, Fetcher, Crawler
+from db_sink import BatchSink
+
+logger = logging.getLogger('enrich')
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATE_PATH = os.path.join(CURRENT_DIR, 'enrich_state.db')
+
+# 预编译的详情页XPath
+XPATH_DIRECTOR = etree.XPath('//a[@rel="v:directedBy"]/text()')
+XPATH_DIRECTOR_FALLBACK = etree.XPath('//*[@id="info"]/span[1]/span[2]/a/text()')
+XPATH_GENRE = etree.XPath('//span[@property="v:genre"]/text()')
+XPATH_RUNTIME = etree.XPath('//span[@property="v:runtime"]/text()')
+
+UPDATE_SQL = 'UPDATE {} SET director=%s, category=%s WHERE link=%s'
+
+
+def parse_detail(content):
+	"""
+	解析电影详情页
+
+	参数:
+		content: 页面内容（字节串或字符串）
+
+	返回:
+		dict: 导演、类型、片长，解析不到导演和类型时返回None
+	"""
+	selector = etree.HTML(content)
+	if selector is None:
+		return None
+	directors = XPATH_DIRECTOR(selector) or XPATH_DIRECTOR_FALLBACK(selector)
+	genres = XPATH_GENRE(selector)
+	runtime = XPATH_RUNTIME(selector)
+	if not directors and not genres:
+		return None
+	return {
+		'director': ','.join(d.strip() for d in directors if d.strip())[:100],
+		'category': ','.join(g.strip() for g in genres if g.strip())[:100],
+		'runtime': runtime[0].strip() if runtime else '',
+	}
+
+
+def make_detail_handler(sink):
+	"""
+	生成详情页处理函数，解析结果交给批量写入器
+
+	参数:
+		sink: BatchSink对象，SQL为UPDATE_SQL（参数顺序：导演、类型、链接）
+
+	返回:
+		function: handler(url, link, response)
+	"""
+	def on_detail(url, link, response):
+		detail = parse_detail(response.content)
+		if detail is None:
+			raise ValueError('详情页中没有导演和类型信息')
+		sink.add((detail['director'], detail['category'], link or url))
+		return []
+	return on_detail
+
+
+def ensure_columns(conn, table):
+	"""
+	确保电影表有director和category列（init_tables.sql早期版本没有这两列）
+
+	参数:
+		conn: 数据库连接
+		table: 电影表名
+	"""
+	cur = conn.cursor()
+	try:
+		cur.execute(f'SHOW COLUMNS FROM {table}')
+		columns = {row[0] for row in cur.fetchall()}
+		for column in ('director', 'category'):
+			if column not in columns:
+				cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} VARCHAR(100)')
+				logger.info(f"已为表 {table} 添加列 {column}")
+		conn.commit()
+	finally:
+		cur.close()
+
+
+def rebase(link, base_url):
+	"""将详情链接的站点替换为base_url（用于本地替身服务器）"""
+	if not base_url:
+		return link
+	base = urlsplit(base_url)
+	parts = urlsplit(link)
+	return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+
+def produce(conn, table, frontier, base_url=None, chunk_size=5000, limit=None):
+	"""
+	生产者：按主键分段读出缺少详情的电影，加入抓取队列（已在队列中的链接自动忽略）
+
+	参数:
+		conn: 数据库连接
+		table: 电影表名
+		frontier: Frontier对象
+		base_url: 替换详情链接站点的地址
+		chunk_size: 每段读取的行数
+		limit: 最多加入的电影数
+
+	返回:
+		int: 新加入队列的数量
+	"""
+	cur = conn.cursor()
+	last_id = 0
+	added = 0
+	try:
+		while True:
+			cur.execute(
+				f"SELECT id, link FROM {table} WHERE id > %s "
+				f"AND (director IS NULL OR director = '' OR category IS NULL OR category = '') "
+				f"ORDER BY id LIMIT %s",
+				(last_id, chunk_size)
+			)
+			rows = cur.fetchall()
+			if not rows:
+				break
+			last_id = rows[-1][0]
+			items = [(rebase(link, base_url), 'detail', link) for _, link in rows if link]
+			if limit is not None:
+				items = items[:max(0, limit - added)]
+			added += frontier.add_many(items)
+			if limit is not None and added >= limit:
+				break
+	finally:
+		cur.close()
+	logger.info(f"新加入 {added} 个待补全的详情页")
+	return added
+
+
+def main():
+	"""主函数"""
+	parser = argparse.ArgumentParser(description='抓取详情页补全电影的导演和类型')
+	parser.add_argument('--table', default='douban_movie', help='电影表名')
+	parser.add_argument('--workers', type=int, default=4, help='并发抓取线程数（并发上限）')
+	parser.add_argument('--interval', type=float, default=2.0, help='同一主机的最小请求间隔（秒）')
+	parser.add_argument('--batch-size', type=int, default=200, help='每个事务写回的行数')
+	parser.add_argument('--limit', type=int, help='本次最多补全的电影数')
+	parser.add_argument('--state', default=DEFAULT_STATE_PATH, help='断点续抓状态文件')
+	parser.add_argument('--base-url', help='将详情链接指向该站点（如本地替身服务器）')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+	try:
+		conn = MySQLdb.connect(
+			host=os.environ.get("DB_HOST", "127.0.0.1"),
+			user=os.environ.get("DB_USER", "root"),
+			passwd=os.environ.get("DB_PASSWORD", "186386"),
+			db=os.environ.get("DB_NAME", "douban"),
+			charset='utf8mb4'
+		)
+	except Exception as e:
+		logger.error(f"连接数据库失败: {str(e)}")
+		sys.exit(1)
+
+	ensure_columns(conn, args.table)
+	frontier = Frontier(args.state)
+	produce(conn, args.table, frontier, args.base_url, limit=args.limit)
+
+	sink = BatchSink(conn, UPDATE_SQL.format(args.table), batch_size=args.batch_size)
+	fetcher = Fetcher(HostRateLimiter(args.interval), CrawlStats())
+	crawler = Crawler(frontier, fetcher, {'detail': make_detail_handler(sink)}, workers=args.workers,
+		sinks={'detail': sink})
+	try:
+		report = crawler.run()
+	finally:
+		sink.close()
+		frontier.close()
+		conn.close()
+	print(report)
+	print(sink.report())
+
+
+if __name__ == "__main__":
+	main()
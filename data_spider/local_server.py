@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+豆瓣页面本地替身服务器
+按爬虫保存页面时的文件名规则回放已保存的豆瓣页面，用于在不访问豆瓣的情况下测试爬虫
+用法：
+	python douban.py --save-pages pages        # 抓取时保存页面
+	python local_server.py --dir pages --port 8000
+	python douban.py --base-url http://127.0.0.1:8000 --state test_state.db
+作者：电影推荐系统团队
+日期：2025-06-20
+"""
+
+import os
+import time
+import hashlib
+import argparse
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from crawler import page_filename
+
+
+def make_handler(page_dir, delay=0.0):
+	"""
+	生成请求处理类
+
+	参数:
+		page_dir: 保存页面的目录
+		delay: 每个响应的模拟延迟（秒）
+	"""
+	class PageHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			path = os.path.join(page_dir, page_filename(self.path))
+			if delay:
+				time.sleep(delay)
+			if not os.path.exists(path):
+				self.send_response(404)
+				self.end_headers()
+				return
+			with open(path, 'rb') as f:
+				body = f.read()
+			# 支持条件请求，便于测试增量抓取
+			etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+			last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+			if self.headers.get('If-None-Match') == etag:
+				self.send_response(304)
+				self.send_header('ETag', etag)
+				self.end_headers()
+				return
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html; charset=utf-8')
+			self.send_header('Content-Length', str(len(body)))
+			self.send_header('ETag', etag)
+			self.send_header('Last-Modified', last_modified)
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	return PageHandler
+
+
+def main():
+	parser = argparse.ArgumentParser(description='豆瓣页面本地替身服务器')
+	parser.add_argument('--dir', required=True, help='保存页面的目录')
+	parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+	parser.add_argument('--port', type=int, default=8000, help='监听端口')
+	parser.add_argument('--delay', type=float, default=0.0, help='每个响应的模拟延迟（秒）')
+	args = parser.parse_args()
+	server = ThreadingHTTPServer((args.host, args.port), make_handler(args.dir, args.delay))
+	print('本地替身服务器已启动: http://{}:{}'.format(args.host, args.port))
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()
@@ -10,11 +10,15 @@
 
 import os
 import sys
+import math
 import requests
 import hashlib
 import time
 import argparse
 import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from urllib.parse import urlencode
 
@@ -123,33 +127,62 @@ class WeChatDebugger:
         except Exception as e:
             print(f"验证过程出现错误: {e}")
     
-    def send_test_message(self, msg_type="text", content="您好，这是一条测试消息"):
+    def signed_url(self, nonce=None):
         """
-        发送测试消息
-        模拟用户发送消息
+        生成带微信签名参数的消息推送URL
         
         参数:
-            msg_type: 消息类型，支持text, image
-            content: 消息内容
+            nonce: 随机数，默认随机生成
+        
+        返回:
+            str: 带signature/timestamp/nonce参数的URL
         """
-        # 生成消息XML
-        from_user = "test_user"
-        to_user = "gh_123456789"  # 公众号原始ID
         timestamp = str(int(time.time()))
+        nonce = nonce or str(random.randint(100000000, 999999999))
+        sign_list = [self.token, timestamp, nonce]
+        sign_list.sort()
+        sign_str = ''.join(sign_list)
+        signature = hashlib.sha1(sign_str.encode()).hexdigest()
+        
+        params = {
+            'signature': signature,
+            'timestamp': timestamp,
+            'nonce': nonce
+        }
+        return f"{self.url}/?{urlencode(params)}"
+    
+    def build_message_xml(self, msg_type="text", content="", from_user="test_user",
+                          to_user="gh_123456789", event="subscribe", msg_id=None):
+        """
+        生成模拟微信推送的消息XML
+        
+        参数:
+            msg_type: 消息类型，支持text, image, event
+            content: 文本消息内容
+            from_user: 发送方用户ID
+            to_user: 公众号原始ID
+            event: 事件类型（msg_type为event时使用）
+            msg_id: 消息ID，默认随机生成
+        
+        返回:
+            str: 消息XML，不支持的类型返回None
+        """
+        timestamp = str(int(time.time()))
+        msg_id = msg_id or str(random.randint(10 ** 15, 10 ** 16 - 1))
         
         if msg_type == "text":
-            xml_content = f"""
+            return f"""
             <xml>
                 <ToUserName><![CDATA[{to_user}]]></ToUserName>
                 <FromUserName><![CDATA[{from_user}]]></FromUserName>
                 <CreateTime>{timestamp}</CreateTime>
                 <MsgType><![CDATA[text]]></MsgType>
                 <Content><![CDATA[{content}]]></Content>
-                <MsgId>1234567890123456</MsgId>
+                <MsgId>{msg_id}</MsgId>
             </xml>
             """
         elif msg_type == "image":
-            xml_content = f"""
+            return f"""
             <xml>
                 <ToUserName><![CDATA[{to_user}]]></ToUserName>
                 <FromUserName><![CDATA[{from_user}]]></FromUserName>
@@ -157,27 +190,39 @@ class WeChatDebugger:
                 <MsgType><![CDATA[image]]></MsgType>
                 <PicUrl><![CDATA[http://example.com/test.jpg]]></PicUrl>
                 <MediaId><![CDATA[media_id]]></MediaId>
-                <MsgId>1234567890123456</MsgId>
+                <MsgId>{msg_id}</MsgId>
             </xml>
             """
-        else:
+        elif msg_type == "event":
+            return f"""
+            <xml>
+                <ToUserName><![CDATA[{to_user}]]></ToUserName>
+                <FromUserName><![CDATA[{from_user}]]></FromUserName>
+                <CreateTime>{timestamp}</CreateTime>
+                <MsgType><![CDATA[event]]></MsgType>
+                <Event><![CDATA[{event}]]></Event>
+                <EventKey><![CDATA[]]></EventKey>
+            </xml>
+            """
+        return None
+    
+    def send_test_message(self, msg_type="text", content="您好，这是一条测试消息"):
+        """
+        发送测试消息
+        模拟用户发送消息
+        
+        参数:
+            msg_type: 消息类型，支持text, image
+            content: 消息内容
+        """
+        # 生成消息XML
+        xml_content = self.build_message_xml(msg_type, content, msg_id="1234567890123456")
+        if msg_type not in ("text", "image") or xml_content is None:
             print(f"不支持的消息类型: {msg_type}")
             return
         
-        # 生成签名
-        nonce = "123456789"
-        sign_list = [self.token, timestamp, nonce]
-        sign_list.sort()
-        sign_str = ''.join(sign_list)
-        signature = hashlib.sha1(sign_str.encode()).hexdigest()
-        
-        # 构建URL
-        params = {
-            'signature': signature,
-            'timestamp': timestamp,
-            'nonce': nonce
-        }
-        message_url = f"{self.url}/?{urlencode(params)}"
+        # 生成签名并构建URL
+        message_url = self.signed_url(nonce="123456789")
         
         print("\n====== 发送测试消息 ======")
         print(f"消息类型: {msg_type}")
@@ -274,6 +319,273 @@ class WeChatDebugger:
             except ImportError:
                 print(f"模块 {module}: 未安装")
 
+# 压测时默认使用的文本命令
+DEFAULT_TEXT_COMMANDS = ["推荐", "热门", "怎么用", "搜索 肖申克的救赎", "评价 霸王别姬 9", "星际穿越", "盗梦"]
+# 默认消息类型配比
+DEFAULT_MIX = "text:80,image:5,subscribe:10,unsubscribe:5"
+
+
+def parse_mix(mix):
+    """
+    解析消息类型配比字符串
+    
+    参数:
+        mix: 形如 "text:80,image:5,subscribe:15" 的字符串
+    
+    返回:
+        list: [(类型, 权重), ...]
+    """
+    weights = []
+    for item in mix.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        kind, _, weight = item.partition(':')
+        kind = kind.strip()
+        if kind not in ("text", "image", "subscribe", "unsubscribe"):
+            raise ValueError(f"不支持的消息类型: {kind}")
+        weights.append((kind, float(weight or 1)))
+    if not weights:
+        raise ValueError("消息类型配比为空")
+    return weights
+
+
+def percentile(sorted_values, pct):
+    """
+    计算百分位数（最近秩法）
+    
+    参数:
+        sorted_values: 已排序的数值列表
+        pct: 百分位（0-100）
+    
+    返回:
+        float: 百分位数，列表为空时返回0
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadGenerator:
+    """基于WeChatDebugger的并发压测与流量回放工具"""
+    
+    def __init__(self, debugger, concurrency=50, timeout=10):
+        """
+        初始化压测工具
+        
+        参数:
+            debugger: WeChatDebugger实例，用于生成签名和消息XML
+            concurrency: 并发发送线程数
+            timeout: 单个请求超时时间（秒）
+        """
+        self.debugger = debugger
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._results = []
+    
+    def _session(self):
+        """每个线程复用一个HTTP会话（保持长连接）"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['Content-Type'] = 'application/xml'
+            self._local.session = session
+        return session
+    
+    def _send(self, message, scheduled):
+        """
+        发送一条消息并记录结果
+        
+        参数:
+            message: 消息字典（kind, msg_type, from_user, content, event）
+            scheduled: 计划发送时间（time.perf_counter），延迟从计划时间算起，
+                       避免服务端变慢时压测端少发请求而低估延迟
+        """
+        xml_content = self.debugger.build_message_xml(
+            message['msg_type'], message.get('content', ''),
+            from_user=message['from_user'], event=message.get('event', 'subscribe')
+        )
+        ok = False
+        error = None
+        size = 0
+        try:
+            response = self._session().post(
+                self.debugger.signed_url(), data=xml_content.encode('utf-8'), timeout=self.timeout
+            )
+            size = len(response.content)
+            ok = response.status_code == 200
+            if not ok:
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self._results.append((message['kind'], latency, ok, error, size))
+    
+    def _run_schedule(self, schedule):
+        """
+        按计划时间表发送消息（开环：按时间表提交，不等待上一个请求完成）
+        
+        参数:
+            schedule: 迭代器，产生 (相对开始时间的秒数, 消息字典)
+        
+        返回:
+            dict: 压测报告
+        """
+        self._results = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for offset, message in schedule:
+                scheduled = start + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, message, scheduled)
+        return self.report(time.perf_counter() - start)
+    
+    def run(self, rps=10, duration=60, users=100, mix=DEFAULT_MIX, commands=None, seed=None):
+        """
+        以目标RPS生成混合消息进行压测
+        
+        参数:
+            rps: 目标每秒请求数
+            duration: 压测时长（秒）
+            users: 模拟用户数（FromUserName为 load_user_0 ~ load_user_{users-1}）
+            mix: 消息类型配比字符串
+            commands: 文本消息内容列表，默认使用DEFAULT_TEXT_COMMANDS
+            seed: 随机种子
+        
+        返回:
+            dict: 压测报告
+        """
+        rng = random.Random(seed)
+        weights = parse_mix(mix)
+        kinds = [kind for kind, _ in weights]
+        kind_weights = [weight for _, weight in weights]
+        commands = commands or DEFAULT_TEXT_COMMANDS
+        total = int(rps * duration)
+        
+        def schedule():
+            for i in range(total):
+                kind = rng.choices(kinds, kind_weights)[0]
+                message = {'kind': kind, 'from_user': f"load_user_{rng.randrange(users)}"}
+                if kind == "text":
+                    message['msg_type'] = "text"
+                    message['content'] = rng.choice(commands)
+                elif kind == "image":
+                    message['msg_type'] = "image"
+                else:
+                    message['msg_type'] = "event"
+                    message['event'] = kind
+                yield i / float(rps), message
+        
+        print(f"\n====== 开始压测: {rps} RPS, {duration} 秒, {users} 个用户, 配比 {mix} ======")
+        return self._run_schedule(schedule())
+    
+    def replay(self, log_path, speed=1.0):
+        """
+        回放采集的消息日志
+        
+        日志为JSON Lines格式，每行一条消息，字段：
+            time: 消息时间戳（秒），用于还原消息间隔
+            from_user: 用户ID
+            msg_type: text / image / event
+            content: 文本内容（text消息）
+            event: 事件类型（event消息）
+        
+        参数:
+            log_path: 日志文件路径
+            speed: 回放倍速（2表示以两倍速度回放）
+        
+        返回:
+            dict: 压测报告
+        """
+        messages = []
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"跳过无法解析的第 {line_no} 行")
+                    continue
+                msg_type = record.get('msg_type', 'text')
+                kind = record.get('event', 'subscribe') if msg_type == 'event' else msg_type
+                messages.append((float(record.get('time', 0)), {
+                    'kind': kind,
+                    'msg_type': msg_type,
+                    'from_user': record.get('from_user', 'replay_user'),
+                    'content': record.get('content', ''),
+                    'event': record.get('event', 'subscribe'),
+                }))
+        if not messages:
+            print("日志中没有可回放的消息")
+            return self.report(0)
+        
+        messages.sort(key=lambda item: item[0])
+        first = messages[0][0]
+        print(f"\n====== 开始回放: {len(messages)} 条消息, {speed} 倍速 ======")
+        return self._run_schedule(((t - first) / speed, message) for t, message in messages)
+    
+    def report(self, elapsed):
+        """
+        汇总压测结果并打印
+        
+        参数:
+            elapsed: 压测总耗时（秒）
+        
+        返回:
+            dict: 总体及按消息类型的吞吐量、错误率和延迟百分位
+        """
+        with self._lock:
+            results = list(self._results)
+        
+        def summarize(rows):
+            latencies = sorted(row[1] for row in rows)
+            errors = sum(1 for row in rows if not row[2])
+            count = len(rows)
+            return {
+                'requests': count,
+                'errors': errors,
+                'error_rate': errors / count if count else 0.0,
+                'avg_bytes': sum(row[4] for row in rows) / count if count else 0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p90_ms': percentile(latencies, 90) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': (latencies[-1] if latencies else 0) * 1000,
+            }
+        
+        summary = summarize(results)
+        summary['elapsed'] = elapsed
+        summary['throughput'] = len(results) / elapsed if elapsed else 0.0
+        by_kind = {}
+        for row in results:
+            by_kind.setdefault(row[0], []).append(row)
+        summary['by_kind'] = {kind: summarize(rows) for kind, rows in sorted(by_kind.items())}
+        error_types = {}
+        for row in results:
+            if row[3]:
+                error_types[row[3]] = error_types.get(row[3], 0) + 1
+        summary['error_types'] = error_types
+        
+        print("\n====== 压测结果 ======")
+        print(f"总请求数: {summary['requests']}, 耗时: {elapsed:.2f}秒, 吞吐量: {summary['throughput']:.1f} 请求/秒")
+        print(f"错误数: {summary['errors']}, 错误率: {summary['error_rate'] * 100:.2f}%")
+        print(f"延迟(ms): p50={summary['p50_ms']:.1f} p90={summary['p90_ms']:.1f} "
+              f"p95={summary['p95_ms']:.1f} p99={summary['p99_ms']:.1f} max={summary['max_ms']:.1f}")
+        for kind, item in summary['by_kind'].items():
+            print(f"  {kind}: {item['requests']} 请求, 错误率 {item['error_rate'] * 100:.2f}%, "
+                  f"p50={item['p50_ms']:.1f}ms p99={item['p99_ms']:.1f}ms")
+        if error_types:
+            print(f"错误类型: {error_types}")
+        return summary
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='微信公众号调试工具')
@@ -283,6 +595,16 @@ def main():
     parser.add_argument('--send', help='发送测试消息')
     parser.add_argument('--msg-type', default='text', help='消息类型: text或image')
     parser.add_argument('--status', action='store_true', help='检查系统状态')
+    parser.add_argument('--load', action='store_true', help='按目标RPS进行压测')
+    parser.add_argument('--replay', help='回放JSON Lines格式的消息日志')
+    parser.add_argument('--rps', type=float, default=10, help='压测目标每秒请求数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长（秒）')
+    parser.add_argument('--users', type=int, default=100, help='模拟用户数')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='消息类型配比，如 text:80,image:5,subscribe:15')
+    parser.add_argument('--commands', help='文本消息内容，用|分隔')
+    parser.add_argument('--concurrency', type=int, default=50, help='并发发送线程数')
+    parser.add_argument('--speed', type=float, default=1.0, help='回放倍速')
+    parser.add_argument('--report', help='将压测报告写入JSON文件')
     
     args = parser.parse_args()
     
@@ -299,8 +621,21 @@ def main():
     if args.status:
         debugger.check_system_status()
     
+    if args.load or args.replay:
+        generator = LoadGenerator(debugger, concurrency=args.concurrency)
+        if args.replay:
+            summary = generator.replay(args.replay, speed=args.speed)
+        else:
+            commands = args.commands.split('|') if args.commands else None
+            summary = generator.run(rps=args.rps, duration=args.duration, users=args.users,
+                                    mix=args.mix, commands=commands)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            print(f"压测报告已写入: {args.report}")
+    
     # 如果没有指定操作，显示交互式菜单
-    if not (args.validate or args.send or args.status):
+    if not (args.validate or args.send or args.status or args.load or args.replay):
         while True:
             print("\n=== 微信公众号调试工具 ===")
             print("1. 验证服务器配置")
@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS `douban_movie` (
     `address` VARCHAR(50),
     `other_release` VARCHAR(100),
     `actors` VARCHAR(1000),
+    `director` VARCHAR(100),
+    `category` VARCHAR(100),
     PRIMARY KEY (`id`),
     UNIQUE KEY `idx_link` (`link`) 
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -26,17 +28,51 @@ CREATE TABLE IF NOT EXISTS `user_info` (
     UNIQUE KEY `idx_wx_id` (`wx_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- 用户搜索记录表
+-- 用户搜索记录表，按seek_time按月分区（分区键必须包含在主键中）
+-- 新建时只有pmax，月分区由 python -m web_server.seek_partitions maintain 拆出（第一次从最早的记录所在月份起，
+-- 会重写pmax中已有的数据，应在建表后尽早执行；之后pmax保持为空，拆分未来月份不移动数据）；
+-- 已有的未分区表用 python -m web_server.seek_partitions migrate 迁移
 CREATE TABLE IF NOT EXISTS `seek_movie` (
-    `id` INT UNSIGNED AUTO_INCREMENT,
+    `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
     `user_id` INT NOT NULL,
     `movie_id` INT NOT NULL,
-    `seek_time` BIGINT,
-    PRIMARY KEY (`id`),
+    `seek_time` BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (`id`, `seek_time`),
     KEY `idx_user_id` (`user_id`),
+    KEY `idx_movie_id` (`movie_id`),
+    KEY `idx_seek_time` (`seek_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (`seek_time`) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- 搜索记录日汇总（web_server/seek_partitions.py），统计与聚合任务读取这些表
+CREATE TABLE IF NOT EXISTS `seek_movie_daily_movie` (
+    `day` DATE NOT NULL,
+    `movie_id` INT NOT NULL,
+    `searches` INT NOT NULL,
+    `users` INT NOT NULL,
+    PRIMARY KEY (`day`, `movie_id`),
     KEY `idx_movie_id` (`movie_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+CREATE TABLE IF NOT EXISTS `seek_movie_daily_user` (
+    `day` DATE NOT NULL,
+    `user_id` INT NOT NULL,
+    `searches` INT NOT NULL,
+    `movies` INT NOT NULL,
+    PRIMARY KEY (`day`, `user_id`),
+    KEY `idx_user_id` (`user_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `seek_movie_daily_user_movie` (
+    `day` DATE NOT NULL,
+    `user_id` INT NOT NULL,
+    `movie_id` INT NOT NULL,
+    `searches` INT NOT NULL,
+    PRIMARY KEY (`day`, `user_id`, `movie_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- 用户评分表
 CREATE TABLE IF NOT EXISTS `like_movie` (
     `id` INT UNSIGNED AUTO_INCREMENT,
@@ -49,7 +85,33 @@ CREATE TABLE IF NOT EXISTS `like_movie` (
     KEY `idx_movie_id` (`movie_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- 增量导入水位表（data_spider/create_target_table.py --incremental）
+CREATE TABLE IF NOT EXISTS `etl_watermark` (
+    `source` VARCHAR(64) NOT NULL,
+    `last_id` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`source`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 搜索记录聚合的隐式兴趣分（web_server/implicit_feedback.py），score为updated_at时刻的衰减分
+CREATE TABLE IF NOT EXISTS `implicit_user_movie` (
+    `user_id` INT NOT NULL,
+    `movie_id` INT NOT NULL,
+    `score` DOUBLE NOT NULL,
+    `updated_at` BIGINT NOT NULL,
+    PRIMARY KEY (`user_id`, `movie_id`),
+    KEY `idx_movie_id` (`movie_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS `implicit_movie` (
+    `movie_id` INT NOT NULL,
+    `score` DOUBLE NOT NULL,
+    `updated_at` BIGINT NOT NULL,
+    PRIMARY KEY (`movie_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- 添加外键约束（可选，如果需要强制引用完整性）
+-- 分区表不支持外键，seek_movie的两条约束已不可用
 -- ALTER TABLE `seek_movie` ADD CONSTRAINT `fk_seek_user` FOREIGN KEY (`user_id`) REFERENCES `user_info` (`id`) ON DELETE CASCADE;
 -- ALTER TABLE `seek_movie` ADD CONSTRAINT `fk_seek_movie` FOREIGN KEY (`movie_id`) REFERENCES `douban_movie` (`id`) ON DELETE CASCADE;
 -- ALTER TABLE `like_movie` ADD CONSTRAINT `fk_like_user` FOREIGN KEY (`user_id`) REFERENCES `user_info` (`id`) ON DELETE CASCADE;
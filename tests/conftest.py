@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# 测试产生的日志写入临时目录，不写入项目的logs（须在导入web_server之前设置）
+os.environ.setdefault('MOVIE_RECOMMENDER_LOG_DIR', tempfile.mkdtemp(prefix='movie-recommender-logs-'))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, 'scripts'), os.path.join(PROJECT_ROOT, 'data_spider')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
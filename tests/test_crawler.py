@@ -0,0 +1,89 @@
+import re
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+
+from crawler import Frontier, Fetcher, Crawler, CrawlStats, HostRateLimiter, page_filename
+from local_server import make_handler
+
+LINK = re.compile(r'href="([^"]+)"')
+
+
+def save_page(page_dir, path, body):
+    (page_dir / page_filename(path)).write_text(body, encoding='utf-8')
+
+
+@pytest.fixture
+def site(tmp_path):
+    """首页链接三个列表页，每个列表页两部电影；列表页中的<time>在摘要中忽略"""
+    page_dir = tmp_path / 'pages'
+    page_dir.mkdir()
+    lists = [f'/list?start={start}' for start in (0, 20, 40)]
+    save_page(page_dir, '/index', ''.join(f'<a href="{path}">' for path in lists))
+    for i, path in enumerate(lists):
+        save_page(page_dir, path, f'<time>1</time><a href="/subject/{2 * i}"><a href="/subject/{2 * i + 1}">')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(str(page_dir)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1]), page_dir, tmp_path / 'state.db'
+    server.shutdown()
+    server.server_close()
+
+
+def make_crawler(base, state_path, movies, conditional=False, stop_after=None):
+    frontier = Frontier(str(state_path))
+    fetcher = Fetcher(HostRateLimiter(interval=0, jitter=0), CrawlStats(), retries=0)
+    crawler = None
+
+    def index(url, meta, response):
+        return [(base + path, 'list', '') for path in LINK.findall(response.content.decode('utf-8'))]
+
+    def listing(url, meta, response):
+        movies.extend(LINK.findall(response.content.decode('utf-8')))
+        if stop_after is not None and len(movies) >= stop_after:
+            crawler.stop()
+        return []
+
+    crawler = Crawler(frontier, fetcher, {'index': index, 'list': listing}, workers=1, conditional=conditional,
+                      digests={'list': lambda content: re.sub(rb'<time>.*?</time>', b'', content)})
+    return crawler, frontier
+
+
+def test_crawl_resumes_after_restart_and_counts_unchanged_pages(site):
+    base, page_dir, state_path = site
+
+    # 第一次运行：处理完一个列表页后停止，另一个页面在抓取中时进程被杀死
+    movies = []
+    crawler, frontier = make_crawler(base, state_path, movies, stop_after=2)
+    frontier.add(base + '/index', 'index')
+    crawler.run(report_interval=3600)
+    assert movies == ['/subject/0', '/subject/1']
+    claimed = frontier.claim()
+    assert claimed is not None and frontier.counts().get('running') == 1
+    frontier.close()
+
+    # 重启：中断时正在抓取的页面重新排队，已完成的页面不再抓取
+    movies = []
+    crawler, frontier = make_crawler(base, state_path, movies)
+    assert frontier.counts() == {'done': 2, 'pending': 2}
+    report = crawler.run(report_interval=3600)
+    assert sorted(movies) == ['/subject/2', '/subject/3', '/subject/4', '/subject/5']
+    assert report['frontier'] == {'done': 4}
+    assert report['pages'] == 2 and report['parsed'] == 2
+    frontier.close()
+
+    # 增量抓取：未修改的页面返回304；内容变化但摘要不变的页面记为unchanged，都不再解析
+    movies = []
+    crawler, frontier = make_crawler(base, state_path, movies, conditional=True)
+    save_page(page_dir, '/list?start=40', '<time>2</time><a href="/subject/4"><a href="/subject/5">')
+    frontier.requeue(base + '/index', 'index')
+    assert frontier.requeue_kind('list') == 3
+    report = crawler.run(report_interval=3600)
+    assert movies == []
+    assert report['not_modified'] == 3 and report['unchanged'] == 1 and report['parsed'] == 0
+    assert report['status_codes'] == {304: 3, 200: 1}
+    assert report['frontier'] == {'done': 4}
+    frontier.close()
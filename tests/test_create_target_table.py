@@ -0,0 +1,118 @@
+import pytest
+
+MySQLdb = pytest.importorskip('pymysql')
+
+import create_target_table as ct
+
+
+class FakeCursor(object):
+    """按链接模拟写入；links_failing中的链接写入时报锁等待超时"""
+
+    def __init__(self, links_failing=()):
+        self.links_failing = set(links_failing)
+        self.rows = {}
+        self.watermarks = []
+
+    def executemany(self, sql, rows):
+        for row in rows:
+            self.execute(sql, row)
+
+    def execute(self, sql, row=None):
+        if 'etl_watermark' in sql:
+            self.watermarks.append(row)
+            return
+        if row[3] in self.links_failing:
+            raise MySQLdb.OperationalError(1205, 'Lock wait timeout exceeded')
+        self.rows[row[3]] = row
+
+
+class FakeConnection(object):
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def source_row(source_id, link):
+    return ('电影', '8.0', '100', link, '2020', '演员', source_id)
+
+
+def test_keyed_chunk_keeps_source_ids_of_kept_rows():
+    last_id, count, chunk, row_ids = ct.normalize_keyed_chunk(
+        [source_row(3, 'l3'), source_row(5, ''), source_row(8, 'l8')])
+    assert (last_id, count, row_ids) == (8, 3, [3, 8])
+    assert [row[3] for row in chunk] == ['l3', 'l8']
+
+
+def test_watermark_stops_before_first_failed_row():
+    _, _, chunk, row_ids = ct.normalize_keyed_chunk(
+        [source_row(i, f'l{i}') for i in (11, 12, 13, 14)])
+    cur = FakeCursor(links_failing={'l13'})
+    progress = ct.ImportProgress()
+    ct.DataHandle().write_chunk(FakeConnection(), cur, 'INSERT', chunk, progress, ('douban_mov', 14), row_ids)
+    assert progress.failed == 1 and progress.written == 3
+    assert cur.watermarks == [('douban_mov', 12)]
+
+
+def test_watermark_not_saved_without_row_ids():
+    cur = FakeCursor(links_failing={'l1'})
+    progress = ct.ImportProgress()
+    chunk = [ct.normalize_row(source_row(1, 'l1')[:6])]
+    ct.DataHandle().write_chunk(FakeConnection(), cur, 'INSERT', chunk, progress, ('douban_mov', 1))
+    assert cur.watermarks == []
+
+
+def test_watermark_advances_when_all_rows_written():
+    _, _, chunk, row_ids = ct.normalize_keyed_chunk([source_row(1, 'l1'), source_row(2, 'l2')])
+    cur = FakeCursor()
+    ct.DataHandle().write_chunk(FakeConnection(), cur, 'INSERT', chunk, ct.ImportProgress(), ('douban_mov', 2), row_ids)
+    assert cur.watermarks == [('douban_mov', 2)]
+
+
+class RecordingCursor(object):
+
+    def __init__(self):
+        self.log = []
+
+    def execute(self, sql, params=None):
+        self.log.append(' '.join(sql.split()))
+
+    def fetchall(self):
+        return [('id',)]
+
+    def fetchone(self):
+        return (100,)
+
+    def close(self):
+        pass
+
+
+class RecordingConnection(FakeConnection):
+
+    def __init__(self):
+        self.cur = RecordingCursor()
+
+    def cursor(self):
+        return self.cur
+
+    def close(self):
+        pass
+
+
+def test_bulk_load_swaps_tables_under_lock(tmp_path):
+    handle = ct.DataHandle()
+    stage = tmp_path / 'stage.tsv'
+    stage.write_text('')
+    handle.stage_rows = lambda oldtable, chunk_size, workers, progress: str(stage)
+    handle.load_stage = lambda stage_path, table: 0
+    conn = RecordingConnection()
+    handle.data_bulk_load(conn, 'douban_movie', 'douban_mov', workers=1)
+    log = conn.cur.log
+    lock = log.index('LOCK TABLES douban_movie WRITE, douban_movie_shadow WRITE')
+    assert log[lock + 1].startswith('UPDATE douban_movie_shadow JOIN douban_movie')
+    assert log[lock + 2] == 'RENAME TABLE douban_movie TO douban_movie_old, douban_movie_shadow TO douban_movie'
+    assert log[lock + 3] == 'UNLOCK TABLES'
+    assert log[lock + 4] == 'DROP TABLE douban_movie_old'
+    assert log.index('DROP TABLE IF EXISTS douban_movie_old') < lock
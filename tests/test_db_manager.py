@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+pymysql = pytest.importorskip('pymysql')
+
+from web_server import db_manager as db_module
+from web_server.db_manager import DatabaseManager
+
+
+class FakeCursor(object):
+
+    def __init__(self, error, rows):
+        self.error = error
+        self.rows = rows
+
+    def execute(self, sql, params=None):
+        if self.error:
+            raise self.error
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, error=None, rows=()):
+        self.error = error
+        self.rows = list(rows)
+
+    def cursor(self):
+        return FakeCursor(self.error, self.rows)
+
+
+class FakePool(object):
+
+    def __init__(self, name, error=None, rows=()):
+        self.name = name
+        self.connection = FakeConnection(error, rows)
+
+    def get(self):
+        return self.connection
+
+    def put(self, connection):
+        pass
+
+
+def make_manager(replica_error):
+    manager = DatabaseManager.__new__(DatabaseManager)
+    manager.primary = FakePool('primary', rows=[{'source': 'primary'}])
+    replica = FakePool('replica1', error=replica_error, rows=[{'source': 'replica'}])
+    manager.replicas = [replica]
+    manager._healthy = [replica]
+    manager._lag = {'replica1': 0}
+    manager._sticky = {}
+    manager._lock = threading.Lock()
+    manager._round_robin = iter(range(100))
+    manager.reconnect_attempts = 3
+    manager.sticky_seconds = 5
+    return manager
+
+
+@pytest.fixture(autouse=True)
+def no_tracing(monkeypatch):
+    monkeypatch.setattr(db_module, 'record_db', lambda elapsed: None)
+    monkeypatch.setattr(db_module.sql_tracer, 'record', lambda *args: None)
+    monkeypatch.setattr(db_module, 'explain_with', lambda *args: None)
+
+
+def test_connection_error_ejects_replica_and_falls_back_to_primary():
+    manager = make_manager(pymysql.OperationalError(2013, 'Lost connection'))
+    assert manager.execute_query('SELECT 1') == [{'source': 'primary'}]
+    assert manager._healthy == []
+    assert manager._lag['replica1'] is None
+
+
+def test_sql_error_is_raised_without_ejecting_replica():
+    manager = make_manager(pymysql.ProgrammingError(1146, "Table doesn't exist"))
+    with pytest.raises(pymysql.ProgrammingError):
+        manager.execute_query('SELECT * FROM missing')
+    assert [pool.name for pool in manager._healthy] == ['replica1']
+
+
+def test_recent_writer_reads_primary():
+    manager = make_manager(None)
+    assert manager.execute_query('SELECT 1') == [{'source': 'replica'}]
+    manager.mark_written('openid')
+    assert manager.execute_query('SELECT 1', user='openid') == [{'source': 'primary'}]
+    assert manager.execute_query('SELECT 1', user='other') == [{'source': 'replica'}]
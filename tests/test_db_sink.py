@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from db_sink import BatchSink
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute('CREATE TABLE movie (title TEXT NOT NULL, link TEXT)')
+    yield conn
+    conn.close()
+
+
+def make_sink(conn, batch_size=3):
+    return BatchSink(conn, 'INSERT INTO movie(title, link) VALUES (?, ?)', batch_size=batch_size, flush_interval=3600)
+
+
+def test_group_commits_after_its_rows(conn):
+    sink = make_sink(conn)
+    events = []
+    with sink.group() as group:
+        sink.add(('a', 'l1'))
+        sink.add(('b', 'l2'))
+        group.defer(lambda: events.append('deferred'))
+    group.close(lambda: events.append('commit'), lambda: events.append('failure'))
+    assert events == []
+    sink.flush()
+    assert events == ['deferred', 'commit']
+    sink.close()
+
+
+def test_group_spanning_batches(conn):
+    sink = make_sink(conn, batch_size=2)
+    events = []
+    with sink.group() as group:
+        for i in range(3):
+            sink.add(('t%d' % i, 'l%d' % i))
+    group.close(lambda: events.append('commit'), lambda: events.append('failure'))
+    assert events == []
+    sink.flush()
+    assert events == ['commit']
+    assert conn.execute('SELECT COUNT(*) FROM movie').fetchone()[0] == 3
+    sink.close()
+
+
+def test_failed_batch_skips_deferred_actions(conn):
+    sink = make_sink(conn)
+    events = []
+    with sink.group() as group:
+        sink.add(('a', 'l1'))
+        sink.add((None, 'l2'))
+        group.defer(lambda: events.append('deferred'))
+    group.close(lambda: events.append('commit'), lambda: events.append('failure'))
+    sink.flush()
+    assert events == ['failure']
+    assert sink.rows_failed == 2
+    sink.close()
+
+
+def test_empty_group_fires_immediately(conn):
+    sink = make_sink(conn)
+    events = []
+    with sink.group() as group:
+        pass
+    group.close(lambda: events.append('commit'), lambda: events.append('failure'))
+    assert events == ['commit']
+    assert sink.current_group() is None
+    sink.close()
+
+
+def test_on_written_reports_affected_rows(conn):
+    conn.execute("INSERT INTO movie(title, link) VALUES ('a', 'l1')")
+    conn.commit()
+    written = []
+    sink = BatchSink(conn, 'UPDATE movie SET title=? WHERE link=?', batch_size=10, flush_interval=3600,
+                     on_written=lambda row, affected: written.append((row[1], affected)))
+    sink.add(('b', 'l1'))
+    sink.add(('c', 'missing'))
+    sink.flush()
+    assert written == [('l1', 1), ('missing', 0)]
+    sink.close()
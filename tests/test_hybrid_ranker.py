@@ -0,0 +1,46 @@
+import threading
+import time
+
+from web_server.hybrid_ranker import HybridRanker, RatingCache
+
+
+def test_slow_stage_is_skipped():
+    ranker = HybridRanker({'fast': 1, 'slow': 1}, stage_timeout=0.05, max_inflight=2)
+    results = ranker.candidates({'fast': lambda: {1: 1.0}, 'slow': lambda: time.sleep(0.3) or {2: 1.0}})
+    assert results == {'fast': {1: 1.0}}
+
+
+def test_budget_starts_when_stage_runs():
+    ranker = HybridRanker({'a': 1, 'b': 1}, stage_timeout=0.2, max_inflight=1)
+    # 两个生成器各用0.15秒，总时间超过一个预算，但各自都在预算内
+    results = ranker.candidates({'a': lambda: time.sleep(0.15) or {1: 1.0}, 'b': lambda: time.sleep(0.15) or {2: 1.0}})
+    assert set(results) == {'a', 'b'}
+
+
+def test_stage_with_too_many_stragglers_is_skipped():
+    release = threading.Event()
+    ranker = HybridRanker({'stuck': 1}, stage_timeout=0.02, max_inflight=1)
+    assert ranker.candidates({'stuck': lambda: release.wait(5) and {}}) == {}
+    calls = []
+    assert ranker.candidates({'stuck': lambda: calls.append(1) or {1: 1.0}}) == {}
+    assert calls == []
+    release.set()
+    time.sleep(0.05)
+    assert ranker.candidates({'stuck': lambda: {1: 1.0}}) == {'stuck': {1: 1.0}}
+
+
+def test_rating_cache_loads_in_background():
+    loaded = threading.Event()
+
+    def loader():
+        loaded.wait(5)
+        return [(1, 10, 8.0), (2, 10, 6.0)]
+
+    cache = RatingCache(loader, ttl=60)
+    assert cache.get() is None
+    loaded.set()
+    for _ in range(100):
+        if cache.get() is not None:
+            break
+        time.sleep(0.01)
+    assert len(cache.get()) == 2
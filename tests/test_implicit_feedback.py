@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+
+from web_server.implicit_feedback import ImplicitFeedback, date_start
+from web_server.seek_partitions import day_start, DAY_SECONDS
+from web_server.sqlite_backend import SQLiteBackend
+
+
+class SQLiteManager(object):
+    """只提供transaction()的数据库管理器替身"""
+
+    def __init__(self, path):
+        self.backend = SQLiteBackend(str(path))
+
+    @contextmanager
+    def transaction(self):
+        connection = self.backend.connect()
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+
+def test_date_start_accepts_sqlite_strings():
+    today = day_start(time.time())
+    assert date_start(time.strftime('%Y-%m-%d', time.localtime(today))) == today
+
+
+def test_run_once_rolls_up_without_partition_maintenance(tmp_path):
+    db = SQLiteManager(tmp_path / 'implicit.sqlite3')
+    two_days_ago = day_start(day_start(time.time()) - DAY_SECONDS - 3600) + 3600
+    with db.transaction() as cursor:
+        cursor.executemany('INSERT INTO seek_movie (user_id, movie_id, seek_time) VALUES (%s, %s, %s)',
+                           [(1, 10, two_days_ago), (1, 10, two_days_ago + 60), (2, 20, two_days_ago)])
+    feedback = ImplicitFeedback(db, half_life_days=14.0)
+    assert feedback.run_once() >= 1
+    with db.transaction() as cursor:
+        cursor.execute('SELECT user_id, movie_id, score FROM implicit_user_movie ORDER BY user_id')
+        rows = cursor.fetchall()
+    assert [(r['user_id'], r['movie_id']) for r in rows] == [(1, 10), (2, 20)]
+    assert 1.5 < rows[0]['score'] < 2.0
+    assert feedback.run_once() == 0
@@ -0,0 +1,72 @@
+import gc
+import time
+import threading
+
+import pytest
+
+from web_server.metrics import Counter, Histogram
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def wait_retired(metric, live=0):
+    deadline = time.time() + 5
+    while len(metric._shards) > 1 + live:
+        assert time.time() < deadline, len(metric._shards)
+        gc.collect()
+        time.sleep(0.01)
+
+
+def test_counter_shards_of_finished_threads_are_folded():
+    counter = Counter('requests_total', '', ('command',))
+    for _ in range(5):
+        run_threads(lambda: [counter.inc(('搜索',)) for _ in range(10)], 20)
+    wait_retired(counter)
+    assert counter.collect() == {('搜索',): 1000}
+    counter.inc(('推荐',), 2)
+    assert len(counter._shards) == 2
+    assert counter.collect() == {('搜索',): 1000, ('推荐',): 2}
+
+
+def test_histogram_shards_of_finished_threads_are_folded():
+    histogram = Histogram('latency_seconds', '', buckets=(0.1, 1.0))
+
+    def observe():
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+    run_threads(observe, 30)
+    wait_retired(histogram)
+    slots = histogram.collect()[()]
+    assert slots[:3] == [30, 30, 30]
+    assert slots[3] == pytest.approx(30 * 5.55)
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{le="+Inf"} 90' in lines
+    assert 'latency_seconds_count 90' in lines
+
+
+def test_collect_while_threads_finish_counts_each_value_once():
+    counter = Counter('churn_total', '')
+    done = threading.Event()
+    seen = []
+
+    def scrape():
+        while not done.is_set():
+            seen.append(counter.collect().get((), 0))
+
+    scraper = threading.Thread(target=scrape)
+    scraper.start()
+    for _ in range(20):
+        run_threads(lambda: counter.inc(), 10)
+    wait_retired(counter)
+    done.set()
+    scraper.join()
+    assert all(a <= b for a, b in zip(seen, seen[1:]))
+    assert max(seen + [0]) <= 200
+    assert counter.collect() == {(): 200}
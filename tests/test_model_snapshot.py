@@ -0,0 +1,71 @@
+import os
+import threading
+
+import numpy as np
+
+from web_server.model_snapshot import SnapshotStore, RecommenderState, build_blocks, write_snapshot
+
+
+def test_get_loads_new_version_off_the_request_thread(tmp_path):
+    version = write_snapshot(str(tmp_path), {'ratings.user_ids': np.arange(3, dtype=np.int64)})
+    release = threading.Event()
+    loaded = []
+
+    def factory(snapshot):
+        release.wait(5)
+        loaded.append(threading.current_thread())
+        return snapshot.version
+
+    store = SnapshotStore(str(tmp_path), factory=factory, check_interval=0.0)
+    assert store.get() is None
+    assert store.get() is None
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == 'snapshot-refresh':
+            thread.join(5)
+    assert store.get() == version
+    assert len(loaded) == 1 and loaded[0] is not threading.main_thread()
+
+
+def write_state(root, liking):
+    catalog = [(1, '张国荣/巩俐', '陈凯歌', '剧情/爱情', '中国大陆', '1993'),
+               (2, '葛优/巩俐', '张艺谋', '剧情/历史', '中国大陆', '1994')]
+    ratings = [(1, 1, liking), (1, 2, 3), (2, 1, 4)]
+    popular = [(1, 9.6, 1000), (2, 9.3, 800)]
+    blocks, meta = build_blocks(catalog, ratings, popular)
+    return write_snapshot(root, blocks, meta)
+
+
+def corrupt(root, version):
+    path = os.path.join(root, version)
+    name = sorted(f for f in os.listdir(path) if f.endswith('.npy'))[0]
+    with open(os.path.join(path, name), 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+
+def test_corrupted_new_version_keeps_current_state(tmp_path):
+    root = str(tmp_path)
+    first = write_state(root, 5)
+    store = SnapshotStore(root)
+    assert store.refresh()
+    state = store.state
+    assert isinstance(state, RecommenderState) and store.version == first
+    second = write_state(root, 1)
+    corrupt(root, second)
+    assert not store.refresh()
+    assert store.state is state and store.version == first
+    # 加载失败的版本不再重试
+    assert second in store._failed and not store.refresh()
+
+
+def test_corrupted_current_version_falls_back_to_previous(tmp_path):
+    root = str(tmp_path)
+    first = write_state(root, 5)
+    second = write_state(root, 1)
+    corrupt(root, second)
+    store = SnapshotStore(root)
+    assert store.refresh()
+    assert isinstance(store.state, RecommenderState) and store.version == first
@@ -0,0 +1,149 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip('pymysql')
+
+import create_target_table as ct
+
+DUMP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data_spider', 'douban.sql')
+VALUE = re.compile(r"\(|\)|'((?:[^'\\]|\\.)*)'|(NULL)|,")
+
+
+def dump_rows():
+    """data_spider/douban.sql中douban_mov的全部行"""
+    rows = []
+    with open(DUMP, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.startswith('INSERT INTO `douban_mov`'):
+                continue
+            row = None
+            for m in VALUE.finditer(line, line.index(' VALUES ') + 8):
+                token = m.group(0)
+                if token == '(':
+                    row = []
+                elif token == ')':
+                    rows.append(tuple(row))
+                elif m.group(1) is not None:
+                    row.append(re.sub(r'\\(.)', r'\1', m.group(1)))
+                elif m.group(2):
+                    row.append(None)
+    return rows
+
+
+def legacy_normalize_row(row):
+    """重构前data_import中逐行清洗的逻辑（原样保留，作为对照）"""
+    has_num = ct.has_num
+    link = ''.join(row[3]).strip() if row[3] else ''
+    title = ''.join(row[0]).strip() if row[0] else ''
+    s = ''.join(row[1]).strip() if row[1] else ''
+    score = float(s) if has_num(s) else None
+    n = ''.join(row[2]).strip() if row[2] else ''
+    if n:
+        num_str = ''.join(c for c in n if c.isdigit())
+        num = int(num_str) if num_str else None
+    else:
+        num = None
+        score = None
+    other_release = None
+    temp_time = ''.join(row[4]).strip() if row[4] else ''
+    if has_num(temp_time):
+        time_str = ''.join(c for c in temp_time if c.isdigit() or c == '-')
+        address = ''.join(c for c in temp_time if not (c.isdigit() or c in '()-'))
+    else:
+        time_str = None
+        if '()' in temp_time:
+            address = ''.join(c for c in temp_time if c not in '()')
+        else:
+            address = None
+            other_release = temp_time
+    actor_str = row[5] if len(row) > 5 else ''
+    if actor_str:
+        actors = actor_str.replace(']', '').replace('[', '').replace("'", "").split(",")
+        actors = [element.strip() for element in actors]
+        for element in list(actors):
+            if has_num(element):
+                if other_release:
+                    other_release = other_release + ';' + element
+                else:
+                    other_release = element
+                actors.remove(element)
+        actor = ','.join(actors)
+    else:
+        actor = ''
+    return (title, score, num, link, time_str, address, other_release, actor)
+
+
+CASES = [
+    # douban.sql：上映日期混在主演列表开头
+    (('芳华', '7.8', '373011人评价', 'https://movie.douban.com/subject/26862829/', '2017-09-07(多伦多电影节)',
+      "['2017-12-15(中国大陆)', '黄轩', '苗苗', '钟楚曦', '杨采钰']"),
+     ('芳华', 7.8, 373011, 'https://movie.douban.com/subject/26862829/', '2017-09-07', '多伦多电影节',
+      '2017-12-15(中国大陆)', '黄轩,苗苗,钟楚曦,杨采钰')),
+    # douban.sql：多个上映日期按原顺序拼接
+    (('泰坦尼克号', '9.2', '729738人评价', 'https://movie.douban.com/subject/1292722/', '1997-11-01(东京电影节)',
+      "['1997-12-19(美国)', '1998-04-03(中国大陆)', '莱昂纳多·迪卡普里奥', '凯特·温丝莱特', '比利·赞恩']"),
+     ('泰坦尼克号', 9.2, 729738, 'https://movie.douban.com/subject/1292722/', '1997-11-01', '东京电影节',
+      '1997-12-19(美国);1998-04-03(中国大陆)', '莱昂纳多·迪卡普里奥,凯特·温丝莱特,比利·赞恩')),
+    # douban.sql：时间列没有数字时原值先进入other_release，再接主演中的片长
+    (('情不自禁', '8.4', '10775人评价', 'https://movie.douban.com/subject/1550445/', '潘粤明',
+      "['邬玉君', '陈友旺', '中国大陆', '方刚亮', '92分钟']"),
+     ('情不自禁', 8.4, 10775, 'https://movie.douban.com/subject/1550445/', None, None,
+      '潘粤明;92分钟', '邬玉君,陈友旺,中国大陆,方刚亮')),
+    # douban.sql：尚未上映，评分人数为空
+    (('草样年华', '(尚未上映)', '', 'https://movie.douban.com/subject/25920326/', '王可如',
+      "['刘冬沁', '谢治勋', '李欢', '包亚铭', '安戈']"),
+     ('草样年华', None, None, 'https://movie.douban.com/subject/25920326/', None, None,
+      '王可如', '刘冬沁,谢治勋,李欢,包亚铭,安戈')),
+    # douban.sql：重复的演员都保留
+    (('艾米粒日记', '7.7', '868人评价', 'https://movie.douban.com/subject/26826435/', '2016-06-24(中国大陆)',
+      "['舒子', '刘晓萌', '中国大陆', '舒子', '74分钟']"),
+     ('艾米粒日记', 7.7, 868, 'https://movie.douban.com/subject/26826435/', '2016-06-24', '中国大陆',
+      '74分钟', '舒子,刘晓萌,中国大陆,舒子')),
+    # 重复的含数字元素都移到other_release
+    (('电影', '8.0', '100人评价', 'l', '()', "['90分钟', '甲', '90分钟', '甲']"),
+     ('电影', 8.0, 100, 'l', None, '', '90分钟;90分钟', '甲,甲')),
+    # 空的时间列不产生前导分隔符
+    (('电影', '8.0', '100人评价', 'l', '', "['1999', '甲']"),
+     ('电影', 8.0, 100, 'l', None, None, '1999', '甲')),
+    # 没有主演
+    (('电影', None, '100人评价', 'l', None, None),
+     ('电影', None, 100, 'l', None, None, '', '')),
+]
+
+
+@pytest.mark.parametrize('row, expected', CASES)
+def test_normalize_row_cases(row, expected):
+    assert ct.normalize_row(row) == expected
+    assert legacy_normalize_row(row) == expected
+
+
+def test_normalize_row_matches_legacy_on_dump():
+    rows = dump_rows()
+    assert len(rows) > 10000
+    for row in rows:
+        assert ct.normalize_row(row) == legacy_normalize_row(row), row
+
+
+def delayed_first(item):
+    """序号越小执行越慢，结果完成的顺序与输入顺序相反"""
+    index, rows = item
+    time.sleep(0.05 * (4 - index) if index < 4 else 0)
+    return index, ct.normalize_chunk(rows)
+
+
+def test_ordered_map_keeps_input_order_with_workers():
+    chunks = list(ct.chunked(iter(dump_rows()[:800]), 100))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(ct.ordered_map(executor, delayed_first, enumerate(chunks), 3))
+    assert [index for index, _ in results] == list(range(len(chunks)))
+    assert [chunk for _, chunk in results] == [ct.normalize_chunk(chunk) for chunk in chunks]
+
+
+def test_normalized_chunks_parallel_matches_serial():
+    chunks = list(ct.chunked(iter(dump_rows()[:2000]), 150))
+    handle = ct.DataHandle()
+    assert list(handle.normalized_chunks(chunks, 3)) == list(handle.normalized_chunks(chunks, 1))
@@ -0,0 +1,25 @@
+from web_server.rate_limiter import RateLimiter, SHED_REPLY, BUSY_REPLY
+
+
+def test_read_command_replays_cached_reply():
+    limiter = RateLimiter()
+    limiter.remember('u1', '搜索 无问西东', '无问西东 ...')
+    assert limiter.shed_reply('u1', '搜索 无问西东') == '无问西东 ...'
+    assert limiter.shed_reply('u1', '搜索 芳华') == SHED_REPLY
+
+
+def test_write_command_is_never_replayed():
+    limiter = RateLimiter()
+    limiter.remember('u1', '评价 秦时明月 8.9', '评价成功，感谢您的支持。秦时明月:8.9分')
+    # 被降级的评价没有写入，不能回复“评价成功”
+    assert limiter.shed_reply('u1', '评价 秦时明月 8.9') == BUSY_REPLY
+    assert limiter.shed_reply('u1', 'event:subscribe') == BUSY_REPLY
+    assert limiter.stats()['shed_write'] == 2
+    assert limiter.stats()['cache_hits'] == 0
+
+
+def test_write_does_not_evict_cached_read_reply():
+    limiter = RateLimiter()
+    limiter.remember('u1', '推荐', '为您推荐 ...')
+    limiter.remember('u1', '评价 芳华 8', '评价成功，感谢您的支持。芳华:8分')
+    assert limiter.shed_reply('u1', '推荐') == '为您推荐 ...'
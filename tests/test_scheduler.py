@@ -0,0 +1,123 @@
+import time
+import datetime
+import threading
+
+import pytest
+
+from web_server.scheduler import CronSchedule, Job, Scheduler, JOB_RUNS
+
+
+def at(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.01)
+
+
+def runs(name, outcome):
+    return JOB_RUNS.collect().get((name, outcome), 0)
+
+
+def fires(expression, *start):
+    return datetime.datetime.fromtimestamp(CronSchedule(expression).next_after(at(*start)))
+
+
+def test_daily_expression():
+    assert fires('30 3 * * *', 2025, 7, 18, 1, 0) == datetime.datetime(2025, 7, 18, 3, 30)
+    assert fires('30 3 * * *', 2025, 7, 18, 3, 30) == datetime.datetime(2025, 7, 19, 3, 30)
+
+
+def test_lists_ranges_and_steps():
+    schedule = CronSchedule('*/15 8-10 * * *')
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.hours == {8, 9, 10}
+    assert CronSchedule('5,10 0 1 1 *').minutes == {5, 10}
+    assert fires('*/15 8-10 * * *', 2025, 7, 18, 10, 50) == datetime.datetime(2025, 7, 19, 8, 0)
+
+
+def test_day_of_month_or_weekday_like_cron():
+    # 2025-07-18是周五；日和周都限制时满足其一即可
+    assert fires('0 0 20 * 0', 2025, 7, 18, 12, 0) == datetime.datetime(2025, 7, 20, 0, 0)
+    assert fires('0 0 19 * 1', 2025, 7, 18, 12, 0) == datetime.datetime(2025, 7, 19, 0, 0)
+    assert fires('0 0 * * 1', 2025, 7, 18, 12, 0) == datetime.datetime(2025, 7, 21, 0, 0)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '0 24 * * *', '0 0 0 * *', '5-1 * * * *', '*/0 * * * *'])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_impossible_date_raises():
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 31 2 *').next_after(at(2025, 1, 1))
+
+
+def test_job_needs_interval_or_cron():
+    with pytest.raises(ValueError):
+        Job('both', lambda: None, interval=60, cron='* * * * *')
+    with pytest.raises(ValueError):
+        Job('neither', lambda: None)
+
+
+def test_overlapping_run_is_skipped_and_run_now_refused():
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(time.time())
+        release.wait(5)
+
+    scheduler = Scheduler()
+    scheduler.add('overlap', slow, interval=0.02, run_at_start=True)
+    scheduler.start()
+    try:
+        wait_until(lambda: runs('overlap', 'skipped') >= 2)
+        assert len(calls) == 1
+        assert scheduler.stats()['overlap']['running'] is True
+        assert scheduler.run_now('overlap') is False
+        release.set()
+        wait_until(lambda: runs('overlap', 'ok') >= 1)
+    finally:
+        release.set()
+        scheduler.stop(wait=True)
+
+
+def test_failure_is_recorded_in_last_error():
+    def broken():
+        raise ValueError('boom')
+
+    scheduler = Scheduler()
+    scheduler.add('broken', broken, interval=3600)
+    try:
+        assert scheduler.run_now('broken') is True
+        wait_until(lambda: runs('broken', 'error') == 1)
+        wait_until(lambda: not scheduler.stats()['broken']['running'])
+        stats = scheduler.stats()['broken']
+        assert stats['last_error'] == 'ValueError: boom'
+        assert stats['last_success'] is None
+        # 失败后可以再次执行
+        assert scheduler.run_now('broken') is True
+        wait_until(lambda: runs('broken', 'error') == 2)
+    finally:
+        scheduler.stop(wait=True)
+
+
+def test_stop_ends_the_loop_and_no_more_runs():
+    calls = []
+    scheduler = Scheduler()
+    scheduler.add('tick', lambda: calls.append(1), interval=0.02, run_at_start=True)
+    scheduler.start()
+    wait_until(lambda: len(calls) >= 2)
+    scheduler.stop(wait=True)
+    scheduler._thread.join(1)
+    assert not scheduler._thread.is_alive()
+    stopped_at = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == stopped_at
+    assert scheduler.stats()['tick']['last_success'] is not None
@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+
+from web_server.seek_partitions import SeekPartitions
+
+
+class FakeCursor(object):
+
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(sql.split(' (')[0] if sql.startswith('CREATE') else sql)
+
+
+class FakeDB(object):
+    """记录执行过的SQL；查询MAX(id)时旧表多出100行新写入（cap为None时一直增长）"""
+
+    def __init__(self, copied_total=300, cap=300):
+        self.log = []
+        self.max_id = 100
+        self.copied_total = copied_total
+        self.cap = cap
+        self.max_reads = 0
+
+    @contextmanager
+    def transaction(self):
+        yield FakeCursor(self.log)
+
+    def execute_query(self, sql, params=None, primary=False):
+        self.log.append(sql)
+        if 'PARTITION_NAME' in sql:
+            return []
+        if 'MIN(NULLIF' in sql:
+            return [{'first_time': 1700000000, 'max_id': self.max_id}]
+        if 'COUNT(*) AS total, COALESCE' in sql:
+            return [{'total': 300, 'max_id': 300}]
+        if 'COUNT(*)' in sql:
+            return [{'total': self.copied_total}]
+        self.max_reads += 1
+        if self.max_reads > 100:
+            raise AssertionError('复制一直在重读MAX(id)，没有结束')
+        if self.cap is None or self.max_id < self.cap:
+            self.max_id += 100
+        return [{'max_id': self.max_id}]
+
+    def execute_update(self, sql, params=None):
+        self.log.append(sql)
+        return 0
+
+
+def test_migrate_swaps_tables_under_lock():
+    db = FakeDB()
+    assert SeekPartitions(db, copy_batch=50).migrate()
+    lock = db.log.index('LOCK TABLES seek_movie WRITE, seek_movie_partitioned WRITE')
+    statements = db.log[lock:lock + 4]
+    assert 'WHERE id > %s' in statements[1] and 'INSERT IGNORE' in statements[1]
+    assert statements[2].startswith('RENAME TABLE seek_movie TO seek_movie_unpartitioned')
+    assert statements[3] == 'UNLOCK TABLES'
+    assert not any('AUTO_INCREMENT =' in sql for sql in db.log)
+
+
+def test_migrate_reports_row_mismatch():
+    assert not SeekPartitions(FakeDB(copied_total=299), copy_batch=50).migrate()
+
+
+def test_migrate_finishes_while_writes_keep_arriving():
+    db = FakeDB(cap=None)
+    assert SeekPartitions(db, copy_batch=50).migrate()
+    copies = [sql for sql in db.log if sql.startswith('INSERT IGNORE') and 'AND id <= %s' in sql]
+    # 两轮不加锁的复制各自只复制到开始时的最大id（200和300），之后的写入由锁内的最后一段复制
+    assert len(copies) == 4 + 2
+    assert 'RENAME TABLE' in ' '.join(db.log)
+
+
+class PmaxOnlyDB(FakeDB):
+    """只有pmax分区的新表"""
+
+    def __init__(self, first_time):
+        super().__init__()
+        self.first_time = first_time
+
+    def execute_query(self, sql, params=None, primary=False):
+        self.log.append(sql)
+        if 'PARTITION_NAME' in sql:
+            return [{'PARTITION_NAME': 'pmax', 'PARTITION_DESCRIPTION': 'MAXVALUE'}]
+        return [{'first_time': self.first_time}]
+
+
+def test_first_split_starts_at_oldest_month():
+    now = int(time.mktime((2025, 7, 18, 12, 0, 0, 0, 0, -1)))
+    first = int(time.mktime((2025, 4, 3, 12, 0, 0, 0, 0, -1)))
+    db = PmaxOnlyDB(first)
+    assert SeekPartitions(db, months_ahead=2).ensure_future_partitions(now) == 6
+    reorganize = [sql for sql in db.log if 'REORGANIZE PARTITION pmax' in sql][0]
+    for name in ('p202504', 'p202505', 'p202506', 'p202507', 'p202508', 'p202509'):
+        assert f'PARTITION {name} ' in reorganize
+    assert 'p202503' not in reorganize
+
+
+def test_first_split_of_empty_table_starts_at_current_month():
+    now = int(time.mktime((2025, 7, 18, 12, 0, 0, 0, 0, -1)))
+    db = PmaxOnlyDB(None)
+    assert SeekPartitions(db, months_ahead=2).ensure_future_partitions(now) == 3
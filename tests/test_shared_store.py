@@ -0,0 +1,75 @@
+import os
+import threading
+
+import pytest
+
+from web_server.shared_store import SharedStoreWriter, SharedStoreReader, catalog_columns
+
+
+def movie(movie_id, title, score=None):
+    return {'id': movie_id, 'title': title, 'score': score, 'num': 10, 'link': None, 'time': '2020',
+            'address': '中国大陆', 'other_release': None, 'actors': '演员'}
+
+
+@pytest.fixture
+def writer():
+    writer = SharedStoreWriter(f'test-store-{os.getpid()}')
+    yield writer
+    writer.close()
+
+
+def test_reader_sees_published_generation(writer):
+    reader = SharedStoreReader(writer.name)
+    assert reader.get() is None
+    writer.publish({'movies': catalog_columns([movie(2, '活着', 9.3), movie(1, '霸王别姬')])})
+    view = reader.get()
+    assert view.generation == 1 and len(view) == 2
+    rows = view.rows([1, 2, 3])
+    assert sorted(rows) == [1, 2]
+    assert rows[1]['title'] == '霸王别姬' and rows[1]['score'] is None and rows[1]['link'] is None
+    assert rows[2]['score'] == 9.3
+    writer.publish({'movies': catalog_columns([movie(3, '大话西游')])})
+    assert reader.get().generation == 2
+
+
+def test_reader_keeps_current_view_while_writer_holds_seqlock(writer):
+    reader = SharedStoreReader(writer.name)
+    writer.publish({'movies': catalog_columns([movie(1, '霸王别姬')])})
+    view = reader.get()
+    seq = writer._seq[0]
+    writer._seq[0] = seq + 1
+    try:
+        assert reader._read_descriptor(retries=3) is None
+        assert reader.get() is view
+    finally:
+        writer._seq[0] = seq
+
+
+def test_concurrent_reads_never_see_torn_descriptor(writer):
+    reader = SharedStoreReader(writer.name)
+    writer.publish({'movies': catalog_columns([movie(1, 'x')])})
+    reader.get()
+    done = threading.Event()
+    seen, errors = [], []
+
+    def read():
+        while not done.is_set():
+            try:
+                descriptor = reader._read_descriptor()
+            except Exception as e:
+                errors.append(e)
+                return
+            if descriptor is not None:
+                seen.append(descriptor['generation'])
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    try:
+        for i in range(2, 60):
+            # 描述符长度随代号变化，读到不一致的内容时json解析会失败
+            writer.publish({'movies': catalog_columns([movie(m, 't' * i) for m in range(1, i)])})
+    finally:
+        done.set()
+        thread.join()
+    assert not errors
+    assert seen and seen == sorted(seen)
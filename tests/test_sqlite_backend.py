@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from web_server.sqlite_backend import translate, create_table_statements, schema_statements
+
+
+def test_translate_placeholders_and_insert_ignore():
+    assert translate('INSERT IGNORE INTO t (a, b) VALUES (%s, %s)') == 'INSERT OR IGNORE INTO t (a, b) VALUES (?, ?)'
+    assert translate('EXPLAIN SELECT * FROM t WHERE id = %s') == 'EXPLAIN QUERY PLAN SELECT * FROM t WHERE id = ?'
+    assert translate('select 1') == 'select 1'
+
+
+def test_translate_on_duplicate_key_update():
+    sql = translate('INSERT INTO like_movie (user_id, movie_id, liking) VALUES (%s, %s, %s) '
+                    'ON DUPLICATE KEY UPDATE liking = VALUES(liking), `num` = VALUES(`num`)')
+    assert sql == ('INSERT INTO like_movie (user_id, movie_id, liking) VALUES (?, ?, ?) '
+                   'ON CONFLICT DO UPDATE SET liking = excluded.liking, `num` = excluded.num')
+
+
+MYSQL_TABLE = '''CREATE TABLE `seek_movie` (
+    `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `user_id` INT NOT NULL,
+    `movie_id` INT NOT NULL,
+    `updated` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY `uniq_user_movie` (`user_id`, `movie_id`),
+    KEY `idx_movie_id` (`movie_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (`id`) (PARTITION pmax VALUES LESS THAN MAXVALUE);'''
+
+
+def test_create_table_statements():
+    create, index = create_table_statements(MYSQL_TABLE)
+    assert create.startswith('CREATE TABLE IF NOT EXISTS `seek_movie`')
+    assert '`id` INTEGER PRIMARY KEY AUTOINCREMENT' in create
+    assert 'PRIMARY KEY (`id`)' not in create
+    assert 'UNIQUE (`user_id`, `movie_id`)' in create
+    assert 'UNSIGNED' not in create and 'ON UPDATE' not in create and 'ENGINE' not in create
+    assert index == 'CREATE INDEX IF NOT EXISTS `seek_movie_idx_movie_id` ON `seek_movie` (`movie_id`)'
+
+    db = sqlite3.connect(':memory:')
+    db.execute(create)
+    db.execute(index)
+    insert = translate('INSERT IGNORE INTO seek_movie (user_id, movie_id) VALUES (%s, %s)')
+    db.executemany(insert, [(1, 2), (1, 2), (1, 3)])
+    assert db.execute('SELECT COUNT(*) FROM seek_movie').fetchone()[0] == 2
+
+
+def test_project_schema_loads_into_sqlite():
+    db = sqlite3.connect(':memory:')
+    for statement in schema_statements():
+        db.execute(statement)
+    tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'douban_movie', 'user_info', 'like_movie', 'seek_movie'} <= tables
+
+
+DB_MANAGER_WITHOUT_PYMYSQL = '''
+import sys
+sys.modules['pymysql'] = None
+from web_server.config_parser import ConfigParser
+ConfigParser.get_database_config = lambda self: {'backend': 'sqlite', 'sqlite_path': sys.argv[1]}
+from web_server.db_manager import db_manager
+db_manager.execute_update('INSERT INTO user_info (wx_id, start_time) VALUES (%s, %s)', ('openid', 1))
+print(db_manager.execute_query('SELECT wx_id FROM user_info')[0]['wx_id'])
+'''
+
+
+def test_sqlite_backend_does_not_need_pymysql(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-c', DB_MANAGER_WITHOUT_PYMYSQL, str(tmp_path / 'douban.sqlite3')],
+        cwd=root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == 'openid'
@@ -0,0 +1,35 @@
+from web_server.trending import SlidingCountMinSketch, TrendingTracker
+
+
+def test_sketch_never_underestimates():
+    sketch = SlidingCountMinSketch(window=60, slots=6, depth=4, width=64)
+    for i in range(500):
+        sketch.add(i % 50, now=0)
+    assert all(sketch.estimate(i) >= 10 for i in range(50))
+
+
+def test_sketch_expires_old_slots():
+    sketch = SlidingCountMinSketch(window=60, slots=6, depth=4, width=256)
+    sketch._current = 0
+    sketch.add('a', 5, now=0)
+    sketch.add('a', 3, now=30)
+    assert sketch.estimate('a') == 8
+    assert sketch.advance(now=65)
+    assert sketch.estimate('a') == 3
+    assert not sketch.advance(now=66)
+    sketch.advance(now=200)
+    assert sketch.estimate('a') == 0
+
+
+def test_full_candidate_set_admits_current_movie_after_window():
+    tracker = TrendingTracker(window=3600, slots=12, capacity=50, width=4096)
+    tracker.sketch._current = 0
+    for movie_id in range(50):
+        for _ in range(100):
+            tracker.record(movie_id, 'old', now=0)
+    later = 3600 * 2
+    for _ in range(60):
+        tracker.record(999, 'new', now=later)
+    assert tracker._candidates[999] >= 60
+    assert len(tracker._candidates) == 50
+    assert max(tracker._candidates, key=tracker._candidates.get) == 999
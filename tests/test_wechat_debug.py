@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from wechat_debug import percentile
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert percentile(values, 10) == 1
+    assert percentile(values, 50) == 5
+    assert percentile(values, 100) == 10
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_percentile_edges():
+    assert percentile([], 50) == 0.0
+    assert percentile([7], 0) == 7
+    assert percentile([7], 99) == 7
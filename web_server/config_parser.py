@@ -53,7 +53,19 @@ class ConfigParser:
             'charset': 'utf8mb4',
             'pool_size': '5',
             'timeout': '60',
-            'reconnect_attempts': '3'
+            'reconnect_attempts': '3',
+            'slow_query_ms': '200',
+            'trace_top_n': '20',
+            'explain_slow_queries': 'false',
+            'n_plus_one_threshold': '10',
+            'seek_retention_months': '12',
+            'replicas': '',
+            'replica_max_lag_seconds': '5',
+            'replica_check_interval': '5',
+            'read_your_writes_seconds': '5',
+            'backend': 'mysql',
+            'sqlite_path': '',
+            'sqlite_cache_mb': '64'
         }
         
         # 服务配置
@@ -62,14 +74,44 @@ class ConfigParser:
             'token': 'HelloMovieRecommender',
             'encoding_key': 'X5hyGsEzWugANKlq9uDjtpGQZ40yL1axD9m147dPa1a',
             'debug': 'false',
-            'log_level': 'INFO'
+            'log_level': 'INFO',
+            'rate_limit_per_user': '0.5',
+            'rate_limit_burst': '5',
+            'max_inflight': '20',
+            'reply_cache_ttl': '300',
+            'admin_token': '',
+            'log_format': 'text',
+            'log_queue_size': '10000',
+            'log_sample_rates': '',
+            'shared_store_name': ''
         }
         
         # 推荐系统配置
         self.config['recommender'] = {
             'similarity_threshold': '0.5',
             'min_ratings': '3',
-            'max_recommendations': '10'
+            'max_recommendations': '10',
+            'content_model_path': '',
+            'weight_user_cf': '0.35',
+            'weight_item_cf': '0.25',
+            'weight_content': '0.25',
+            'weight_popularity': '0.15',
+            'stage_timeout_ms': '150',
+            'weight_implicit': '0.1',
+            'implicit_half_life_days': '14',
+            'snapshot_dir': ''
+        }
+        
+        self.config['scheduler'] = {
+            'enabled': 'true',
+            'max_workers': '2',
+            'jitter_seconds': '10',
+            'popularity_interval': '300',
+            'ratings_interval': '300',
+            'snapshot_check_interval': '5',
+            'implicit_feedback_interval': '600',
+            'seek_maintenance_cron': '',
+            'snapshot_build_cron': ''
         }
     
     def get_section(self, section):
@@ -77,7 +119,7 @@ class ConfigParser:
         获取指定配置部分
         
         参数:
-            section: 配置部分名称 (database, service, recommender)
+            section: 配置部分名称 (database, service, recommender, scheduler)
         
         返回:
             dict: 配置部分字典
@@ -88,6 +130,8 @@ class ConfigParser:
             return self.get_service_config()
         elif section == 'recommender':
             return self.get_recommender_config()
+        elif section == 'scheduler':
+            return self.get_scheduler_config()
         else:
             # 对于未知部分，尝试直接获取
             try:
@@ -117,7 +161,19 @@ class ConfigParser:
                 'charset': self.config.get('database', 'charset', fallback='utf8mb4'),
                 'pool_size': self.config.getint('database', 'pool_size', fallback=5),
                 'timeout': self.config.getint('database', 'timeout', fallback=60),
-                'reconnect_attempts': self.config.getint('database', 'reconnect_attempts', fallback=3)
+                'reconnect_attempts': self.config.getint('database', 'reconnect_attempts', fallback=3),
+                'slow_query_ms': self.config.getint('database', 'slow_query_ms', fallback=200),
+                'trace_top_n': self.config.getint('database', 'trace_top_n', fallback=20),
+                'explain_slow_queries': self.config.getboolean('database', 'explain_slow_queries', fallback=False),
+                'n_plus_one_threshold': self.config.getint('database', 'n_plus_one_threshold', fallback=10),
+                'seek_retention_months': self.config.getint('database', 'seek_retention_months', fallback=12),
+                'replicas': self.config.get('database', 'replicas', fallback=''),
+                'replica_max_lag_seconds': self.config.getint('database', 'replica_max_lag_seconds', fallback=5),
+                'replica_check_interval': self.config.getint('database', 'replica_check_interval', fallback=5),
+                'read_your_writes_seconds': self.config.getint('database', 'read_your_writes_seconds', fallback=5),
+                'backend': self.config.get('database', 'backend', fallback='mysql'),
+                'sqlite_path': self.config.get('database', 'sqlite_path', fallback=''),
+                'sqlite_cache_mb': self.config.getint('database', 'sqlite_cache_mb', fallback=64)
             }
             return db_config
         except Exception as e:
@@ -144,7 +200,16 @@ class ConfigParser:
                 'token': self.config.get('service', 'token', fallback='HelloMovieRecommender'),
                 'encoding_key': self.config.get('service', 'encoding_key', fallback='X5hyGsEzWugANKlq9uDjtpGQZ40yL1axD9m147dPa1a'),
                 'debug': self.config.getboolean('service', 'debug', fallback=False),
-                'log_level': self.config.get('service', 'log_level', fallback='INFO')
+                'log_level': self.config.get('service', 'log_level', fallback='INFO'),
+                'rate_limit_per_user': self.config.getfloat('service', 'rate_limit_per_user', fallback=0.5),
+                'rate_limit_burst': self.config.getint('service', 'rate_limit_burst', fallback=5),
+                'max_inflight': self.config.getint('service', 'max_inflight', fallback=20),
+                'reply_cache_ttl': self.config.getint('service', 'reply_cache_ttl', fallback=300),
+                'admin_token': self.config.get('service', 'admin_token', fallback=''),
+                'log_format': self.config.get('service', 'log_format', fallback='text'),
+                'log_queue_size': self.config.getint('service', 'log_queue_size', fallback=10000),
+                'log_sample_rates': self.config.get('service', 'log_sample_rates', fallback=''),
+                'shared_store_name': self.config.get('service', 'shared_store_name', fallback='')
             }
             return service_config
         except Exception as e:
@@ -154,7 +219,16 @@ class ConfigParser:
                 'token': 'HelloMovieRecommender',
                 'encoding_key': 'X5hyGsEzWugANKlq9uDjtpGQZ40yL1axD9m147dPa1a',
                 'debug': False,
-                'log_level': 'INFO'
+                'log_level': 'INFO',
+                'rate_limit_per_user': 0.5,
+                'rate_limit_burst': 5,
+                'max_inflight': 20,
+                'reply_cache_ttl': 300,
+                'admin_token': '',
+                'log_format': 'text',
+                'log_queue_size': 10000,
+                'log_sample_rates': '',
+                'shared_store_name': ''
             }
     
     def get_recommender_config(self):
@@ -168,7 +242,16 @@ class ConfigParser:
             recommender_config = {
                 'similarity_threshold': self.config.getfloat('recommender', 'similarity_threshold', fallback=0.5),
                 'min_ratings': self.config.getint('recommender', 'min_ratings', fallback=3),
-                'max_recommendations': self.config.getint('recommender', 'max_recommendations', fallback=10)
+                'max_recommendations': self.config.getint('recommender', 'max_recommendations', fallback=10),
+                'content_model_path': self.config.get('recommender', 'content_model_path', fallback=''),
+                'weight_user_cf': self.config.getfloat('recommender', 'weight_user_cf', fallback=0.35),
+                'weight_item_cf': self.config.getfloat('recommender', 'weight_item_cf', fallback=0.25),
+                'weight_content': self.config.getfloat('recommender', 'weight_content', fallback=0.25),
+                'weight_popularity': self.config.getfloat('recommender', 'weight_popularity', fallback=0.15),
+                'stage_timeout_ms': self.config.getint('recommender', 'stage_timeout_ms', fallback=150),
+                'weight_implicit': self.config.getfloat('recommender', 'weight_implicit', fallback=0.1),
+                'implicit_half_life_days': self.config.getfloat('recommender', 'implicit_half_life_days', fallback=14.0),
+                'snapshot_dir': self.config.get('recommender', 'snapshot_dir', fallback='')
             }
             return recommender_config
         except Exception as e:
@@ -176,7 +259,50 @@ class ConfigParser:
             return {
                 'similarity_threshold': 0.5,
                 'min_ratings': 3,
-                'max_recommendations': 10
+                'max_recommendations': 10,
+                'content_model_path': '',
+                'weight_user_cf': 0.35,
+                'weight_item_cf': 0.25,
+                'weight_content': 0.25,
+                'weight_popularity': 0.15,
+                'stage_timeout_ms': 150,
+                'weight_implicit': 0.1,
+                'implicit_half_life_days': 14.0,
+                'snapshot_dir': ''
+            }
+    
+    def get_scheduler_config(self):
+        """
+        获取后台任务调度配置
+        
+        返回:
+            dict: 调度配置字典
+        """
+        try:
+            scheduler_config = {
+                'enabled': self.config.getboolean('scheduler', 'enabled', fallback=True),
+                'max_workers': self.config.getint('scheduler', 'max_workers', fallback=2),
+                'jitter_seconds': self.config.getfloat('scheduler', 'jitter_seconds', fallback=10.0),
+                'popularity_interval': self.config.getint('scheduler', 'popularity_interval', fallback=300),
+                'ratings_interval': self.config.getint('scheduler', 'ratings_interval', fallback=300),
+                'snapshot_check_interval': self.config.getint('scheduler', 'snapshot_check_interval', fallback=5),
+                'implicit_feedback_interval': self.config.getint('scheduler', 'implicit_feedback_interval', fallback=600),
+                'seek_maintenance_cron': self.config.get('scheduler', 'seek_maintenance_cron', fallback=''),
+                'snapshot_build_cron': self.config.get('scheduler', 'snapshot_build_cron', fallback='')
+            }
+            return scheduler_config
+        except Exception as e:
+            print(f"获取调度配置出错: {str(e)}，将使用默认配置")
+            return {
+                'enabled': True,
+                'max_workers': 2,
+                'jitter_seconds': 10.0,
+                'popularity_interval': 300,
+                'ratings_interval': 300,
+                'snapshot_check_interval': 5,
+                'implicit_feedback_interval': 600,
+                'seek_maintenance_cron': '',
+                'snapshot_build_cron': ''
             }
 
 # 测试代码
@@ -185,4 +311,5 @@ if __name__ == "__main__":
     print("数据库配置:", config_parser.get_database_config())
     print("服务配置:", config_parser.get_service_config())
     print("推荐系统配置:", config_parser.get_recommender_config())
+    print("调度配置:", config_parser.get_scheduler_config())
     print("通过get_section获取数据库配置:", config_parser.get_section('database')) 
\ No newline at end of file
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基于内容的推荐模块
+用电影的演员、导演、类型、地区和上映年代构造稀疏TF-IDF特征（CSR格式，行向量已归一化），
+用户画像为其评分电影特征的加权和，按余弦相似度为评分很少的新用户排序整个片库
+特征矩阵离线构建并保存为.npz文件，服务启动时加载，打分只需一次稀疏矩阵向量乘
+作者：电影推荐系统团队
+日期：2025-07-08
+"""
+
+import os
+import re
+import time
+import math
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from .logger import movie_recommender_logger as logger
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_PATH = os.path.join(PROJECT_ROOT, 'models', 'content_features.npz')
+
+# 各字段特征的权重（导演、类型比单个演员更能代表口味）
+FIELD_WEIGHTS = {
+    'actor': 1.0,
+    'director': 1.5,
+    'category': 1.2,
+    'address': 0.8,
+    'decade': 0.5,
+}
+
+# 只出现在一部电影中的特征对相似度没有贡献
+MIN_DF = 2
+
+CATALOG_SQL = 'select id, actors, director, category, address, time from douban_movie'
+
+_SPLIT = re.compile(r'[,，/、\s]+')
+
+
+def _tokens(text):
+    """按逗号、斜杠、空白等切分多值字段"""
+    if not text:
+        return []
+    return [token for token in _SPLIT.split(str(text)) if token]
+
+
+def movie_features(actors, director, category, address, release):
+    """
+    提取一部电影的特征
+
+    参数:
+        actors: 主演（逗号分隔）
+        director: 导演（逗号分隔）
+        category: 类型（逗号分隔）
+        address: 上映地区
+        release: 上映日期（date、字符串或None）
+
+    返回:
+        list: (字段, 特征值) 列表，已去重
+    """
+    features = set()
+    for field, text in (('actor', actors), ('director', director), ('category', category)):
+        features.update((field, token) for token in _tokens(text))
+    for token in _tokens(address):
+        features.add(('address', token))
+    year = getattr(release, 'year', None)
+    if year is None and release:
+        match = re.match(r'(\d{4})', str(release))
+        year = int(match.group(1)) if match else None
+    if year:
+        features.add(('decade', str(year // 10 * 10)))
+    return sorted(features)
+
+
+class ContentModel(object):
+    """电影特征矩阵（CSR）及打分"""
+
+    # 全部数组列（含由CSR派生的行号和排序索引），columns()/from_columns()按此保存和恢复
+    COLUMNS = ('movie_ids', 'indptr', 'indices', 'data', 'rows', 'sorted_ids', 'sorted_rows')
+
+    def __init__(self, movie_ids, indptr, indices, data, num_features, built_at=None):
+        """
+        初始化模型
+
+        参数:
+            movie_ids: 各行对应的电影id
+            indptr, indices, data: CSR格式的特征矩阵，行向量L2归一化
+            num_features: 特征数
+            built_at: 构建时间戳
+        """
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.num_features = int(num_features)
+        self.built_at = built_at or time.time()
+        # 每个非零元素所在的行，用于向量化的矩阵向量乘
+        self.rows = np.repeat(np.arange(len(self.movie_ids), dtype=np.int32), np.diff(self.indptr))
+        order = np.argsort(self.movie_ids, kind='stable')
+        self.sorted_ids = self.movie_ids[order]
+        self.sorted_rows = order
+
+    @classmethod
+    def from_columns(cls, columns, num_features, built_at):
+        """
+        由已计算好的列构造（如快照中的只读内存映射数组），不复制也不重新计算
+
+        参数:
+            columns: {列名: 数组}，包含COLUMNS中的全部列
+            num_features: 特征数
+            built_at: 构建时间戳
+
+        返回:
+            ContentModel: 模型
+        """
+        model = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(model, name, columns[name])
+        model.num_features = int(num_features)
+        model.built_at = float(built_at)
+        return model
+
+    def columns(self):
+        """
+        返回:
+            dict: {列名: 数组}
+        """
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    @classmethod
+    def build(cls, catalog):
+        """
+        从片库构建模型
+
+        参数:
+            catalog: (id, actors, director, category, address, time) 行的可迭代对象
+
+        返回:
+            ContentModel: 模型
+        """
+        movie_ids = []
+        movie_features_list = []
+        df = Counter()
+        for movie_id, actors, director, category, address, release in catalog:
+            features = movie_features(actors, director, category, address, release)
+            movie_ids.append(movie_id)
+            movie_features_list.append(features)
+            df.update(features)
+
+        total = len(movie_ids)
+        vocabulary = {}
+        idf = []
+        for feature, count in sorted(df.items()):
+            if count < MIN_DF:
+                continue
+            vocabulary[feature] = len(idf)
+            # 平滑idf，乘以字段权重
+            idf.append((math.log((1 + total) / (1 + count)) + 1) * FIELD_WEIGHTS[feature[0]])
+
+        indptr = [0]
+        indices = []
+        data = []
+        for features in movie_features_list:
+            columns = [vocabulary[f] for f in features if f in vocabulary]
+            weights = np.array([idf[c] for c in columns], dtype=np.float64)
+            norm = np.sqrt(np.dot(weights, weights)) if len(columns) else 0.0
+            indices.extend(columns)
+            data.extend((weights / norm).tolist() if norm else [])
+            indptr.append(len(indices))
+        logger.info(f"内容特征构建完成：{total} 部电影，{len(idf)} 个特征，{len(indices)} 个非零元素")
+        return cls(movie_ids, indptr, indices, data, len(idf))
+
+    def save(self, path):
+        """
+        保存到.npz文件（先写临时文件再替换）
+
+        参数:
+            path: 文件路径
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, movie_ids=self.movie_ids, indptr=self.indptr, indices=self.indices,
+                 data=self.data, num_features=np.int64(self.num_features), built_at=np.float64(self.built_at))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        从.npz文件加载
+
+        参数:
+            path: 文件路径
+
+        返回:
+            ContentModel: 模型
+        """
+        with np.load(path) as f:
+            return cls(f['movie_ids'], f['indptr'], f['indices'], f['data'],
+                       int(f['num_features']), float(f['built_at']))
+
+    def row_of(self, movie_ids):
+        """
+        电影id对应的行号
+
+        参数:
+            movie_ids: 电影id数组
+
+        返回:
+            tuple: (行号数组, 是否在片库中的布尔数组)
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        pos = np.searchsorted(self.sorted_ids, movie_ids)
+        pos = np.minimum(pos, len(self.sorted_ids) - 1)
+        found = self.sorted_ids[pos] == movie_ids if len(self.sorted_ids) else np.zeros(len(movie_ids), bool)
+        return self.sorted_rows[pos], found
+
+    def profile(self, ratings):
+        """
+        用户画像：评分电影特征按(评分-5)/5加权求和，喜欢的电影为正、不喜欢的为负
+
+        参数:
+            ratings: {电影id: 评分(0-10)}
+
+        返回:
+            numpy.ndarray: 特征空间中的向量，没有正向信号时为None
+        """
+        if not ratings or not self.num_features:
+            return None
+        rows, found = self.row_of(list(ratings.keys()))
+        weights = (np.asarray(list(ratings.values()), dtype=np.float32) - 5.0) / 5.0
+        rows, weights = rows[found], weights[found]
+        if not len(rows) or weights.max() <= 0:
+            return None
+        vector = np.zeros(self.num_features, dtype=np.float32)
+        for row, weight in zip(rows, weights):
+            start, end = self.indptr[row], self.indptr[row + 1]
+            vector[self.indices[start:end]] += weight * self.data[start:end]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def scores(self, vector):
+        """
+        片库中每部电影与画像的余弦相似度（行向量已归一化，即矩阵向量乘）
+
+        参数:
+            vector: 归一化的画像向量
+
+        返回:
+            numpy.ndarray: 与movie_ids对应的相似度
+        """
+        return np.bincount(self.rows, weights=self.data * vector[self.indices],
+                           minlength=len(self.movie_ids))
+
+    def recommend(self, ratings, n=10, exclude=()):
+        """
+        按内容相似度推荐
+
+        参数:
+            ratings: {电影id: 评分(0-10)}
+            n: 推荐数量
+            exclude: 不推荐的电影id（评分过的电影总会排除）
+
+        返回:
+            list: [(电影id, 相似度), ...]，按相似度降序
+        """
+        vector = self.profile(ratings)
+        if vector is None:
+            return []
+        scores = self.scores(vector)
+        skip = list(ratings.keys()) + list(exclude)
+        rows, found = self.row_of(skip)
+        scores[rows[found]] = -np.inf
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n] if n else np.array([], dtype=np.int64)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self.movie_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class ContentRecommender(object):
+    """加载并持有内容模型，文件更新后自动重新加载"""
+
+    def __init__(self, path=DEFAULT_MODEL_PATH):
+        """
+        初始化
+
+        参数:
+            path: 模型文件路径
+        """
+        self.path = path
+        self.model = None
+        self._mtime = None
+
+    def get(self):
+        """
+        当前模型，文件不存在或加载失败时为None
+
+        返回:
+            ContentModel: 模型
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self.model
+        if mtime != self._mtime:
+            try:
+                started = time.time()
+                self.model = ContentModel.load(self.path)
+                logger.info(f"已加载内容模型 {self.path}，用时 {(time.time() - started) * 1000:.1f} 毫秒")
+            except Exception as e:
+                logger.error(f"加载内容模型 {self.path} 失败: {str(e)}")
+            self._mtime = mtime
+        return self.model
+
+    def recommend(self, ratings, n=10, exclude=()):
+        """
+        按内容相似度推荐，模型不可用时返回空列表
+
+        参数:
+            ratings: {电影id: 评分(0-10)}
+            n: 推荐数量
+            exclude: 不推荐的电影id
+
+        返回:
+            list: [(电影id, 相似度), ...]
+        """
+        model = self.get()
+        if model is None:
+            return []
+        return model.recommend(ratings, n, exclude)
+
+
+def catalog_rows(db_manager):
+    """
+    读取douban_movie中构建模型所需的列
+
+    参数:
+        db_manager: 数据库管理器（字典行）
+
+    返回:
+        list: ContentModel.build 所需的 (id, actors, director, category, address, time) 行
+    """
+    return [(r['id'], r['actors'], r['director'], r['category'], r['address'], r['time'])
+            for r in db_manager.execute_query(CATALOG_SQL)]
+
+
+def main():
+    """离线构建内容特征文件"""
+    parser = argparse.ArgumentParser(description='构建基于内容推荐的电影特征矩阵')
+    parser.add_argument('--output', default=DEFAULT_MODEL_PATH, help='特征文件路径')
+    args = parser.parse_args()
+
+    from .db_manager import db_manager
+
+    model = ContentModel.build(catalog_rows(db_manager))
+    model.save(args.output)
+    print(f"已保存 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
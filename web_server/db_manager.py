@@ -4,96 +4,175 @@
 """
 数据库连接管理器
 提供数据库连接池和重试机制
+[database] backend = sqlite 时使用本地SQLite文件（见sqlite_backend.py），语句接口不变
+配置了只读副本（[database] replicas）时读写分离：写入和事务走主库，SELECT按轮询分发到健康的副本；
+刚写入过的用户在一段时间内读主库（读己之写），复制延迟过大或连接失败的副本被暂时摘除；
+读己之写的记录只在本进程内有效，多进程部署时需要负载均衡按用户（openid）固定到同一进程，
+否则用户写入后的下一个请求落到其他进程时仍可能读到副本上的旧数据
 作者：电影推荐系统团队
 日期：2023-05-20
 """
 
 import time
-import pymysql
-from pymysql.cursors import DictCursor
+import threading
+import itertools
+from contextlib import contextmanager
 from .logger import movie_recommender_logger as logger
 from .config_parser import ConfigParser
+from .metrics import REGISTRY, POOL_CHECKOUT_WAIT, record_db
+from .sql_tracer import sql_tracer, explain_with, TracedCursor
+from .sqlite_backend import SQLiteBackend, DEFAULT_DB_PATH
 
-class DatabaseManager:
-    """数据库连接管理器"""
-    
-    def __init__(self):
-        """初始化数据库连接管理器"""
-        # 从配置文件获取数据库配置
-        config_parser = ConfigParser()
-        self.db_config = config_parser.get_database_config()
-        
-        # 连接池
+DB_ROUTED = REGISTRY.counter(
+    'db_queries_routed_total', '按目标统计的SQL路由次数（primary/replica）及原因', ('target', 'reason'))
+
+# 粘主库的用户数上限，超过时清理已过期的记录
+MAX_STICKY_USERS = 10000
+
+# 说明副本本身不可用的错误（连接断开、超时、服务器不可用等）；SQL错误等其他异常与副本无关
+# pymysql只在使用MySQL时导入（SQLite后端不需要安装），其错误类型见connection_errors
+CONNECTION_ERRORS = (ConnectionError, TimeoutError)
+
+
+def connection_errors():
+    """
+    返回:
+        tuple: CONNECTION_ERRORS，安装了pymysql时再加上其OperationalError和InterfaceError
+    """
+    try:
+        import pymysql
+    except ImportError:
+        return CONNECTION_ERRORS
+    return CONNECTION_ERRORS + (pymysql.OperationalError, pymysql.InterfaceError)
+
+
+def parse_hosts(value, default_port=3306):
+    """
+    解析逗号分隔的 host[:port] 列表
+
+    参数:
+        value: 配置字符串，如 "10.0.0.2:3306,10.0.0.3"
+        default_port: 未写端口时使用的端口
+
+    返回:
+        list: [(host, port), ...]
+    """
+    hosts = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+def mysql_connector(db_config, host, port, timeout=60):
+    """
+    返回创建MySQL连接的函数
+
+    参数:
+        db_config: 数据库配置（用户、密码、库名、字符集）
+        host: 主机
+        port: 端口
+        timeout: 连接超时（秒）
+
+    返回:
+        function: 无参函数，返回pymysql.Connection
+    """
+    import pymysql
+    from pymysql.cursors import DictCursor
+
+    def connect():
+        return pymysql.connect(
+            host=host,
+            port=port,
+            user=db_config.get('user', 'douban_user'),
+            password=db_config.get('password', 'MySQL_20050816Zln@233'),
+            db=db_config.get('db', 'douban'),
+            charset=db_config.get('charset', 'utf8mb4'),
+            connect_timeout=timeout,
+            cursorclass=DictCursor
+        )
+    return connect
+
+
+class ConnectionPool:
+    """单个数据库实例的连接池"""
+
+    def __init__(self, name, connect, address, max_connections=5):
+        """
+        初始化连接池
+
+        参数:
+            name: 连接池名称（primary、replica1等）
+            connect: 创建新连接的无参函数
+            address: 实例地址（host:port或文件路径），用于日志和状态
+            max_connections: 连接池大小
+        """
+        self.name = name
+        self.connect = connect
+        self.address = address
+        self.max_connections = max_connections
         self.connections = []
-        self.max_connections = self.db_config.get('pool_size', 5)
-        self.timeout = self.db_config.get('timeout', 60)
-        self.reconnect_attempts = self.db_config.get('reconnect_attempts', 3)
-        
-        # 初始化连接池
-        self._init_connection_pool()
-    
-    def _init_connection_pool(self):
-        """初始化连接池"""
-        logger.info("初始化数据库连接池")
+        logger.info(f"初始化数据库连接池 {name} ({address})")
         try:
-            for _ in range(self.max_connections):
-                conn = self._create_connection()
+            for _ in range(max_connections):
+                conn = self.create()
                 if conn:
                     self.connections.append(conn)
         except Exception as e:
-            logger.error(f"初始化连接池失败: {str(e)}")
-    
-    def _create_connection(self):
+            logger.error(f"初始化连接池 {name} 失败: {str(e)}")
+
+    def create(self):
         """
         创建一个新的数据库连接
-        
+
         返回:
-            pymysql.Connection: 数据库连接对象
+            数据库连接对象，失败时为None
         """
         try:
-            connection = pymysql.connect(
-                host=self.db_config.get('host', 'localhost'),
-                port=self.db_config.get('port', 3306),
-                user=self.db_config.get('user', 'douban_user'),
-                password=self.db_config.get('password', 'MySQL_20050816Zln@233'),
-                db=self.db_config.get('db', 'douban'),
-                charset=self.db_config.get('charset', 'utf8mb4'),
-                connect_timeout=self.timeout,
-                cursorclass=DictCursor
-            )
-            logger.debug("创建数据库连接成功")
+            connection = self.connect()
+            logger.debug(f"创建数据库连接成功 ({self.name})")
             return connection
         except Exception as e:
-            logger.error(f"创建数据库连接失败: {str(e)}")
+            logger.error(f"创建数据库连接失败 ({self.name}): {str(e)}")
             return None
-    
-    def _get_connection(self):
+
+    def get(self):
         """
         从连接池获取一个连接
-        
+
         返回:
             pymysql.Connection: 数据库连接对象
         """
-        # 检查连接池是否为空
-        if not self.connections:
-            logger.warning("连接池为空，创建新连接")
-            return self._create_connection()
-        
-        # 获取连接
-        connection = self.connections.pop()
-        
-        # 检查连接是否有效
+        start = time.perf_counter()
         try:
-            connection.ping(reconnect=True)
-            return connection
-        except Exception as e:
-            logger.warning(f"连接已断开，创建新连接: {str(e)}")
-            return self._create_connection()
-    
-    def _put_connection(self, connection):
+            # 检查连接池是否为空
+            if not self.connections:
+                logger.warning(f"连接池 {self.name} 为空，创建新连接")
+                return self.create()
+
+            # 获取连接
+            try:
+                connection = self.connections.pop()
+            except IndexError:
+                return self.create()
+
+            # 检查连接是否有效
+            try:
+                connection.ping(reconnect=True)
+                return connection
+            except Exception as e:
+                logger.warning(f"连接已断开，创建新连接 ({self.name}): {str(e)}")
+                return self.create()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+    def put(self, connection):
         """
         将连接归还到连接池
-        
+
         参数:
             connection: 要归还的数据库连接
         """
@@ -105,18 +184,215 @@ class DatabaseManager:
                 # 连接池已满，关闭连接
                 try:
                     connection.close()
-                    logger.debug("连接池已满，关闭连接")
+                    logger.debug(f"连接池 {self.name} 已满，关闭连接")
                 except Exception as e:
                     logger.warning(f"关闭连接失败: {str(e)}")
-    
-    def execute_query(self, sql, params=None):
+
+    def close_all(self):
+        """关闭池中所有连接"""
+        for connection in self.connections:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.warning(f"关闭连接失败: {str(e)}")
+        self.connections = []
+
+
+class DatabaseManager:
+    """数据库连接管理器"""
+
+    def __init__(self):
+        """初始化数据库连接管理器"""
+        # 从配置文件获取数据库配置
+        config_parser = ConfigParser()
+        self.db_config = config_parser.get_database_config()
+
+        self.max_connections = self.db_config.get('pool_size', 5)
+        self.timeout = self.db_config.get('timeout', 60)
+        self.reconnect_attempts = self.db_config.get('reconnect_attempts', 3)
+
+        self.backend = self.db_config.get('backend', 'mysql')
+        if self.backend == 'sqlite':
+            # 单机SQLite：没有副本，连接池里的连接共享同一个数据库文件
+            sqlite = SQLiteBackend(self.db_config.get('sqlite_path') or DEFAULT_DB_PATH,
+                                   cache_mb=self.db_config.get('sqlite_cache_mb', 64))
+            self.primary = ConnectionPool('primary', sqlite.connect, sqlite.path, self.max_connections)
+            self.replicas = []
+        else:
+            # 主库与只读副本各自的连接池
+            host, port = self.db_config.get('host', 'localhost'), self.db_config.get('port', 3306)
+            self.primary = ConnectionPool(
+                'primary', mysql_connector(self.db_config, host, port, self.timeout),
+                f'{host}:{port}', self.max_connections
+            )
+            self.replicas = [
+                ConnectionPool(f'replica{i}', mysql_connector(self.db_config, host, port, self.timeout),
+                               f'{host}:{port}', self.max_connections)
+                for i, (host, port) in enumerate(parse_hosts(self.db_config.get('replicas', '')), 1)
+            ]
+        self.max_replica_lag = self.db_config.get('replica_max_lag_seconds', 5)
+        self.check_interval = self.db_config.get('replica_check_interval', 5)
+        self.sticky_seconds = self.db_config.get('read_your_writes_seconds', 5)
+
+        # 副本状态：名称 -> 最近一次测得的复制延迟（秒），None表示已摘除
+        self._lag = {pool.name: 0 for pool in self.replicas}
+        self._healthy = list(self.replicas)
+        self._round_robin = itertools.count()
+        # 读己之写：用户 -> 读主库的截止时间（仅本进程，见模块说明）
+        self._sticky = {}
+        self._lock = threading.Lock()
+
+        if self.replicas:
+            REGISTRY.gauge('db_replica_lag_seconds', '只读副本的复制延迟（秒，已摘除的副本为-1）',
+                lambda: {(name,): -1 if lag is None else lag for name, lag in self._lag.items()}, ('replica',))
+            self._health_thread = threading.Thread(target=self._health_loop, name='db-replica-health', daemon=True)
+            self._health_thread.start()
+
+    @property
+    def connections(self):
+        """主库连接池中的空闲连接"""
+        return self.primary.connections
+
+    def _replica_lag(self, pool):
+        """
+        查询副本的复制延迟
+
+        返回:
+            int: 延迟秒数；复制未运行或查询失败时为None
+        """
+        import pymysql
+
+        connection = pool.get()
+        if not connection:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute('SHOW REPLICA STATUS')
+                    key = 'Seconds_Behind_Source'
+                except pymysql.MySQLError:
+                    # MySQL 8.0.22之前的版本
+                    cursor.execute('SHOW SLAVE STATUS')
+                    key = 'Seconds_Behind_Master'
+                row = cursor.fetchone()
+            return None if not row or row.get(key) is None else int(row[key])
+        except Exception as e:
+            logger.warning(f"检查副本 {pool.name} 失败: {str(e)}")
+            return None
+        finally:
+            pool.put(connection)
+
+    def check_replicas(self):
+        """检查所有副本，延迟超过上限或复制未运行的副本摘除，恢复的副本重新加入"""
+        healthy = []
+        for pool in self.replicas:
+            lag = self._replica_lag(pool)
+            was_healthy = pool in self._healthy
+            ok = lag is not None and lag <= self.max_replica_lag
+            self._lag[pool.name] = lag
+            if ok:
+                healthy.append(pool)
+                if not was_healthy:
+                    logger.info(f"副本 {pool.name} 已恢复（延迟 {lag} 秒），重新加入读池")
+            elif was_healthy:
+                logger.warning(f"副本 {pool.name} 延迟 {lag} 秒，超过 {self.max_replica_lag} 秒或复制未运行，暂时摘除")
+        self._healthy = healthy
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check_replicas()
+            except Exception as e:
+                logger.error(f"副本健康检查失败: {str(e)}")
+
+    def _eject(self, pool, error):
+        """连接失败的副本立即摘除，等下一次健康检查再决定是否恢复"""
+        with self._lock:
+            if pool in self._healthy:
+                self._healthy = [p for p in self._healthy if p is not pool]
+                self._lag[pool.name] = None
+                logger.warning(f"副本 {pool.name} 查询失败，暂时摘除: {str(error)}")
+
+    def mark_written(self, user):
+        """
+        记录用户刚刚写入，之后一段时间内该用户的读请求走主库
+        （记录只保存在本进程，其他工作进程看不到）
+
+        参数:
+            user: 用户标识（微信openid）
+        """
+        if not user or not self.replicas:
+            return
+        # 窗口不短于当前副本的最大延迟
+        lags = [lag for lag in self._lag.values() if lag is not None]
+        window = max([self.sticky_seconds] + [lag + 1 for lag in lags])
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky) >= MAX_STICKY_USERS:
+                self._sticky = {u: t for u, t in self._sticky.items() if t > now}
+            self._sticky[user] = now + window
+
+    def is_sticky(self, user):
+        """用户是否仍在读己之写窗口内"""
+        deadline = self._sticky.get(user) if user else None
+        return deadline is not None and deadline > time.monotonic()
+
+    def _read_pool(self, sql, user=None, primary=False):
+        """
+        为查询选择连接池
+
+        返回:
+            ConnectionPool: 主库或一个健康的副本
+        """
+        if not self.replicas:
+            return self.primary
+        if primary:
+            reason = 'forced'
+        elif not sql.lstrip()[:6].lower() == 'select':
+            reason = 'not_select'
+        elif self.is_sticky(user):
+            reason = 'sticky'
+        else:
+            healthy = self._healthy
+            if healthy:
+                DB_ROUTED.inc(('replica', 'read'))
+                return healthy[next(self._round_robin) % len(healthy)]
+            reason = 'no_replica'
+        DB_ROUTED.inc(('primary', reason))
+        return self.primary
+
+    def _traced_execute(self, connection, cursor, sql, params):
         """
-        执行查询SQL语句
-        
+        执行SQL并记录耗时与SQL指纹
+
+        参数:
+            connection: 数据库连接
+            cursor: 数据库游标
+            sql: SQL语句
+            params: SQL参数
+
+        返回:
+            int: cursor.execute的返回值
+        """
+        start = time.perf_counter()
+        try:
+            return cursor.execute(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            record_db(elapsed)
+            sql_tracer.record(sql, elapsed, explain_with(connection, sql, params))
+
+    def execute_query(self, sql, params=None, user=None, primary=False):
+        """
+        执行查询SQL语句（配置了副本时SELECT读副本）
+
         参数:
             sql: SQL查询语句
             params: 查询参数，默认为None
-        
+            user: 发起查询的用户，刚写入过的用户读主库
+            primary: 为True时强制读主库
+
         返回:
             list: 查询结果列表
         """
@@ -124,18 +400,27 @@ class DatabaseManager:
         cursor = None
         result = []
         attempts = 0
-        
+
         while attempts < self.reconnect_attempts:
+            pool = self._read_pool(sql, user, primary)
+            connection = None
             try:
-                connection = self._get_connection()
+                connection = pool.get()
                 if not connection:
                     raise Exception("无法获取数据库连接")
-                
+
                 cursor = connection.cursor()
-                cursor.execute(sql, params)
+                self._traced_execute(connection, cursor, sql, params)
                 result = cursor.fetchall()
                 break  # 查询成功，跳出循环
             except Exception as e:
+                if pool is not self.primary:
+                    if connection is not None and not isinstance(e, connection_errors()):
+                        # SQL本身的错误换到主库也一样会失败，副本保持可用
+                        raise
+                    # 副本连接失败时摘除，立即在其他副本或主库上重试（不计入重试次数，每个副本最多失败一次）
+                    self._eject(pool, e)
+                    continue
                 attempts += 1
                 if attempts >= self.reconnect_attempts:
                     logger.error(f"执行查询失败，已达最大重试次数: {str(e)}")
@@ -146,19 +431,22 @@ class DatabaseManager:
             finally:
                 if cursor:
                     cursor.close()
+                    cursor = None
                 if connection:
-                    self._put_connection(connection)
-        
+                    pool.put(connection)
+                    connection = None
+
         return result
-    
-    def execute_update(self, sql, params=None):
+
+    def execute_update(self, sql, params=None, user=None):
         """
-        执行更新SQL语句（INSERT, UPDATE, DELETE）
-        
+        执行更新SQL语句（INSERT, UPDATE, DELETE），总是在主库执行
+
         参数:
             sql: SQL更新语句
             params: 更新参数，默认为None
-        
+            user: 发起写入的用户，之后一段时间内该用户读主库
+
         返回:
             int: 受影响的行数
         """
@@ -166,21 +454,24 @@ class DatabaseManager:
         cursor = None
         affected_rows = 0
         attempts = 0
-        
+        if self.replicas:
+            DB_ROUTED.inc(('primary', 'write'))
+
         while attempts < self.reconnect_attempts:
             try:
-                connection = self._get_connection()
+                connection = self.primary.get()
                 if not connection:
                     raise Exception("无法获取数据库连接")
-                
+
                 cursor = connection.cursor()
-                affected_rows = cursor.execute(sql, params)
+                affected_rows = self._traced_execute(connection, cursor, sql, params)
                 connection.commit()
+                self.mark_written(user)
                 break  # 更新成功，跳出循环
             except Exception as e:
                 if connection:
                     connection.rollback()  # 发生异常时回滚事务
-                
+
                 attempts += 1
                 if attempts >= self.reconnect_attempts:
                     logger.error(f"执行更新失败，已达最大重试次数: {str(e)}")
@@ -191,20 +482,58 @@ class DatabaseManager:
             finally:
                 if cursor:
                     cursor.close()
+                    cursor = None
                 if connection:
-                    self._put_connection(connection)
-        
+                    self.primary.put(connection)
+                    connection = None
+
         return affected_rows
-    
+
+    @contextmanager
+    def transaction(self, user=None):
+        """
+        在主库的一个事务中执行多条SQL，正常退出时提交，发生异常时回滚（不重试）
+
+        用法:
+            with db_manager.transaction() as cursor:
+                cursor.execute(...)
+
+        参数:
+            user: 发起写入的用户，提交后一段时间内该用户读主库
+
+        返回:
+            TracedCursor: 计时的字典游标
+        """
+        connection = self.primary.get()
+        if not connection:
+            raise Exception("无法获取数据库连接")
+        if self.replicas:
+            DB_ROUTED.inc(('primary', 'transaction'))
+        cursor = connection.cursor()
+        try:
+            yield TracedCursor(cursor)
+            connection.commit()
+            self.mark_written(user)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            self.primary.put(connection)
+
+    def replica_status(self):
+        """
+        返回:
+            list: 每个副本的名称、地址、延迟和是否在读池中
+        """
+        healthy = self._healthy
+        return [{'name': pool.name, 'host': pool.address, 'lag': self._lag.get(pool.name),
+                 'healthy': pool in healthy} for pool in self.replicas]
+
     def close_all_connections(self):
         """关闭所有连接"""
-        for connection in self.connections:
-            try:
-                connection.close()
-            except Exception as e:
-                logger.warning(f"关闭连接失败: {str(e)}")
-        
-        self.connections = []
+        for pool in [self.primary] + self.replicas:
+            pool.close_all()
         logger.info("已关闭所有数据库连接")
 
 # 全局数据库管理器实例
@@ -217,15 +546,16 @@ if __name__ == "__main__":
         # 测试查询
         results = manager.execute_query("SELECT * FROM douban_movie LIMIT 5")
         print(f"查询结果: {results}")
-        
+
         # 测试插入
         affected = manager.execute_update(
             "INSERT INTO user_info (wx_id, start_time) VALUES (%s, %s)",
             ("test_user", int(time.time()))
         )
         print(f"插入影响行数: {affected}")
+        print(f"副本状态: {manager.replica_status()}")
     except Exception as e:
         print(f"测试出错: {str(e)}")
     finally:
         # 关闭所有连接
-        manager.close_all_connections() 
\ No newline at end of file
+        manager.close_all_connections()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+混合排序模块
+多个候选生成器（基于用户的协同过滤、基于物品的协同过滤、基于内容、热门）并发产生候选及分数，
+各自归一化后按配置的权重向量化加权，取前N个
+每个生成器有独立的时间预算（从开始执行时算起，排队超过一个预算也算超时），超时的生成器本次被跳过，不拖慢整个请求
+作者：电影推荐系统团队
+日期：2025-07-10
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from .logger import movie_recommender_logger as logger
+from .metrics import REGISTRY
+
+
+STAGE_RESULTS = REGISTRY.counter(
+    'recommender_stage_total', '候选生成器执行结果（ok/timeout/error/empty/busy）', ('stage', 'outcome'))
+STAGE_LATENCY = REGISTRY.histogram(
+    'recommender_stage_seconds', '候选生成器耗时（秒，含超时被跳过的）', ('stage',))
+
+# 评分不低于该值视为喜欢（评分范围0-10）
+LIKE_THRESHOLD = 6.0
+
+# 热门候选（按评分乘评价人数对数排序的前N部）
+POPULARITY_SQL = ('select id, score, num from douban_movie where score is not null '
+                  'order by score * ln(ifnull(num, 0) + 1) desc limit %s')
+
+
+class RatingData(object):
+    """全部用户评分（三元组数组），一次查询载入，供协同过滤生成器共用"""
+
+    # 全部数组列，columns()/from_columns()按此顺序保存和恢复
+    COLUMNS = ('user_ids', 'movie_ids', 'likings', 'users', 'user_index', 'movies', 'movie_index')
+
+    def __init__(self, rows):
+        """
+        初始化
+
+        参数:
+            rows: (user_id, movie_id, liking) 行的可迭代对象，liking为NULL的行按-1处理（与原推荐逻辑一致）
+        """
+        rows = list(rows)
+        self.user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        self.movie_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        self.likings = np.fromiter((r[2] if r[2] is not None else -1 for r in rows), dtype=np.float64, count=len(rows))
+        # 压缩编号，便于bincount
+        self.users, self.user_index = np.unique(self.user_ids, return_inverse=True)
+        self.movies, self.movie_index = np.unique(self.movie_ids, return_inverse=True)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        由已计算好的列构造（如快照中的只读内存映射数组），不复制也不重新计算
+
+        参数:
+            columns: {列名: 数组}，包含COLUMNS中的全部列
+
+        返回:
+            RatingData: 评分数据
+        """
+        data = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(data, name, columns[name])
+        return data
+
+    def columns(self):
+        """
+        返回:
+            dict: {列名: 数组}
+        """
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def ratings_of(self, user_id):
+        """
+        某个用户的评分
+
+        返回:
+            dict: {电影id: 评分}
+        """
+        mask = self.user_ids == user_id
+        return dict(zip(self.movie_ids[mask].tolist(), self.likings[mask].tolist()))
+
+
+def user_cf(data, user_id, ratings, neighbors=20):
+    """
+    基于用户的协同过滤：按共同评分电影上的均方差找相近用户，用其评分（相对5分居中）加权
+
+    参数:
+        data: RatingData
+        user_id: 当前用户id
+        ratings: 当前用户的评分 {电影id: 评分}
+        neighbors: 使用的相近用户数
+
+    返回:
+        dict: {电影id: 分数}
+    """
+    if not ratings or not len(data):
+        return {}
+    rated = np.fromiter(ratings.keys(), dtype=np.int64)
+    mine = np.fromiter(ratings.values(), dtype=np.float64)
+    order = np.argsort(rated)
+    rated, mine = rated[order], mine[order]
+
+    pos = np.minimum(np.searchsorted(rated, data.movie_ids), len(rated) - 1)
+    common = (rated[pos] == data.movie_ids) & (data.user_ids != user_id)
+    users = data.user_index[common]
+    count = np.bincount(users, minlength=len(data.users))
+    sq = np.bincount(users, weights=(data.likings[common] - mine[pos[common]]) ** 2, minlength=len(data.users))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        msd = np.where(count > 0, sq / np.maximum(count, 1), np.inf)
+    # 共同评分越多越可信
+    similarity = np.where(count > 0, 1.0 / (1.0 + msd) * np.minimum(count, 5) / 5.0, 0.0)
+    if not similarity.any():
+        return {}
+    top = np.argsort(-similarity)[:neighbors]
+    top = top[similarity[top] > 0]
+    weight = np.zeros(len(data.users))
+    weight[top] = similarity[top]
+
+    candidate = (weight[data.user_index] > 0) & ~np.isin(data.movie_ids, rated)
+    if not candidate.any():
+        return {}
+    movies = data.movie_index[candidate]
+    w = weight[data.user_index[candidate]]
+    numerator = np.bincount(movies, weights=w * (data.likings[candidate] - 5.0), minlength=len(data.movies))
+    denominator = np.bincount(movies, weights=w, minlength=len(data.movies))
+    hit = denominator > 0
+    scores = numerator[hit] / denominator[hit]
+    keep = scores > 0
+    return dict(zip(data.movies[hit][keep].tolist(), scores[keep].tolist()))
+
+
+def item_cf(data, user_id, ratings):
+    """
+    基于物品的协同过滤：喜欢过当前用户所喜欢电影的其他用户，还喜欢哪些电影（按热门程度开方归一化）
+
+    参数:
+        data: RatingData
+        user_id: 当前用户id
+        ratings: 当前用户的评分 {电影id: 评分}
+
+    返回:
+        dict: {电影id: 分数}
+    """
+    liked = np.fromiter((m for m, s in ratings.items() if s >= LIKE_THRESHOLD), dtype=np.int64)
+    if not len(liked) or not len(data):
+        return {}
+    positive = (data.likings >= LIKE_THRESHOLD) & (data.user_ids != user_id)
+    # 每个用户与当前用户共同喜欢的电影数
+    overlap = np.bincount(data.user_index[positive & np.isin(data.movie_ids, liked)], minlength=len(data.users))
+    if not overlap.any():
+        return {}
+    candidate = positive & (overlap[data.user_index] > 0) & ~np.isin(data.movie_ids, list(ratings.keys()))
+    if not candidate.any():
+        return {}
+    movies = data.movie_index[candidate]
+    co = np.bincount(movies, weights=overlap[data.user_index[candidate]], minlength=len(data.movies))
+    popularity = np.bincount(data.movie_index[positive], minlength=len(data.movies))
+    hit = co > 0
+    scores = co[hit] / np.sqrt(popularity[hit] * len(liked))
+    return dict(zip(data.movies[hit].tolist(), scores.tolist()))
+
+
+def popularity_scores(rows):
+    """
+    热门分：评分乘以评价人数的对数，避免少数人打出的高分排在前面
+
+    参数:
+        rows: [(电影id, 评分, 评价人数), ...]
+
+    返回:
+        dict: {电影id: 分数}
+    """
+    return {int(movie_id): float(score) * float(np.log1p(num or 0)) for movie_id, score, num in rows if score}
+
+
+class PopularityCache(object):
+    """热门电影候选（按加权评分），按TTL缓存"""
+
+    def __init__(self, loader, ttl=600):
+        """
+        初始化
+
+        参数:
+            loader: 返回 [(电影id, 评分, 评价人数), ...] 的函数
+            ttl: 缓存秒数
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self._scores = {}
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        返回:
+            dict: {电影id: 分数}
+        """
+        with self._lock:
+            if time.time() >= self._expires:
+                self._scores = popularity_scores(self.loader())
+                self._expires = time.time() + self.ttl
+            return self._scores
+
+    def refresh(self):
+        """在后台重新加载（查询不持有锁，加载期间请求继续使用旧数据）"""
+        scores = popularity_scores(self.loader())
+        with self._lock:
+            self._scores = scores
+            self._expires = time.time() + self.ttl
+        return len(scores)
+
+
+class RatingCache(object):
+    """全部用户评分（RatingData）的进程内缓存：在后台线程加载，请求线程只读取已加载的数据"""
+
+    def __init__(self, loader, ttl=300):
+        """
+        初始化
+
+        参数:
+            loader: 返回 [(user_id, movie_id, liking), ...] 的函数
+            ttl: 缓存秒数，过期后由下一次get在后台线程重新加载
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.used = False
+        self._data = None
+        self._expires = 0.0
+        self._loading = threading.Lock()
+
+    def get(self):
+        """
+        当前数据，尚未加载完成时为None（过期时启动后台加载，不等待）
+
+        返回:
+            RatingData: 评分数据
+        """
+        self.used = True
+        if time.time() >= self._expires and not self._loading.locked():
+            threading.Thread(target=self.refresh, name='rating-cache', daemon=True).start()
+        return self._data
+
+    def refresh(self):
+        """
+        重新加载（已有线程在加载时直接返回）
+
+        返回:
+            bool: 是否完成了加载
+        """
+        if not self._loading.acquire(blocking=False):
+            return False
+        try:
+            self._data = RatingData(self.loader())
+            self._expires = time.time() + self.ttl
+            return True
+        except Exception as e:
+            # 失败后等一个较短的间隔再重试，避免每个请求都触发加载
+            self._expires = time.time() + min(self.ttl, 30)
+            logger.error(f"加载评分数据失败: {str(e)}")
+            return False
+        finally:
+            self._loading.release()
+
+
+class _StageStart(object):
+    """生成器开始执行的时刻"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.at = None
+
+    def set(self):
+        self.at = time.monotonic()
+        self.event.set()
+
+
+class HybridRanker(object):
+    """并发执行候选生成器并按权重合并"""
+
+    def __init__(self, weights, stage_timeout=0.15, max_inflight=20):
+        """
+        初始化
+
+        参数:
+            weights: {生成器名: 权重}，权重为0的生成器不执行
+            stage_timeout: 每个生成器的时间预算（秒）
+            max_inflight: 同时处理的推荐请求数上限；线程池按 请求数×生成器数 设置，正常情况下生成器不排队，
+                          某个生成器超时后仍在执行的实例达到该数时，该生成器暂停提交
+        """
+        self.weights = {name: float(w) for name, w in weights.items() if float(w) > 0}
+        self.stage_timeout = stage_timeout
+        self.max_inflight = max_inflight
+        self._running = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_inflight * len(self.weights)),
+                                            thread_name_prefix='ranker')
+
+    def _timed(self, name, fn, started):
+        started.set()
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - start, (name,))
+            with self._lock:
+                self._running[name] -= 1
+
+    def _submit(self, name, fn):
+        """提交生成器；该生成器仍在执行的实例过多（多为超时未结束的）时返回None"""
+        with self._lock:
+            if self._running.get(name, 0) >= self.max_inflight:
+                return None
+            self._running[name] = self._running.get(name, 0) + 1
+        started = _StageStart()
+        try:
+            return self._executor.submit(self._timed, name, fn, started), started
+        except Exception:
+            with self._lock:
+                self._running[name] -= 1
+            raise
+
+    def _result(self, future, started, submitted):
+        """等待结果：预算从开始执行时算起，提交后一个预算内仍未开始的按超时处理"""
+        if not started.event.wait(max(0.0, submitted + self.stage_timeout - time.monotonic())):
+            raise FutureTimeoutError()
+        return future.result(timeout=max(0.0, started.at + self.stage_timeout - time.monotonic()))
+
+    def candidates(self, generators):
+        """
+        并发执行生成器，收集在时间预算内完成的结果
+
+        参数:
+            generators: {生成器名: 无参函数，返回 {电影id: 分数}}
+
+        返回:
+            dict: {生成器名: {电影id: 分数}}
+        """
+        submitted = time.monotonic()
+        tasks = {}
+        for name, fn in generators.items():
+            if name not in self.weights:
+                continue
+            task = self._submit(name, fn)
+            if task is None:
+                STAGE_RESULTS.inc((name, 'busy'))
+                logger.warning(f"候选生成器 {name} 仍有 {self.max_inflight} 个实例在执行，本次跳过")
+                continue
+            tasks[name] = task
+        results = {}
+        for name, (future, started) in tasks.items():
+            try:
+                scores = self._result(future, started, submitted)
+            except FutureTimeoutError:
+                if future.cancel():
+                    # 尚未开始执行，_timed不会再运行
+                    with self._lock:
+                        self._running[name] -= 1
+                STAGE_RESULTS.inc((name, 'timeout'))
+                logger.warning(f"候选生成器 {name} 超过 {self.stage_timeout * 1000:.0f} 毫秒，本次跳过")
+                continue
+            except Exception as e:
+                STAGE_RESULTS.inc((name, 'error'))
+                logger.error(f"候选生成器 {name} 失败: {str(e)}")
+                continue
+            STAGE_RESULTS.inc((name, 'ok' if scores else 'empty'))
+            if scores:
+                results[name] = scores
+        return results
+
+    def merge(self, results, n, exclude=()):
+        """
+        合并候选：每个生成器的分数按最大值归一化到[0,1]，组成 候选×生成器 矩阵后与权重向量相乘
+
+        参数:
+            results: {生成器名: {电影id: 分数}}
+            n: 返回数量
+            exclude: 不推荐的电影id
+
+        返回:
+            list: [(电影id, 分数), ...]，按分数降序
+        """
+        names = [name for name in results if name in self.weights]
+        exclude = set(exclude)
+        movie_ids = sorted({m for name in names for m in results[name]} - exclude)
+        if not movie_ids or not n:
+            return []
+        column = {m: i for i, m in enumerate(movie_ids)}
+        matrix = np.zeros((len(movie_ids), len(names)))
+        for j, name in enumerate(names):
+            scores = results[name]
+            rows = [column[m] for m in scores if m in column]
+            values = np.array([scores[m] for m in scores if m in column], dtype=np.float64)
+            top = values.max() if len(values) else 0.0
+            if top > 0:
+                matrix[rows, j] = values / top
+        total = matrix @ np.array([self.weights[name] for name in names])
+        n = min(n, len(movie_ids))
+        best = np.argpartition(-total, n - 1)[:n]
+        best = best[np.lexsort((np.array(movie_ids)[best], -total[best]))]
+        return [(movie_ids[i], float(total[i])) for i in best if total[i] > 0]
+
+    def rank(self, generators, n, exclude=()):
+        """
+        执行生成器并合并
+
+        参数:
+            generators: {生成器名: 无参函数}
+            n: 返回数量
+            exclude: 不推荐的电影id
+
+        返回:
+            list: [(电影id, 分数), ...]
+        """
+        return self.merge(self.candidates(generators), n, exclude)
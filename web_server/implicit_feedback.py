@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+隐式反馈聚合模块
+把搜索记录的日汇总（seek_movie_daily_user_movie，见seek_partitions.py）按天增量聚合为随时间衰减的兴趣分
+（按用户-电影、按电影），写入汇总表implicit_user_movie、implicit_movie，推荐时直接读汇总表
+日汇总落后于已结束的日期时先补做日汇总，不依赖seek_movie分区维护任务（SQLite后端同样可用）
+分数按半衰期指数衰减：某天的n次搜索贡献 n·exp(-λ·(t - 当天正午))，λ = ln2 / 半衰期
+汇总表保存的是updated_at时刻的分数，读出时再衰减到当前时刻
+作者：电影推荐系统团队
+日期：2025-07-14
+"""
+
+import math
+import time
+import argparse
+import datetime
+from collections import defaultdict
+
+from .logger import movie_recommender_logger as logger
+from .config_parser import ConfigParser
+from .seek_partitions import SeekPartitions, ROLLUP_SOURCE, DAY_SECONDS, day_start
+
+# 水位记录在etl_watermark表中的名称，last_id为下一个待聚合日期的零点时间戳
+WATERMARK_SOURCE = 'implicit_daily'
+# 改为读日汇总之前按seek_movie.id记录的水位
+LEGACY_WATERMARK_SOURCE = 'seek_movie'
+
+CREATE_SQL = (
+    '''CREATE TABLE IF NOT EXISTS `implicit_user_movie` (
+        `user_id` INT NOT NULL,
+        `movie_id` INT NOT NULL,
+        `score` DOUBLE NOT NULL,
+        `updated_at` BIGINT NOT NULL,
+        PRIMARY KEY (`user_id`, `movie_id`),
+        KEY `idx_movie_id` (`movie_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    '''CREATE TABLE IF NOT EXISTS `implicit_movie` (
+        `movie_id` INT NOT NULL,
+        `score` DOUBLE NOT NULL,
+        `updated_at` BIGINT NOT NULL,
+        PRIMARY KEY (`movie_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    '''CREATE TABLE IF NOT EXISTS `etl_watermark` (
+        `source` VARCHAR(64) NOT NULL,
+        `last_id` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (`source`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+)
+
+# 旧分数先衰减到新的时刻再加上新贡献（MySQL按书写顺序赋值，score使用的是旧的updated_at）
+# executemany只替换VALUES中的占位符，衰减率λ直接写入语句
+UPSERT_USER_SQL = (
+    'INSERT INTO implicit_user_movie (user_id, movie_id, score, updated_at) VALUES (%s, %s, %s, %s) '
+    'ON DUPLICATE KEY UPDATE score = score * EXP(-{rate!r} * (VALUES(updated_at) - updated_at)) + VALUES(score), '
+    'updated_at = VALUES(updated_at)'
+)
+UPSERT_MOVIE_SQL = (
+    'INSERT INTO implicit_movie (movie_id, score, updated_at) VALUES (%s, %s, %s) '
+    'ON DUPLICATE KEY UPDATE score = score * EXP(-{rate!r} * (VALUES(updated_at) - updated_at)) + VALUES(score), '
+    'updated_at = VALUES(updated_at)'
+)
+
+
+def decay_rate(half_life_days):
+    """
+    由半衰期（天）计算每秒的衰减率λ
+
+    参数:
+        half_life_days: 半衰期（天）
+
+    返回:
+        float: λ
+    """
+    return math.log(2) / (half_life_days * 86400.0)
+
+
+def date_start(value):
+    """
+    DATE列的值（MySQL为datetime.date，SQLite为'YYYY-MM-DD'字符串）对应零点的时间戳
+
+    参数:
+        value: 日期
+
+    返回:
+        int: 时间戳
+    """
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value[:10])
+    return day_start(time.mktime(value.timetuple()))
+
+
+class ImplicitFeedback(object):
+    """搜索记录的增量聚合与查询"""
+
+    def __init__(self, db_manager, half_life_days=14.0):
+        """
+        初始化
+
+        参数:
+            db_manager: DatabaseManager对象
+            half_life_days: 兴趣分的半衰期（天）
+        """
+        self.db_manager = db_manager
+        self.seek_partitions = SeekPartitions(db_manager)
+        self.rate = decay_rate(half_life_days)
+        self.upsert_user_sql = UPSERT_USER_SQL.format(rate=self.rate)
+        self.upsert_movie_sql = UPSERT_MOVIE_SQL.format(rate=self.rate)
+        self._tables_ready = False
+
+    def ensure_tables(self):
+        """创建汇总表和水位表（与sql/init_tables.sql中的定义一致）"""
+        if self._tables_ready:
+            return
+        with self.db_manager.transaction() as cursor:
+            for sql in CREATE_SQL:
+                cursor.execute(sql)
+        self._tables_ready = True
+
+    def _watermark(self, cursor, source):
+        cursor.execute('SELECT last_id FROM etl_watermark WHERE source = %s', (source,))
+        row = cursor.fetchone()
+        return int(row['last_id']) if row else None
+
+    def _first_day(self, cursor):
+        """没有水位时的起始日期：接着旧的按id水位之后的一天，否则从最早的日汇总开始"""
+        legacy = self._watermark(cursor, LEGACY_WATERMARK_SOURCE)
+        if legacy:
+            cursor.execute('SELECT seek_time FROM seek_movie WHERE id <= %s ORDER BY id DESC LIMIT 1', (legacy,))
+            row = cursor.fetchone()
+            if row and row['seek_time']:
+                return day_start(int(row['seek_time']) + DAY_SECONDS)
+        cursor.execute('SELECT MIN(day) AS first_day FROM seek_movie_daily_user_movie')
+        row = cursor.fetchone()
+        if row and row['first_day']:
+            return date_start(row['first_day'])
+        return None
+
+    def aggregate(self, rows, now):
+        """
+        把日汇总行聚合为衰减到now时刻的分数
+
+        参数:
+            rows: (user_id, movie_id, 搜索次数, 事件时刻) 列表
+            now: 参考时刻（秒）
+
+        返回:
+            tuple: ({(用户id, 电影id): 分数}, {电影id: 分数})
+        """
+        per_user = defaultdict(float)
+        per_movie = defaultdict(float)
+        for user_id, movie_id, searches, event_time in rows:
+            weight = searches * math.exp(-self.rate * max(0, now - event_time))
+            per_user[(user_id, movie_id)] += weight
+            per_movie[movie_id] += weight
+        return per_user, per_movie
+
+    def run_once(self):
+        """
+        聚合水位之后、日汇总已完成的每一天，每天的数据与水位在同一事务中提交
+        （日汇总还没有覆盖到昨天时先汇总，每天最多一次）
+
+        返回:
+            int: 聚合的天数
+        """
+        self.ensure_tables()
+        with self.db_manager.transaction() as cursor:
+            rolled = self._watermark(cursor, ROLLUP_SOURCE)
+        if rolled is None or rolled < day_start(time.time()):
+            self.seek_partitions.rollup()
+        with self.db_manager.transaction() as cursor:
+            day = self._watermark(cursor, WATERMARK_SOURCE)
+            if day is None:
+                day = self._first_day(cursor)
+            # 日汇总水位之前的日期才是完整的
+            rolled = self._watermark(cursor, ROLLUP_SOURCE)
+        if day is None or rolled is None:
+            return 0
+        processed = 0
+        searches = 0
+        started = time.time()
+        while day < rolled:
+            following = day_start(day + DAY_SECONDS + 3600)
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(
+                    'SELECT user_id, movie_id, searches FROM seek_movie_daily_user_movie WHERE day = %s',
+                    (datetime.date.fromtimestamp(day),)
+                )
+                rows = cursor.fetchall()
+                # 以当前时刻为参考，保证updated_at单调递增
+                now = int(time.time())
+                noon = day + DAY_SECONDS // 2
+                per_user, per_movie = self.aggregate(
+                    [(r['user_id'], r['movie_id'], r['searches'], noon) for r in rows], now)
+                if per_user:
+                    cursor.executemany(self.upsert_user_sql, [
+                        (user_id, movie_id, score, now) for (user_id, movie_id), score in per_user.items()])
+                    cursor.executemany(self.upsert_movie_sql, [
+                        (movie_id, score, now) for movie_id, score in per_movie.items()])
+                cursor.execute(
+                    'INSERT INTO etl_watermark (source, last_id) VALUES (%s, %s) '
+                    'ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)',
+                    (WATERMARK_SOURCE, following)
+                )
+            processed += 1
+            searches += sum(r['searches'] for r in rows)
+            day = following
+        if processed:
+            logger.info(f"隐式反馈聚合完成：{processed} 天、{searches} 次搜索，用时 {time.time() - started:.2f} 秒")
+        return processed
+
+    def user_scores(self, user_id, limit=50):
+        """
+        某个用户当前的兴趣分
+
+        参数:
+            user_id: 用户id
+            limit: 最多返回的电影数
+
+        返回:
+            dict: {电影id: 分数}
+        """
+        rows = self.db_manager.execute_query(
+            'SELECT movie_id, score * EXP(-%s * (%s - updated_at)) AS decayed FROM implicit_user_movie '
+            'WHERE user_id = %s ORDER BY decayed DESC LIMIT %s',
+            (self.rate, int(time.time()), user_id, limit)
+        )
+        return {row['movie_id']: row['decayed'] for row in rows}
+
+    def movie_scores(self, limit=50):
+        """
+        当前搜索兴趣最高的电影
+
+        参数:
+            limit: 返回的电影数
+
+        返回:
+            dict: {电影id: 分数}
+        """
+        rows = self.db_manager.execute_query(
+            'SELECT movie_id, score * EXP(-%s * (%s - updated_at)) AS decayed FROM implicit_movie '
+            'ORDER BY decayed DESC LIMIT %s',
+            (self.rate, int(time.time()), limit)
+        )
+        return {row['movie_id']: row['decayed'] for row in rows}
+
+
+def create_implicit_feedback(db_manager):
+    """按[recommender]配置创建ImplicitFeedback"""
+    config = ConfigParser().get_recommender_config()
+    return ImplicitFeedback(db_manager, half_life_days=config.get('implicit_half_life_days', 14.0))
+
+
+def main():
+    """增量聚合搜索日汇总（日汇总落后时先补做）"""
+    parser = argparse.ArgumentParser(description='把seek_movie搜索日汇总增量聚合为隐式兴趣分')
+    parser.parse_args()
+
+    from .db_manager import db_manager
+    feedback = create_implicit_feedback(db_manager)
+    print(f"聚合 {feedback.run_once()} 天的搜索记录")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,25 +9,224 @@
 """
 
 import os
+import copy
+import json
+import queue
+import atexit
+import random
 import logging
 import logging.handlers
+import threading
+import contextvars
 import time
 from datetime import datetime
 
+# 当前请求的ID，用于关联同一请求的日志
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+# 设置该环境变量时日志写入其指定的目录（测试等场景），否则写入项目根目录下的logs
+LOG_DIR_ENV = 'MOVIE_RECOMMENDER_LOG_DIR'
+
+# 文本日志格式
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(filename)s:%(lineno)d - %(message)s'
+
+
+def default_log_dir():
+    """
+    日志目录
+
+    返回:
+        str: 环境变量MOVIE_RECOMMENDER_LOG_DIR指定的目录，未设置时为项目根目录下的logs
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.environ.get(LOG_DIR_ENV) or os.path.join(project_root, 'logs')
+
+
+def set_request_id(request_id):
+    """
+    设置当前请求ID
+
+    参数:
+        request_id: 请求ID
+
+    返回:
+        contextvars.Token: 用于恢复的令牌
+    """
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    """
+    恢复请求ID
+
+    参数:
+        token: set_request_id返回的令牌
+    """
+    _request_id.reset(token)
+
+
+def get_request_id():
+    """获取当前请求ID"""
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """为日志记录附加请求ID"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按类别对INFO及以下级别的日志采样，WARNING及以上级别总是保留
+    类别取自日志调用时的 extra={'category': ...}，未指定时不采样
+    """
+
+    def __init__(self, rates=None):
+        """
+        初始化采样过滤器
+
+        参数:
+            rates: 类别 -> 保留比例（0~1）
+        """
+        super().__init__()
+        self.rates = dict(rates or {})
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'category', None))
+        if rate is None or rate >= 1:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """将日志格式化为单行JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'location': f'{record.filename}:{record.lineno}',
+            'message': record.getMessage(),
+        }
+        category = getattr(record, 'category', None)
+        if category:
+            data['category'] = category
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """有界队列日志处理器，队列满时丢弃日志并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def prepare(self, record):
+        """只在调用线程上合并消息参数和异常文本，格式化与写盘交给后台线程"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sample_rates(text):
+    """
+    解析采样配置
+
+    参数:
+        text: 形如 "message:0.1,reply:0.5" 的字符串
+
+    返回:
+        dict: 类别 -> 保留比例
+    """
+    rates = {}
+    for item in (text or '').split(','):
+        category, _, rate = item.partition(':')
+        if category.strip() and rate.strip():
+            rates[category.strip()] = float(rate)
+    return rates
+
+
+# 已启动的后台日志线程，进程退出时统一停止以刷出剩余日志
+_listeners = []
+
+
+def _stop_listeners():
+    for listener in _listeners:
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+atexit.register(_stop_listeners)
+
+
+def setup_async_logging(logger, handlers, level=logging.INFO, queue_size=10000, sample_rates=None):
+    """
+    为日志记录器配置异步日志管道：调用线程只入队，后台线程负责格式化和写盘
+
+    参数:
+        logger: logging.Logger对象
+        handlers: 实际输出的处理器列表（在后台线程中执行）
+        level: 日志级别
+        queue_size: 队列容量，队列满时丢弃并计数
+        sample_rates: 类别 -> 保留比例
+
+    返回:
+        DroppingQueueHandler: 入队处理器（dropped属性为丢弃条数）
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+
 class Logger:
     """日志管理类"""
     
-    def __init__(self, logger_name='movie_recommender', log_level=logging.INFO):
+    def __init__(self, logger_name='movie_recommender', log_level=logging.INFO, json_format=False,
+                 queue_size=10000, sample_rates=None, log_dir=None):
         """
         初始化日志系统
         
         参数:
             logger_name: 日志记录器名称
             log_level: 日志级别，默认为INFO
+            json_format: 是否输出JSON格式日志
+            queue_size: 异步日志队列容量
+            sample_rates: 按类别采样的保留比例
+            log_dir: 日志目录，默认见default_log_dir
         """
-        # 获取日志目录路径（上一级目录的logs子目录）
-        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        log_dir = os.path.join(current_dir, 'logs')
+        log_dir = log_dir or default_log_dir()
         
         # 如果日志目录不存在，则创建
         if not os.path.exists(log_dir):
@@ -39,19 +238,17 @@ class Logger:
         # 创建日志记录器
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(log_level)
+        self.queue_handler = None
         
         # 避免重复添加处理器
         if not self.logger.handlers:
             # 创建日志格式
-            formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-            )
+            formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
             
             # 控制台处理器
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(formatter)
             console_handler.setLevel(log_level)
-            self.logger.addHandler(console_handler)
             
             # 文件处理器（按日期滚动）
             log_file = os.path.join(log_dir, f'{logger_name}.log')
@@ -60,22 +257,38 @@ class Logger:
             )
             file_handler.setFormatter(formatter)
             file_handler.setLevel(log_level)
-            self.logger.addHandler(file_handler)
             
             # 错误日志处理器（单独记录错误和严重错误）
             error_log_file = os.path.join(log_dir, f'{logger_name}_error.log')
             error_file_handler = logging.FileHandler(error_log_file)
             error_file_handler.setFormatter(formatter)
             error_file_handler.setLevel(logging.ERROR)
-            self.logger.addHandler(error_file_handler)
+            
+            # 处理器在后台线程中执行，磁盘阻塞不影响调用线程
+            self.queue_handler = setup_async_logging(
+                self.logger, [console_handler, file_handler, error_file_handler],
+                level=log_level, queue_size=queue_size, sample_rates=sample_rates
+            )
+            self.logger.propagate = False
+    
+    @property
+    def dropped(self):
+        """队列满时丢弃的日志条数"""
+        return self.queue_handler.dropped if self.queue_handler else 0
     
-    def debug(self, message):
+    def debug(self, message, category=None):
         """记录调试信息"""
-        self.logger.debug(message)
+        self.logger.debug(message, extra={'category': category})
     
-    def info(self, message):
-        """记录普通信息"""
-        self.logger.info(message)
+    def info(self, message, category=None):
+        """
+        记录普通信息
+        
+        参数:
+            message: 日志信息
+            category: 日志类别，用于按类别采样
+        """
+        self.logger.info(message, extra={'category': category})
     
     def warning(self, message):
         """记录警告信息"""
@@ -101,8 +314,35 @@ class Logger:
         """
         self.logger.critical(message, exc_info=exc_info)
 
+def create_logger(logger_name='movie_recommender', log_dir=None):
+    """
+    按[service]配置（log_level、log_format、log_queue_size、log_sample_rates）创建Logger，
+    与main.py中web_server日志记录器使用同一组配置
+
+    参数:
+        logger_name: 日志记录器名称
+        log_dir: 日志目录，默认见default_log_dir
+
+    返回:
+        Logger: 日志管理对象
+    """
+    try:
+        from .config_parser import ConfigParser
+        service_config = ConfigParser().get_service_config()
+    except Exception as e:
+        print(f"读取日志配置失败，使用默认配置: {str(e)}")
+        service_config = {}
+    return Logger(
+        logger_name,
+        log_level=getattr(logging, service_config.get('log_level', 'INFO'), logging.INFO),
+        json_format=service_config.get('log_format', 'text') == 'json',
+        queue_size=service_config.get('log_queue_size', 10000),
+        sample_rates=parse_sample_rates(service_config.get('log_sample_rates', '')),
+        log_dir=log_dir
+    )
+
 # 全局日志实例
-movie_recommender_logger = Logger()
+movie_recommender_logger = create_logger()
 
 # 测试代码
 if __name__ == "__main__":
@@ -2,13 +2,15 @@
 #-*- coding: utf-8 -*-
 import web
 import hashlib
+import hmac
 import lxml
 import time
 import os
 import random
-import pymysql
 import sys
 import logging
+import json
+import uuid
 
 import reply
 import receive
@@ -17,8 +19,27 @@ from config_parser import ConfigParser
 # 获取当前脚本所在目录的绝对路径
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+# 将项目根目录加入路径，以便导入web_server包内的模块
+if PROJECT_ROOT not in sys.path:
+	sys.path.append(PROJECT_ROOT)
+
+from web_server.rate_limiter import RateLimiter
+from web_server import metrics
+from web_server.sql_tracer import sql_tracer
+from web_server.profiler import profiler, install_signal_handler
+from web_server.content_recommender import ContentRecommender, DEFAULT_MODEL_PATH
+from web_server.hybrid_ranker import HybridRanker, RatingCache, PopularityCache, POPULARITY_SQL, user_cf, item_cf
+from web_server.model_snapshot import SnapshotStore, build_snapshot, DEFAULT_SNAPSHOT_DIR
+from web_server.shared_store import SharedStoreReader
+from web_server.db_manager import db_manager
+from web_server.implicit_feedback import create_implicit_feedback
+from web_server.trending import trending
+from web_server.scheduler import Scheduler
+from web_server.seek_partitions import create_seek_partitions
+from web_server.logger import (movie_recommender_logger, setup_async_logging, parse_sample_rates,
+	set_request_id, reset_request_id, JsonFormatter, TEXT_FORMAT, default_log_dir)
 CONFIG_PATH = os.path.join(PROJECT_ROOT, 'config', 'database.conf')
-LOGS_DIR = os.path.join(PROJECT_ROOT, 'logs')
+LOGS_DIR = default_log_dir()
 
 # 确保日志目录存在
 if not os.path.exists(LOGS_DIR):
@@ -33,16 +54,25 @@ try:
 	DB_CONFIG = config.get_section('database')
 	SERVICE_CONFIG = config.get_section('service')
 	RECOMMENDER_CONFIG = config.get_section('recommender')
+	SCHEDULER_CONFIG = config.get_section('scheduler')
 	
 	# 设置日志
 	log_level = getattr(logging, SERVICE_CONFIG.get('log_level', 'INFO'))
-	logging.basicConfig(
-		level=log_level,
-		format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-		handlers=[
-			logging.StreamHandler(),
-			logging.FileHandler(os.path.join(LOGS_DIR, 'web_server.log'))
-		]
+	if SERVICE_CONFIG.get('log_format', 'text') == 'json':
+		log_formatter = JsonFormatter()
+	else:
+		log_formatter = logging.Formatter(TEXT_FORMAT)
+	log_handlers = [
+		logging.StreamHandler(),
+		logging.FileHandler(os.path.join(LOGS_DIR, 'web_server.log'))
+	]
+	for handler in log_handlers:
+		handler.setFormatter(log_formatter)
+	# 日志经有界队列交给后台线程写盘，队列满时丢弃计数，不阻塞请求
+	log_queue_handler = setup_async_logging(
+		logging.getLogger(), log_handlers, level=log_level,
+		queue_size=SERVICE_CONFIG.get('log_queue_size', 10000),
+		sample_rates=parse_sample_rates(SERVICE_CONFIG.get('log_sample_rates', ''))
 	)
 	logger = logging.getLogger('web_server')
 	logger.info("配置加载成功")
@@ -50,9 +80,151 @@ except Exception as e:
 	print(f"配置加载失败: {e}")
 	sys.exit(1)
 
+# 按用户限流与全局并发控制
+rate_limiter = RateLimiter(
+	rate=SERVICE_CONFIG.get('rate_limit_per_user', 0.5),
+	burst=SERVICE_CONFIG.get('rate_limit_burst', 5),
+	max_inflight=SERVICE_CONFIG.get('max_inflight', 20),
+	cache_ttl=SERVICE_CONFIG.get('reply_cache_ttl', 300)
+)
+
+# 限流计数同时作为监控指标导出
+metrics.REGISTRY.gauge('rate_limiter_events', '限流器计数（served/shed等）',
+	lambda: {(key,): value for key, value in rate_limiter.stats().items()}, ('event',))
+
+metrics.REGISTRY.gauge('log_records_dropped_total', '日志队列满时丢弃的日志条数',
+	lambda: {('web_server',): log_queue_handler.dropped, ('movie_recommender',): movie_recommender_logger.dropped},
+	('logger',))
+
+# 基于内容的推荐（特征文件由 python -m web_server.content_recommender 离线构建）
+content_recommender = ContentRecommender(RECOMMENDER_CONFIG.get('content_model_path') or DEFAULT_MODEL_PATH)
+
+# 混合排序：各候选生成器的权重和时间预算
+ranker = HybridRanker(
+	weights={
+		'user_cf': RECOMMENDER_CONFIG.get('weight_user_cf', 0.35),
+		'item_cf': RECOMMENDER_CONFIG.get('weight_item_cf', 0.25),
+		'content': RECOMMENDER_CONFIG.get('weight_content', 0.25),
+		'popularity': RECOMMENDER_CONFIG.get('weight_popularity', 0.15),
+		'implicit': RECOMMENDER_CONFIG.get('weight_implicit', 0.1),
+	},
+	stage_timeout=RECOMMENDER_CONFIG.get('stage_timeout_ms', 150) / 1000.0,
+	max_inflight=SERVICE_CONFIG.get('max_inflight', 20)
+)
+# 每个生成器最多提供的候选数
+CANDIDATES_PER_STAGE = 50
+# 搜索记录聚合出的兴趣分（implicit_feedback后台任务或 python -m web_server.implicit_feedback 增量更新，日汇总落后时一并补做）
+implicit_feedback = create_implicit_feedback(db_manager)
+popularity = PopularityCache(lambda: [
+	(row['id'], row['score'], row['num']) for row in db_manager.execute_query(POPULARITY_SQL, (CANDIDATES_PER_STAGE,))
+])
+# 没有共享内存和快照时使用的全部评分，在后台线程加载（python -m web_server.model_snapshot 构建快照后不再使用）
+ratings_cache = RatingCache(lambda: [
+	(row['user_id'], row['movie_id'], row['liking']) for row in db_manager.execute_query('select user_id, movie_id, liking from like_movie;')
+], ttl=SCHEDULER_CONFIG.get('ratings_interval') or 300)
+# 离线构建的模型快照（python -m web_server.model_snapshot），各进程内存映射共享；没有快照时按请求查询
+SNAPSHOT_DIR = RECOMMENDER_CONFIG.get('snapshot_dir') or DEFAULT_SNAPSHOT_DIR
+# 默认每5秒由请求触发一次后台检查；调度器实际启动后改由snapshot_check任务检查（见start_scheduler）
+snapshots = SnapshotStore(SNAPSHOT_DIR, check_interval=5.0)
+
+# 共享内存中的片库和评分（由 python -m web_server.shared_store 加载进程发布），未配置时为None
+shared_store = SharedStoreReader(SERVICE_CONFIG['shared_store_name']) if SERVICE_CONFIG.get('shared_store_name') else None
+
+# 后台任务：热门候选预热、快照检查与重建、隐式反馈聚合、seek_movie分区维护
+scheduler = Scheduler(max_workers=SCHEDULER_CONFIG.get('max_workers', 2))
+
+def schedule_jobs():
+	jitter = SCHEDULER_CONFIG.get('jitter_seconds', 10.0)
+	if SCHEDULER_CONFIG.get('popularity_interval'):
+		scheduler.add('popularity_refresh', popularity.refresh,
+			interval=SCHEDULER_CONFIG['popularity_interval'], jitter=jitter, run_at_start=True)
+	if SCHEDULER_CONFIG.get('snapshot_check_interval'):
+		scheduler.add('snapshot_check', snapshots.refresh,
+			interval=SCHEDULER_CONFIG['snapshot_check_interval'], run_at_start=True)
+	if SCHEDULER_CONFIG.get('ratings_interval'):
+		# 只在请求用到评分缓存（没有共享内存和快照）时刷新
+		scheduler.add('ratings_refresh', lambda: ratings_cache.used and ratings_cache.refresh(),
+			interval=SCHEDULER_CONFIG['ratings_interval'], jitter=jitter)
+	if SCHEDULER_CONFIG.get('implicit_feedback_interval'):
+		scheduler.add('implicit_feedback', implicit_feedback.run_once,
+			interval=SCHEDULER_CONFIG['implicit_feedback_interval'], jitter=jitter)
+	# 以下两个cron任务默认关闭，只在一个指定的进程中配置；开启快照重建后协同过滤改用快照中的评分
+	if SCHEDULER_CONFIG.get('seek_maintenance_cron') and DB_CONFIG.get('backend', 'mysql') == 'mysql':
+		seek_partitions = create_seek_partitions(db_manager)
+		scheduler.add('seek_maintenance', seek_partitions.maintain,
+			cron=SCHEDULER_CONFIG['seek_maintenance_cron'], jitter=jitter)
+	if SCHEDULER_CONFIG.get('snapshot_build_cron'):
+		scheduler.add('snapshot_build', lambda: build_snapshot(db_manager, SNAPSHOT_DIR, popular=CANDIDATES_PER_STAGE),
+			cron=SCHEDULER_CONFIG['snapshot_build_cron'], jitter=jitter)
+
+def start_scheduler():
+	"""注册并启动后台任务；调度器运行后快照由snapshot_check任务检查，请求线程只读取当前状态"""
+	schedule_jobs()
+	scheduler.start()
+	if SCHEDULER_CONFIG.get('snapshot_check_interval'):
+		snapshots.check_interval = float('inf')
+
+def content_picks(line, n):
+	#优先使用快照中的内容模型
+	state = snapshots.get()
+	if state is not None and state.content is not None:
+		return state.content.recommend(line, n)
+	return content_recommender.recommend(line, n=n)
+
+# 已知的文本命令，其余文本按浏览处理
+TEXT_COMMANDS = ('评价', '推荐', '搜索', '热门', '怎么用')
+
 urls = (
 	'/', 'Main',
+	'/stats', 'Stats',
+	'/metrics', 'Metrics',
+	'/admin/sql', 'AdminSql',
+	'/admin/profile', 'AdminProfile',
 )
+
+class Metrics(object):
+	def GET(self):
+		web.header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		return metrics.REGISTRY.render()
+
+def check_admin():
+	#管理接口需携带与配置一致的token参数，未配置token时管理接口关闭
+	admin_token = SERVICE_CONFIG.get('admin_token', '')
+	data = web.input(token='')
+	if not admin_token or not hmac.compare_digest(data.token, admin_token):
+		raise web.forbidden()
+	return data
+
+class AdminSql(object):
+	def GET(self):
+		data = check_admin()
+		result = sql_tracer.dump()
+		if data.get('reset') == '1':
+			sql_tracer.reset()
+		web.header('Content-Type', 'application/json; charset=utf-8')
+		return json.dumps(result, ensure_ascii=False, default=str, indent=2)
+
+class AdminProfile(object):
+	def GET(self):
+		#?seconds=N 开始采样N秒；不带参数时返回当前状态与上次结果
+		data = check_admin()
+		result = {}
+		if data.get('seconds'):
+			try:
+				seconds = int(data.seconds)
+			except ValueError:
+				raise web.badrequest()
+			result['started'] = profiler.start(seconds, all_threads=data.get('all') == '1')
+		result.update(profiler.status())
+		web.header('Content-Type', 'application/json; charset=utf-8')
+		return json.dumps(result, ensure_ascii=False, default=str, indent=2)
+
+class Stats(object):
+	def GET(self):
+		web.header('Content-Type', 'application/json; charset=utf-8')
+		return json.dumps({'rate_limiter': rate_limiter.stats(), 'trending': trending.stats(),
+			'replicas': db_manager.replica_status(), 'scheduler': scheduler.stats()})
+
 class Main(object):
 	def GET(self):
 		try:
@@ -81,29 +253,22 @@ class Main(object):
 			return str(e)
 	def update_user_info(self, user_name):
 		try:
-			self.db = pymysql.connect(
-				host=DB_CONFIG.get('host', 'localhost'),
-				port=int(DB_CONFIG.get('port', 3306)),
-				user=DB_CONFIG.get('user', 'douban_user'),
-				password=DB_CONFIG.get('password', 'MySQL_20050816Zln@233'),
-				db=DB_CONFIG.get('db', 'douban'),
-				charset=DB_CONFIG.get('charset', 'utf8mb4')
-			)
-			self.cursor = self.db.cursor()
-			cmd = 'select * from user_info where wx_id = "{}";'.format(user_name)
-			self.cursor.execute(cmd)
-			results = self.cursor.fetchall()
+			cmd = 'select id from user_info where wx_id = %s;'
+			results = db_manager.execute_query(cmd, (user_name,), user=user_name)
 			if len(results) == 0:
-				cmd = 'insert into user_info(wx_id, start_time) values("{}", "{}");'.format(user_name, int(time.time()))
+				#副本可能还没有同步到刚创建的用户，重复插入时忽略
+				cmd = 'insert ignore into user_info(wx_id, start_time) values(%s, %s);'
 				try:
-					self.cursor.execute(cmd)
-					self.db.commit()
-					logger.info(f"添加新用户: {user_name}")
+					if db_manager.execute_update(cmd, (user_name, int(time.time())), user=user_name):
+						logger.info(f"添加新用户: {user_name}")
 				except Exception as e:
-					self.db.rollback()
 					logger.error(f"添加用户失败: {e}")
 		except Exception as e:
 			logger.error(f"更新用户信息失败: {e}")
+	def user_id_of(self, user_name):
+		cmd = 'select id from user_info where wx_id = %s;'
+		results = db_manager.execute_query(cmd, (user_name,), user=user_name)
+		return results[0]['id'] if len(results) == 1 else None
 	def parse_cmd(self, recv_content):
 		recv_msg_buf = recv_content.split(' ')#格式标准化
 		recv_msg = []
@@ -120,219 +285,192 @@ class Main(object):
 			nice = 10
 		elif nice < 0:
 			nice = 0
-		cmd = 'select id from user_info where wx_id = "{}";'.format(user_name)#记录到数据库
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
-		user_id = results[0][0]
-		cmd = 'select id from douban_movie where title = "{}";'.format(movie_name)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
+		user_id = self.user_id_of(user_name)#记录到数据库
+		cmd = 'select id from douban_movie where title = %s;'
+		results = db_manager.execute_query(cmd, (movie_name,))
 		if len(results) == 0:
 			content = "抱歉，电影名输入有误，请重新输入。"
 		else:
 
 			for row in results:
-				movie_id = row[0]
-				cmd = 'select liking from like_movie where user_id={} and movie_id={};'.format(user_id, movie_id)
-				self.cursor.execute(cmd)
-				results = self.cursor.fetchall()
+				movie_id = row['id']
+				cmd = 'select liking from like_movie where user_id=%s and movie_id=%s;'
+				results = db_manager.execute_query(cmd, (user_id, movie_id), user=user_name)
+				#写入后该用户一段时间内读主库，紧接着的推荐能看到这次评价
 				if len(results) == 0:
-					cmd = 'insert into like_movie(user_id, movie_id, liking) values({}, {}, {});'.format(user_id, movie_id, nice)
+					cmd = 'insert into like_movie(user_id, movie_id, liking) values(%s, %s, %s);'
 					try:
-						self.cursor.execute(cmd)
-						self.db.commit()
+						db_manager.execute_update(cmd, (user_id, movie_id, nice), user=user_name)
+						trending.record(movie_id, movie_name, 'rate')
 						content = '评价成功，感谢您的支持。{}:{}分'.format(movie_name, nice)
 					except Exception as e:
-						self.db.rollback()
 						logger.error(f"评价插入失败: {e}")
 						content	= '评价失败，请重新输入。{}:{}分'.format(movie_name, nice)
 				else:
-					cmd = 'update like_movie set liking={} where user_id={} and movie_id={};'.format(nice, user_id, movie_id)
+					cmd = 'update like_movie set liking=%s where user_id=%s and movie_id=%s;'
 					try:
-						self.cursor.execute(cmd)
-						self.db.commit()
+						db_manager.execute_update(cmd, (nice, user_id, movie_id), user=user_name)
+						trending.record(movie_id, movie_name, 'rate')
 						content = '更新评分成功。{}:{}分'.format(movie_name, nice)
 					except Exception as e:
-						self.db.rollback()
 						logger.error(f"评价更新失败: {e}")
 						content	= '评价失败，请重新输入。{}:{}分'.format(movie_name, nice)
 		return content
 	def recommend(self, user_name, recv_msg):
 		content = ""
-		cmd = 'select id from user_info where wx_id="{}";'.format(user_name)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
-		if len(results) != 1:
+		user_id = self.user_id_of(user_name)
+		if user_id is None:
 			return content
-		user_id = results[0][0]
-		cmd = 'select * from like_movie where user_id={};'.format(user_id)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
-		line = {}
-		if len(results):
-			for row in results:
-				movie_id = row[1]
-				score = row[2] if row[2] != None else -1
-				line[movie_id] = score
-		
-		cmd = 'select id from user_info where wx_id<>"{}";'.format(user_name)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
-		areas = {}
-		for other_user in results:#遍历每一个用户
-			cmd = 'select * from like_movie where user_id={};'.format(other_user[0])
-			self.cursor.execute(cmd)
-			results = self.cursor.fetchall()
-			line_other = {}
-			if len(results):
-				for row in results:
-					movie_id = row[1]
-					score = row[2] if row[2] != None else -1
-					line_other[movie_id] = score
-			tup = self.compute(line, line_other)
-			areas[other_user[0]] = tup
-		neighbor_id = -1
-		for (key, val) in areas.items():
-			if val[0] == -1:
-				del areas[key]
-			elif neighbor_id == -1 and val[1] != 0:#首次赋值
-				neighbor_id = key
-			elif neighbor_id != -1 and val[1] != 0 and val[0] < areas[neighbor_id][0]:#更新
-				neighbor_id = key
-		logger.debug(f"用户相似度计算结果: {areas}")
-		if neighbor_id == -1:
-			return self.will(line)
-			#return "抱歉，由于您的评价次数过少，系统暂时推算不出您的兴趣爱好。\n请多多评价，过段时间再试。"
-		cmd = 'select * from like_movie where user_id={};'.format(neighbor_id)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
-		movies_id = []
-		for row in results:
-			if row[1] not in line:
-				movies_id.append(row[1])
-		if not len(movies_id):
+		view = shared_store.get() if shared_store is not None else None
+		state = snapshots.get()
+		#其他用户的评分依次取自共享内存、模型快照、后台加载的评分缓存，都不可用时本次不做协同过滤
+		#（快照中的评分停留在构建时刻，按天重建时最多落后24小时）
+		data = view.ratings if view is not None else state.ratings if state is not None else ratings_cache.get()
+		#当前用户的评分实时查询（生成器会排除共享数据中该用户的行）
+		cmd = 'select movie_id, liking from like_movie where user_id=%s;'
+		line = {row['movie_id']: row['liking'] if row['liking'] is not None else -1
+			for row in db_manager.execute_query(cmd, (user_id,), user=user_name)}
+		generators = {
+			'user_cf': lambda: user_cf(data, user_id, line) if data is not None else {},
+			'item_cf': lambda: item_cf(data, user_id, line) if data is not None else {},
+			'content': lambda: dict(content_picks(line, CANDIDATES_PER_STAGE)),
+			'popularity': lambda: state.popularity if state is not None and state.popularity else popularity.get(),
+			'implicit': lambda: implicit_feedback.user_scores(user_id, CANDIDATES_PER_STAGE),
+		}
+		picks = ranker.rank(generators, RECOMMENDER_CONFIG.get('max_recommendations', 10), exclude=line)
+		if not picks:
 			return self.will(line)
-			#return "抱歉，由于您的评价次数过少，系统暂时推算不出您的兴趣爱好。\n请多多评价，过段时间再试。"
+		movies_id = [movie_id for movie_id, _ in picks]
+		if view is not None:
+			found = view.rows(movies_id)
+		else:
+			cmd = 'select * from douban_movie where id in ({});'.format(','.join(['%s'] * len(movies_id)))
+			found = {row['id']: row for row in db_manager.execute_query(cmd, movies_id)}
 		for mov_id in movies_id:
-			cmd = 'select * from douban_movie where id={};'.format(mov_id)
-			self.cursor.execute(cmd)
-			result = self.cursor.fetchone()
-			title = result[1] if result[1] != None else ""
-			score = result[2] if result[2] != None else 0
-			num = result[3] if result[3] != None else 0
-			link = result[4] if result[4] != None else ""
-			date_time = result[5] if result[5] != None else ""
-			address = result[6] if result[6] != None else ""
-			other_address = result[7] if result[7] != None else ""
-			actors = result[8] if result[8] != None else ""
+			result = found.get(mov_id)
+			if result is None:
+				continue
+			title = result['title'] if result['title'] != None else ""
+			score = result['score'] if result['score'] != None else 0
+			num = result['num'] if result['num'] != None else 0
+			link = result['link'] if result['link'] != None else ""
+			date_time = result['time'] if result['time'] != None else ""
+			address = result['address'] if result['address'] != None else ""
+			other_address = result['other_release'] if result['other_release'] != None else ""
+			actors = result['actors'] if result['actors'] != None else ""
 			if score:
 				content += '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n评分:{}\n{}\n\n'.format(
 					title, date_time, address, other_address, actors, num, score, link)
 			else:
 				content += '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n{}\n\n'.format(
 					title, date_time, address, other_address, actors, num, link)
+		if len(line) < RECOMMENDER_CONFIG.get('min_ratings', 3):
+			content += '为提高您的推荐质量，请您多使用评价功能。另外，您评价过的电影不会再次推荐给您。\n'
 		return content
-	def compute(self, line, line_other):
-		area=0.0
-		common = [x for x in line if x in line_other]
-		common_num = len(common)
-		x = len(line) - common_num
-		y = len(line_other) - common_num
-		if 0 == common_num:
-			area = -1
-		else:
-			for key in common:
-				area += (line[key] - line_other[key])**2
-			area = (area*x)/(common_num**2)
-		return (area, y)#area越小越相近,-1为无交集,y为可推荐的数量
-	def will(self, line):
-		cmd = 'select count(id) from douban_movie;'
-		self.cursor.execute(cmd)
-		result = self.cursor.fetchone()
-		movie_sum = result[0]
+	def content_pick(self, line):
+		#按内容相似度挑选，模型不可用或没有喜欢的电影时返回None
+		try:
+			picks = content_picks(line, 1)
+		except Exception as e:
+			logger.error(f"内容推荐失败: {e}")
+			return None
+		if not picks:
+			return None
+		results = db_manager.execute_query('select * from douban_movie where id=%s;', (picks[0][0],))
+		return results[0] if results else None
+	def random_pick(self, line):
+		cmd = 'select count(id) as movie_sum from douban_movie;'
+		movie_sum = db_manager.execute_query(cmd)[0]['movie_sum']
 		movie_sum -= 100
-		rand = random.randint(0, movie_sum)
-		cmd = 'select * from douban_movie limit {},100;'.format(rand)
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
+		rand = random.randint(0, max(movie_sum, 0))
+		cmd = 'select * from douban_movie limit %s,100;'
+		results = db_manager.execute_query(cmd, (rand,))
 		max_score_addr = 0
 		max_score = 0.0
 		index = 0
 		for row in results:
-			if row[2] != None and row[2] > max_score and row[0] not in line:
+			if row['score'] != None and row['score'] > max_score and row['id'] not in line:
 				max_score_addr = index
-				max_score = row[2]
+				max_score = row['score']
 			index += 1
-		title = results[max_score_addr][1] if results[max_score_addr][1] != None else ""
-		score = results[max_score_addr][2] if results[max_score_addr][2] != None else 0
-		num = results[max_score_addr][3] if results[max_score_addr][3] != None else 0
-		link = results[max_score_addr][4] if results[max_score_addr][4] != None else ""
-		date_time = results[max_score_addr][5] if results[max_score_addr][5] != None else ""
-		address = results[max_score_addr][6] if results[max_score_addr][6] != None else ""
-		other_address = results[max_score_addr][7] if results[max_score_addr][7] != None else ""
-		actors = results[max_score_addr][8] if results[max_score_addr][8] != None else ""
+		return results[max_score_addr]
+	def will(self, line):
+		row = self.content_pick(line)
+		if row is None:
+			row = self.random_pick(line)
+		title = row['title'] if row['title'] != None else ""
+		score = row['score'] if row['score'] != None else 0
+		num = row['num'] if row['num'] != None else 0
+		link = row['link'] if row['link'] != None else ""
+		date_time = row['time'] if row['time'] != None else ""
+		address = row['address'] if row['address'] != None else ""
+		other_address = row['other_release'] if row['other_release'] != None else ""
+		actors = row['actors'] if row['actors'] != None else ""
 		content = '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n评分:{}\n{}\n为提高您的推荐质量，请您多使用评价功能。另外，您评价过的电影不会再次推荐给您。\n'.format(
 			title, date_time, address, other_address, actors, num, score, link)
 		return content
+	def hot(self):
+		#最近一小时搜索和评价最多的电影，直接由内存中的统计生成，不查询数据库
+		top = trending.top(10)
+		if not top:
+			return "最近还没有热门电影，快去搜索或评价一部吧。"
+		content = "最近一小时的热门电影：\n"
+		for rank, (movie_id, title, count) in enumerate(top, 1):
+			content += '{}. {}（热度:{}）\n'.format(rank, title, count)
+		return content
 	def search(self, user_name, recv_msg):
 		return self.browse(user_name, recv_msg[1:])
 	def browse(self, user_name, recv_msg):
 		movie_name = recv_msg[0]
 		content = ""
-		cmd = 'select * from douban_movie where title like "{}";'.format(movie_name)#精准查找
-		self.cursor.execute(cmd)
-		results = self.cursor.fetchall()
+		cmd = 'select * from douban_movie where title like %s;'#精准查找
+		results = db_manager.execute_query(cmd, (movie_name,))
 		logger.info(f'查找电影 "{movie_name}" 结果数量: {len(results)}')
 		if len(results):
 			for row in results:
-				title = row[1] if row[1] != None else ""
-				score = row[2] if row[2] != None else 0
-				num = row[3] if row[3] != None else 0
-				link = row[4] if row[4] != None else ""
-				date_time = row[5] if row[5] != None else ""
-				address = row[6] if row[6] != None else ""
-				other_address = row[7] if row[7] != None else ""
-				actors = row[8] if row[8] != None else ""
+				title = row['title'] if row['title'] != None else ""
+				score = row['score'] if row['score'] != None else 0
+				num = row['num'] if row['num'] != None else 0
+				link = row['link'] if row['link'] != None else ""
+				date_time = row['time'] if row['time'] != None else ""
+				address = row['address'] if row['address'] != None else ""
+				other_address = row['other_release'] if row['other_release'] != None else ""
+				actors = row['actors'] if row['actors'] != None else ""
 				if score:
 					content += '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n评分:{}\n{}\n\n'.format(
 						title, date_time, address, other_address, actors, num, score, link)
 				else:
 					content += '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n{}\n\n'.format(
 						title, date_time, address, other_address, actors, num, link)
-			cmd = 'select id from user_info where wx_id = "{}";'.format(user_name)#更新查找记录
-			self.cursor.execute(cmd)
-			results = self.cursor.fetchall()
-			user_id = results[0][0]
-			cmd = 'select id from douban_movie where title = "{}";'.format(movie_name)
-			self.cursor.execute(cmd)
-			results = self.cursor.fetchall()
+			user_id = self.user_id_of(user_name)#更新查找记录
+			cmd = 'select id from douban_movie where title = %s;'
+			results = db_manager.execute_query(cmd, (movie_name,))
 			for row in results:
-				movie_id = row[0]
-				cmd = 'insert into seek_movie(user_id, movie_id, seek_time) values({}, {}, {})'.format(user_id, movie_id, int(time.time()))
+				movie_id = row['id']
+				trending.record(movie_id, movie_name)
+				#搜索记录不会被该用户立即读回，不需要读己之写
+				cmd = 'insert into seek_movie(user_id, movie_id, seek_time) values(%s, %s, %s)'
 				try:
-					self.cursor.execute(cmd)
-					self.db.commit()
+					db_manager.execute_update(cmd, (user_id, movie_id, int(time.time())))
 				except Exception as e:
-					self.db.rollback()
 					logger.error(f"搜索记录插入失败: {e}")
 		else:#模糊查找
-			cmd = 'select * from douban_movie where title like "%{}%" limit 5;'.format(movie_name)
-			self.cursor.execute(cmd)
-			results = self.cursor.fetchall()
+			cmd = 'select * from douban_movie where title like %s limit 5;'
+			results = db_manager.execute_query(cmd, ('%' + movie_name + '%',))
 			logger.info(f'模糊查找电影 "{movie_name}" 结果数量: {len(results)}')
 			if len(results) == 0:
 				content = "抱歉，暂时没有收录该影片。"#找不到
 			else:
 				content = "您在找的可能是：\n"#模糊匹配到
 				for row in results:
-					title = row[1] if row[1] != None else ""
-					score = row[2] if row[2] != None else 0
-					num = row[3] if row[3] != None else 0
-					link = row[4] if row[4] != None else ""
-					date_time = row[5] if row[5] != None else ""
-					address = row[6] if row[6] != None else ""
-					other_address = row[7] if row[7] != None else ""
-					actors = row[8] if row[8] != None else ""
+					title = row['title'] if row['title'] != None else ""
+					score = row['score'] if row['score'] != None else 0
+					num = row['num'] if row['num'] != None else 0
+					link = row['link'] if row['link'] != None else ""
+					date_time = row['time'] if row['time'] != None else ""
+					address = row['address'] if row['address'] != None else ""
+					other_address = row['other_release'] if row['other_release'] != None else ""
+					actors = row['actors'] if row['actors'] != None else ""
 					content += '{}\n{}\n{}\n{}\n{}\n评价人数:{}\n评分:{}\n{}\n\n'.format(
 						title, date_time, address, other_address, actors, num, score, link)
 		return content
@@ -354,11 +492,12 @@ class Main(object):
 			content = self.recommend(user_name, recv_msg)
 		elif exe_cmd == '搜索':
 			content = self.search(user_name, recv_msg)
+		elif exe_cmd == '热门':
+			content = self.hot()
 		elif exe_cmd == '怎么用':
-			content = "您可以发送以下内容给我：\n搜索 无问西东\n评价 秦时明月 8.9\n推荐\n怎么用"
+			content = "您可以发送以下内容给我：\n搜索 无问西东\n评价 秦时明月 8.9\n推荐\n热门\n怎么用"
 		else:
 			content = self.browse(user_name, recv_msg)
-		self.db.close()
 		return content
 
 	def on_image(self, recMsg):
@@ -369,32 +508,13 @@ class Main(object):
 		content = ""
 		if recMsg.Event == "subscribe":
 			try:
-				db = pymysql.connect(
-					host=DB_CONFIG.get('host', 'localhost'),
-					port=int(DB_CONFIG.get('port', 3306)),
-					user=DB_CONFIG.get('user', 'douban_user'),
-					password=DB_CONFIG.get('password', 'MySQL_20050816Zln@233'),
-					db=DB_CONFIG.get('db', 'douban'),
-					charset=DB_CONFIG.get('charset', 'utf8mb4')
-				)
-				cursor = db.cursor()
-				cmd = 'select * from user_info where wx_id = "{}";'.format(recMsg.FromUserName)
-				cursor.execute(cmd)
-				results = cursor.fetchall()
-				if len(results) == 0:
-					cmd = 'insert into user_info(wx_id, start_time) values("{}", "{}");'.format(recMsg.FromUserName, int(time.time()))
-					try:
-						cursor.execute(cmd)
-						db.commit()
-						logger.info(f"用户订阅：添加新用户 {recMsg.FromUserName}")
-					except Exception as e:
-						db.rollback()
-						logger.error(f"用户订阅：添加用户失败: {e}")
-				db.close()
+				cmd = 'insert ignore into user_info(wx_id, start_time) values(%s, %s);'
+				if db_manager.execute_update(cmd, (recMsg.FromUserName, int(time.time())), user=recMsg.FromUserName):
+					logger.info(f"用户订阅：添加新用户 {recMsg.FromUserName}")
 			except Exception as e:
 				logger.error(f"用户订阅事件处理失败: {e}", exc_info=True)
 				
-			content = "感谢您的关注与支持，评价电影超过一定次数后，本平台将为您提供个性化推荐服务。您可以发送以下内容给我：\n搜索 无问西东\n评价 秦时明月 8.9\n推荐\n怎么用"
+			content = "感谢您的关注与支持，评价电影超过一定次数后，本平台将为您提供个性化推荐服务。您可以发送以下内容给我：\n搜索 无问西东\n评价 秦时明月 8.9\n推荐\n热门\n怎么用"
 			return content
 		elif recMsg.Event == "unsubscribe":
 			logger.info(f"用户取消订阅: {recMsg.FromUserName}")
@@ -403,23 +523,78 @@ class Main(object):
 			logger.info(f"收到其他事件: {recMsg.Event} 来自用户: {recMsg.FromUserName}")
 			return content
 
+	def limited(self, recMsg, handler):
+		#限流：超出用户令牌桶或全局并发上限时，不访问数据库，直接返回缓存或固定回复
+		user_name = recMsg.FromUserName
+		if recMsg.MsgType == 'text':
+			recv_content = recMsg.Content
+			if isinstance(recv_content, bytes):
+				recv_content = recv_content.decode('utf-8')
+			key = ' '.join(self.parse_cmd(recv_content or ""))
+		else:
+			key = 'event:{}'.format(recMsg.Event)
+		if not rate_limiter.allow(user_name):
+			logger.warning(f"用户 {user_name} 请求过于频繁，已降级处理")
+			return rate_limiter.shed_reply(user_name, key)
+		if not rate_limiter.try_enter():
+			logger.warning("并发请求数已达上限，已降级处理")
+			return rate_limiter.shed_reply(user_name, key)
+		try:
+			content = handler(recMsg)
+		finally:
+			rate_limiter.leave()
+		rate_limiter.remember(user_name, key, content)
+		return content
+
+	def command_of(self, recMsg):
+		#用于监控统计的命令名称
+		if not isinstance(recMsg, receive.Msg):
+			return 'other'
+		if recMsg.MsgType == 'text':
+			recv_content = recMsg.Content
+			if isinstance(recv_content, bytes):
+				recv_content = recv_content.decode('utf-8')
+			recv_msg = self.parse_cmd(recv_content or "")
+			if recv_msg and recv_msg[0] in TEXT_COMMANDS:
+				return recv_msg[0]
+			return '浏览'
+		if recMsg.MsgType in ('image', 'event'):
+			return recMsg.MsgType
+		return 'other'
+
 	def POST(self):
+		metrics.begin_request()
+		request_token = set_request_id(uuid.uuid4().hex[:12])
+		self.command = 'other'
+		self.reply_size = 0
+		try:
+			return self.handle_post()
+		finally:
+			profiler.untag()
+			sql_tracer.end_request()
+			metrics.end_request(self.command, self.reply_size)
+			reset_request_id(request_token)
+
+	def handle_post(self):
 		try:
 			webData = web.data()
 			logger.info(f"收到POST请求：{len(webData)}字节")
 			content = ""
 			recMsg = receive.parse_xml(webData)
+			self.command = self.command_of(recMsg)
+			sql_tracer.begin_request(self.command)
+			profiler.tag(self.command)
 			toUser = recMsg.FromUserName
 			fromUser = recMsg.ToUserName
 			if isinstance(recMsg, receive.Msg) and recMsg.MsgType == 'text':#主要业务逻辑
-				logger.info(f"收到文本消息：{recMsg.Content}")
-				content = self.on_text(recMsg)
+				logger.info(f"收到文本消息：{recMsg.Content}", extra={'category': 'message'})
+				content = self.limited(recMsg, self.on_text)
 			elif isinstance(recMsg, receive.Msg) and recMsg.MsgType == 'image':
 				logger.info(f"收到图片消息")
 				content = self.on_image(recMsg)
 			elif isinstance(recMsg, receive.Msg) and recMsg.MsgType == 'event':
 				logger.info(f"收到事件：{recMsg.Event}")
-				content = self.on_event(recMsg)
+				content = self.limited(recMsg, self.on_event)
 			else:
 				logger.warning(f"不支持的消息类型: {recMsg.MsgType if hasattr(recMsg, 'MsgType') else '未知'}")
 				return "success"
@@ -427,9 +602,10 @@ class Main(object):
 			if content == "":
 				return "success"
 			
-			logger.info(f"回复消息: {content[:50]}...")
+			logger.info(f"回复消息: {content[:50]}...", extra={'category': 'reply'})
 			replyMsg = reply.TextMsg(toUser, fromUser, content)
 			data = replyMsg.send()
+			self.reply_size = len(data.encode('utf-8'))
 			return data
 		except Exception as e:
 			logger.error(f"处理POST请求失败: {e}", exc_info=True)
@@ -440,6 +616,10 @@ if __name__ == '__main__':
 		# 设置监听所有接口(0.0.0.0)而不是默认的localhost
 		web.config.debug = False  # 生产环境关闭调试
 		app = web.application(urls, globals())
+		# kill -USR2 <pid> 触发30秒采样分析
+		install_signal_handler(profiler)
+		if SCHEDULER_CONFIG.get('enabled', True):
+			start_scheduler()
 		port = int(SERVICE_CONFIG.get('port', 80))
 		logger.info(f"启动Web服务器，监听地址：0.0.0.0:{port}")
 		web.httpserver.runsimple(app.wsgifunc(), ('0.0.0.0', port))
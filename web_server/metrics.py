@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+监控指标模块
+提供Prometheus文本格式的计数器与直方图，按线程分片累加，热路径无锁
+线程结束时其分片并入退役分片，线程不断创建和退出时分片数不会增长
+作者：电影推荐系统团队
+日期：2025-06-05
+"""
+
+import time
+import weakref
+import threading
+from bisect import bisect_left
+
+# 默认的耗时直方图分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求的SQL条数分桶
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# 回复大小分桶（字节）
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    """生成Prometheus标签字符串"""
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    parts = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    """格式化数值"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _ShardOwner:
+    """挂在线程局部存储上的分片持有者，线程结束时被回收"""
+
+    __slots__ = ('__weakref__',)
+
+
+class _ShardedMetric:
+    """按线程分片的指标基类：每个线程只写自己的字典，采集时合并"""
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        初始化指标
+
+        参数:
+            name: 指标名称
+            documentation: 指标说明
+            labelnames: 标签名列表
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # 已结束线程的累计值，始终是第一个分片
+        self._retired = {}
+        self._shards = [self._retired]
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        """获取当前线程的分片（首次访问时注册，线程结束时并入退役分片）"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards.append(values)
+            # 线程结束时线程局部存储被清除，owner随之回收
+            weakref.finalize(owner, self._retire, values).atexit = False
+            self._local.owner = owner
+            self._local.values = values
+            return values
+
+    def _retire(self, values):
+        """把已结束线程的分片并入退役分片"""
+        with self._shards_lock:
+            for i in range(len(self._shards) - 1, 0, -1):
+                if self._shards[i] is values:
+                    del self._shards[i]
+                    break
+            self._merge(self._retired, dict(values))
+
+    def _merge(self, total, shard):
+        """把shard累加到total（子类实现）"""
+        raise NotImplementedError
+
+    def _snapshots(self):
+        """复制所有分片（与分片退役互斥，同一线程的值不会被重复或遗漏）"""
+        with self._shards_lock:
+            return [dict(shard) for shard in self._shards]
+
+
+class Counter(_ShardedMetric):
+    """计数器"""
+
+    metric_type = 'counter'
+
+    def inc(self, labelvalues=(), amount=1):
+        """
+        增加计数
+
+        参数:
+            labelvalues: 标签值元组
+            amount: 增加的数量
+        """
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, total, shard):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def collect(self):
+        """
+        合并所有线程的计数
+
+        返回:
+            dict: 标签值元组 -> 计数
+        """
+        merged = {}
+        for shard in self._snapshots():
+            self._merge(merged, shard)
+        return merged
+
+    def render(self):
+        """生成Prometheus文本格式"""
+        lines = []
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_ShardedMetric):
+    """直方图"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        初始化直方图
+
+        参数:
+            name: 指标名称
+            documentation: 指标说明
+            labelnames: 标签名列表
+            buckets: 分桶上界（升序）
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labelvalues=()):
+        """
+        记录一次观测值
+
+        参数:
+            value: 观测值
+            labelvalues: 标签值元组
+        """
+        shard = self._shard()
+        slots = shard.get(labelvalues)
+        if slots is None:
+            # 每个分桶一个计数（非累计），外加+Inf、总和
+            slots = [0] * (len(self.buckets) + 1) + [0.0]
+            shard[labelvalues] = slots
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def _merge(self, total, shard):
+        # 生成新列表而不原地修改，已复制出去的快照不受影响
+        for labels, slots in shard.items():
+            current = total.get(labels)
+            total[labels] = list(slots) if current is None else [a + b for a, b in zip(current, slots)]
+
+    def collect(self):
+        """
+        合并所有线程的分桶
+
+        返回:
+            dict: 标签值元组 -> [各分桶计数..., +Inf计数, 总和]
+        """
+        merged = {}
+        for shard in self._snapshots():
+            self._merge(merged, shard)
+        return merged
+
+    def render(self):
+        """生成Prometheus文本格式"""
+        lines = []
+        for labels, slots in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), slots):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(slots[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class CallbackGauge:
+    """在采集时调用函数取值的仪表"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        """
+        初始化仪表
+
+        参数:
+            name: 指标名称
+            documentation: 指标说明
+            callback: 返回 {标签值元组: 数值} 的函数
+            labelnames: 标签名列表
+        """
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        """生成Prometheus文本格式"""
+        lines = []
+        for labels, value in sorted(self.callback().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        """初始化注册表"""
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        注册指标
+
+        参数:
+            metric: 指标对象
+
+        返回:
+            指标对象本身
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """创建并注册计数器"""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """创建并注册直方图"""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        """创建并注册回调仪表"""
+        return self.register(CallbackGauge(name, documentation, callback, labelnames))
+
+    def render(self):
+        """
+        生成所有指标的Prometheus文本格式
+
+        返回:
+            str: 文本格式的指标
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表与内置指标
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    'wechat_requests_total', '按命令统计的请求数', ('command',))
+REQUEST_LATENCY = REGISTRY.histogram(
+    'wechat_request_duration_seconds', '按命令统计的请求耗时', ('command',))
+REQUEST_DB_QUERIES = REGISTRY.histogram(
+    'wechat_request_db_queries', '每个请求执行的SQL条数', ('command',), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = REGISTRY.histogram(
+    'wechat_request_db_seconds', '每个请求的数据库耗时', ('command',))
+REPLY_SIZE = REGISTRY.histogram(
+    'wechat_reply_size_bytes', '回复消息大小', ('command',), SIZE_BUCKETS)
+POOL_CHECKOUT_WAIT = REGISTRY.histogram(
+    'db_pool_checkout_wait_seconds', '从连接池获取连接的等待时间')
+CACHE_REQUESTS = REGISTRY.counter(
+    'cache_requests_total', '缓存访问次数', ('cache', 'result'))
+
+
+def _cache_hit_ratio():
+    """按缓存名称计算命中率"""
+    totals = {}
+    for (cache, result), value in CACHE_REQUESTS.collect().items():
+        hits, count = totals.get(cache, (0, 0))
+        if result == 'hit':
+            hits += value
+        totals[cache] = (hits, count + value)
+    return {(cache,): hits / count for cache, (hits, count) in totals.items() if count}
+
+
+REGISTRY.gauge('cache_hit_ratio', '缓存命中率', _cache_hit_ratio, ('cache',))
+
+# 当前线程正在处理的请求的数据库统计
+_request = threading.local()
+
+
+def begin_request():
+    """开始统计当前线程的请求"""
+    _request.db_queries = 0
+    _request.db_time = 0.0
+    _request.start = time.perf_counter()
+
+
+def record_db(elapsed):
+    """
+    记录一次SQL执行
+
+    参数:
+        elapsed: SQL执行耗时（秒）
+    """
+    try:
+        _request.db_queries += 1
+        _request.db_time += elapsed
+    except AttributeError:
+        # 不在请求上下文中（如后台任务），忽略
+        pass
+
+
+def end_request(command, reply_size=0):
+    """
+    结束请求统计并记录指标
+
+    参数:
+        command: 命令名称（评价/推荐/搜索/浏览/event等）
+        reply_size: 回复消息的字节数
+    """
+    start = getattr(_request, 'start', None)
+    if start is None:
+        return
+    labels = (command,)
+    REQUESTS_TOTAL.inc(labels)
+    REQUEST_LATENCY.observe(time.perf_counter() - start, labels)
+    REQUEST_DB_QUERIES.observe(_request.db_queries, labels)
+    REQUEST_DB_TIME.observe(_request.db_time, labels)
+    REPLY_SIZE.observe(reply_size, labels)
+    del _request.start
+
+
+def record_cache(cache, hit):
+    """
+    记录一次缓存访问
+
+    参数:
+        cache: 缓存名称
+        hit: 是否命中
+    """
+    CACHE_REQUESTS.inc((cache, 'hit' if hit else 'miss'))
+
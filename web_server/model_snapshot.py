@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+推荐模型快照模块
+离线任务把预计算的推荐状态（评分矩阵、内容特征、热门候选）写成一个版本目录：
+  <root>/<版本>/<块名>.npy    每个数组一个.npy文件
+  <root>/<版本>/manifest.json 版本号、格式版本、各块的dtype/shape/sha256及元数据
+  <root>/CURRENT              当前版本号（写完整个版本目录后原子替换）
+Web进程以只读方式内存映射各块，多个进程共享同一份页缓存，启动时间和内存不随进程数增长；
+CURRENT变化时校验新版本并原子切换，校验失败时继续使用当前版本，启动时依次回退到更早的版本
+作者：电影推荐系统团队
+日期：2025-07-22
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+from .logger import movie_recommender_logger as logger
+from .content_recommender import ContentModel, catalog_rows
+from .hybrid_ranker import RatingData, popularity_scores, POPULARITY_SQL
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SNAPSHOT_DIR = os.path.join(PROJECT_ROOT, 'models', 'snapshots')
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+CURRENT = 'CURRENT'
+
+
+class SnapshotError(Exception):
+    """快照缺失、格式不符或校验失败"""
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(root, blocks, meta=None, keep=3):
+    """
+    写入一个新版本并设为当前版本
+
+    参数:
+        root: 快照根目录
+        blocks: {块名: numpy数组}
+        meta: 可JSON序列化的元数据
+        keep: 保留的版本数（含新版本）
+
+    返回:
+        str: 版本号
+    """
+    os.makedirs(root, exist_ok=True)
+    # 版本号按时间排序（精确到毫秒，同一秒内写入的版本也有先后），回退时按此找更早的版本
+    now = time.time()
+    version = time.strftime('%Y%m%d%H%M%S', time.localtime(now)) + f'{int(now * 1000) % 1000:03d}-' + os.urandom(3).hex()
+    tmp_dir = os.path.join(root, '.tmp-' + version)
+    os.makedirs(tmp_dir)
+    try:
+        manifest = {'version': version, 'format': FORMAT_VERSION, 'created_at': time.time(),
+                    'meta': meta or {}, 'blocks': {}}
+        for name, array in blocks.items():
+            array = np.ascontiguousarray(array)
+            path = os.path.join(tmp_dir, name + '.npy')
+            with open(path, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+                f.flush()
+                os.fsync(f.fileno())
+            manifest['blocks'][name] = {'file': name + '.npy', 'dtype': array.dtype.str,
+                                        'shape': list(array.shape), 'sha256': _sha256(path)}
+        with open(os.path.join(tmp_dir, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_dir, os.path.join(root, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(root, CURRENT + '.tmp')
+    with open(pointer, 'w') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, CURRENT))
+    _fsync_dir(root)
+
+    # 旧版本可能仍被其他进程映射，删除目录不影响已映射的文件
+    for old in list_versions(root)[keep:]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def list_versions(root):
+    """
+    返回:
+        list: 已写完的版本号，新的在前
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    return sorted((n for n in names if not n.startswith('.') and os.path.isfile(os.path.join(root, n, MANIFEST))),
+                  reverse=True)
+
+
+def current_version(root):
+    """CURRENT指向的版本号，没有时为None"""
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class Snapshot(object):
+    """一个已校验的快照版本，各块为只读内存映射数组"""
+
+    def __init__(self, root, version, verify=True):
+        """
+        打开快照
+
+        参数:
+            root: 快照根目录
+            version: 版本号
+            verify: 是否校验sha256
+
+        异常:
+            SnapshotError: 清单缺失、格式不符、文件损坏
+        """
+        self.version = version
+        self.path = os.path.join(root, version)
+        try:
+            with open(os.path.join(self.path, MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"无法读取清单: {str(e)}")
+        if manifest.get('format') != FORMAT_VERSION:
+            raise SnapshotError(f"不支持的快照格式 {manifest.get('format')}")
+        self.meta = manifest.get('meta', {})
+        self.blocks = {}
+        for name, info in manifest['blocks'].items():
+            path = os.path.join(self.path, info['file'])
+            if verify and _sha256(path) != info['sha256']:
+                raise SnapshotError(f"块 {name} 校验失败")
+            try:
+                array = np.load(path, mmap_mode='r', allow_pickle=False)
+            except (OSError, ValueError) as e:
+                raise SnapshotError(f"块 {name} 无法加载: {str(e)}")
+            if array.dtype.str != info['dtype'] or list(array.shape) != info['shape']:
+                raise SnapshotError(f"块 {name} 的类型或形状与清单不符")
+            self.blocks[name] = array
+
+    def group(self, prefix):
+        """
+        返回:
+            dict: 以 prefix. 开头的块，去掉前缀
+        """
+        prefix += '.'
+        return {name[len(prefix):]: array for name, array in self.blocks.items() if name.startswith(prefix)}
+
+
+class RecommenderState(object):
+    """由快照构造的推荐状态：评分数据、内容模型、热门候选"""
+
+    def __init__(self, snapshot):
+        """
+        初始化
+
+        参数:
+            snapshot: Snapshot
+        """
+        self.version = snapshot.version
+        self.ratings = RatingData.from_columns(snapshot.group('ratings'))
+        content = snapshot.meta.get('content')
+        self.content = ContentModel.from_columns(
+            snapshot.group('content'), content['num_features'], content['built_at']) if content else None
+        popular = snapshot.group('popularity')
+        self.popularity = dict(zip(popular['movie_ids'].tolist(), popular['scores'].tolist())) if popular else {}
+
+
+class SnapshotStore(object):
+    """持有当前快照，定期检查CURRENT并切换到新版本"""
+
+    def __init__(self, root=DEFAULT_SNAPSHOT_DIR, factory=RecommenderState, check_interval=5.0):
+        """
+        初始化
+
+        参数:
+            root: 快照根目录
+            factory: 由Snapshot构造状态对象的函数
+            check_interval: 检查新版本的间隔（秒）
+        """
+        self.root = root
+        self.factory = factory
+        self.check_interval = check_interval
+        self.state = None
+        self.version = None
+        self._checked = 0.0
+        self._failed = set()
+        self._loading = threading.Lock()
+
+    def get(self):
+        """
+        当前状态，没有可用快照时为None
+        （到检查间隔时在后台线程检查并加载新版本，请求线程不做校验和加载，继续使用当前状态）
+
+        返回:
+            当前状态对象
+        """
+        if time.monotonic() - self._checked >= self.check_interval and not self._loading.locked():
+            self._checked = time.monotonic()
+            threading.Thread(target=self.refresh, name='snapshot-refresh', daemon=True).start()
+        return self.state
+
+    def refresh(self):
+        """
+        CURRENT指向新版本时加载并切换；加载失败的版本不再重试，尚无可用状态时回退到更早的版本
+
+        返回:
+            bool: 是否切换了版本
+        """
+        if not self._loading.acquire(blocking=False):
+            return False
+        try:
+            self._checked = time.monotonic()
+            target = current_version(self.root)
+            if target is None or target == self.version:
+                return False
+            candidates = [target] if target not in self._failed else []
+            if self.state is None:
+                candidates += [v for v in list_versions(self.root) if v < target and v not in self._failed]
+            for version in candidates:
+                try:
+                    started = time.time()
+                    state = self.factory(Snapshot(self.root, version))
+                except Exception as e:
+                    self._failed.add(version)
+                    logger.error(f"加载模型快照 {version} 失败: {str(e)}")
+                    continue
+                self.state, self.version = state, version
+                logger.info(f"已切换到模型快照 {version}，用时 {(time.time() - started) * 1000:.1f} 毫秒")
+                return True
+            return False
+        finally:
+            self._loading.release()
+
+
+def build_blocks(catalog, ratings, popular):
+    """
+    由数据库查询结果构造快照的块和元数据
+
+    参数:
+        catalog: (id, actors, director, category, address, time) 行
+        ratings: (user_id, movie_id, liking) 行
+        popular: (id, score, num) 行
+
+    返回:
+        tuple: (块字典, 元数据)
+    """
+    blocks = {}
+    for name, array in RatingData(ratings).columns().items():
+        blocks['ratings.' + name] = array
+    content = ContentModel.build(catalog)
+    for name, array in content.columns().items():
+        blocks['content.' + name] = array
+    scores = popularity_scores(popular)
+    blocks['popularity.movie_ids'] = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+    blocks['popularity.scores'] = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+    meta = {'content': {'num_features': content.num_features, 'built_at': content.built_at}}
+    return blocks, meta
+
+
+def build_snapshot(db_manager, root=DEFAULT_SNAPSHOT_DIR, keep=3, popular=50):
+    """
+    从数据库读取并写入一个新版本的快照
+
+    参数:
+        db_manager: 数据库管理器
+        root: 快照根目录
+        keep: 保留的版本数
+        popular: 热门候选数
+
+    返回:
+        str: 版本号
+    """
+    catalog = catalog_rows(db_manager)
+    ratings = [(r['user_id'], r['movie_id'], r['liking'])
+               for r in db_manager.execute_query('select user_id, movie_id, liking from like_movie')]
+    popular = [(r['id'], r['score'], r['num']) for r in db_manager.execute_query(POPULARITY_SQL, (popular,))]
+    blocks, meta = build_blocks(catalog, ratings, popular)
+    return write_snapshot(root, blocks, meta, keep=keep)
+
+
+def main():
+    """离线构建模型快照"""
+    parser = argparse.ArgumentParser(description='构建推荐模型快照（评分矩阵、内容特征、热门候选）')
+    parser.add_argument('--root', default='', help='快照根目录，默认使用[recommender] snapshot_dir')
+    parser.add_argument('--keep', type=int, default=3, help='保留的版本数')
+    parser.add_argument('--popular', type=int, default=50, help='热门候选数')
+    args = parser.parse_args()
+
+    from .config_parser import ConfigParser
+    from .db_manager import db_manager
+
+    root = args.root or ConfigParser().get_recommender_config().get('snapshot_dir') or DEFAULT_SNAPSHOT_DIR
+    version = build_snapshot(db_manager, root, keep=args.keep, popular=args.popular)
+    print(f"已写入快照 {os.path.join(root, version)}")
+
+
+if __name__ == '__main__':
+    main()
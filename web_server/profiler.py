@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+采样性能分析模块
+按需在指定时长内对处理请求的工作线程进行栈采样，
+输出火焰图工具可读的折叠栈文件，并按命令统计采样数
+作者：电影推荐系统团队
+日期：2025-06-12
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+from .logger import movie_recommender_logger as logger, default_log_dir
+
+# 默认输出目录（日志目录下的profiles）
+PROFILE_DIR = os.path.join(default_log_dir(), 'profiles')
+
+
+class SamplingProfiler:
+    """栈采样分析器，未启动时不创建线程，也不记录任何数据"""
+
+    def __init__(self, output_dir=PROFILE_DIR, interval=0.005, max_seconds=300):
+        """
+        初始化分析器
+
+        参数:
+            output_dir: 折叠栈文件的输出目录
+            interval: 采样间隔（秒）
+            max_seconds: 单次采样允许的最长时间（秒）
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_seconds = max_seconds
+        # 仅在采样期间为真，工作线程据此决定是否登记当前命令
+        self.active = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._commands = {}
+        self._frame_names = {}
+        self.last_result = None
+
+    def tag(self, command):
+        """
+        登记当前线程正在处理的命令（仅在采样期间生效）
+
+        参数:
+            command: 命令名称
+        """
+        if self.active:
+            self._commands[threading.get_ident()] = command
+
+    def untag(self):
+        """清除当前线程的命令登记"""
+        if self.active:
+            self._commands.pop(threading.get_ident(), None)
+
+    def start(self, seconds=30, all_threads=False):
+        """
+        开始采样
+
+        参数:
+            seconds: 采样时长（秒）
+            all_threads: 是否采样所有线程（默认只采样正在处理请求的线程）
+
+        返回:
+            bool: 成功启动返回True，已有采样在进行时返回False
+        """
+        seconds = max(1, min(int(seconds), self.max_seconds))
+        with self._lock:
+            if self.active:
+                return False
+            self.active = True
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, all_threads),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+        logger.info(f"开始采样分析，时长 {seconds} 秒")
+        return True
+
+    def status(self):
+        """
+        获取分析器状态
+
+        返回:
+            dict: 是否在采样以及上一次采样结果
+        """
+        return {'active': self.active, 'last_result': self.last_result}
+
+    def _frame_name(self, code):
+        """生成栈帧名称（按code对象缓存）"""
+        name = self._frame_names.get(code)
+        if name is None:
+            name = f"{code.co_name}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+            name = name.replace(';', ':').replace(' ', '_')
+            self._frame_names[code] = name
+        return name
+
+    def _run(self, seconds, all_threads):
+        """采样线程主循环"""
+        own_ident = threading.get_ident()
+        stacks = {}
+        by_command = {}
+        samples = 0
+        started = time.time()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                commands = dict(self._commands)
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    command = commands.get(ident)
+                    if command is None:
+                        if not all_threads:
+                            continue
+                        command = 'idle'
+                    names = []
+                    while frame is not None:
+                        names.append(self._frame_name(frame.f_code))
+                        frame = frame.f_back
+                    names.append(command)
+                    names.reverse()
+                    stack = ';'.join(names)
+                    stacks[stack] = stacks.get(stack, 0) + 1
+                    by_command[command] = by_command.get(command, 0) + 1
+                    samples += 1
+                time.sleep(self.interval)
+            self.last_result = self._write(started, stacks, by_command, samples)
+            logger.info(f"采样分析完成，共 {samples} 个样本，输出: {self.last_result['folded']}")
+        except Exception as e:
+            logger.error(f"采样分析失败: {str(e)}")
+            self.last_result = {'error': str(e)}
+        finally:
+            self.active = False
+            self._commands.clear()
+
+    def _write(self, started, stacks, by_command, samples):
+        """写出折叠栈与按命令统计的结果"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+        folded_path = os.path.join(self.output_dir, f'profile-{stamp}.folded')
+        summary_path = os.path.join(self.output_dir, f'profile-{stamp}.json')
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+        summary = {
+            'started': started,
+            'seconds': round(time.time() - started, 3),
+            'interval': self.interval,
+            'samples': samples,
+            'by_command': by_command,
+            'folded': folded_path,
+        }
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        summary['summary'] = summary_path
+        return summary
+
+
+def install_signal_handler(profiler, signum=None, seconds=30):
+    """
+    注册信号处理函数，收到信号时开始采样
+
+    参数:
+        profiler: 分析器实例
+        signum: 信号编号，默认为SIGUSR2
+        seconds: 每次采样时长（秒）
+
+    返回:
+        bool: 注册成功返回True（非主线程或平台不支持时返回False）
+    """
+    import signal
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR2', None)
+    if signum is None:
+        return False
+    try:
+        signal.signal(signum, lambda *_: profiler.start(seconds))
+        return True
+    except ValueError:
+        return False
+
+# 全局分析器实例
+profiler = SamplingProfiler()
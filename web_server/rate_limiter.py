@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+请求限流模块
+提供按用户的令牌桶限流、全局并发上限以及降级回复缓存
+降级时只对只读命令重放缓存的回复；写命令（评价、关注）没有执行，不能回复上一次的结果
+作者：电影推荐系统团队
+日期：2025-06-02
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from .metrics import record_cache
+
+# 降级时返回的固定回复
+SHED_REPLY = "当前请求过多，请稍后再试。"
+# 写命令被降级时的回复
+BUSY_REPLY = "系统繁忙，请稍后再试"
+# 会写数据库的命令（请求标识的第一段）
+WRITE_COMMANDS = ('评价', 'event:subscribe')
+
+
+def key_command(key):
+    """请求标识中的命令名（第一段）"""
+    return key.split(' ', 1)[0] if key else ''
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        """
+        初始化令牌桶
+
+        参数:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发请求数）
+            now: 当前时间（秒）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def consume(self, now, amount=1):
+        """
+        尝试消耗令牌
+
+        参数:
+            now: 当前时间（秒）
+            amount: 需要消耗的令牌数
+
+        返回:
+            bool: 令牌足够返回True，否则返回False
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+
+class RateLimiter:
+    """按用户限流与全局并发控制"""
+
+    def __init__(self, rate=0.5, burst=5, max_inflight=20, max_users=10000, cache_ttl=300,
+                 write_commands=WRITE_COMMANDS):
+        """
+        初始化限流器
+
+        参数:
+            rate: 每个用户每秒补充的令牌数
+            burst: 每个用户允许的突发请求数
+            max_inflight: 全局同时处理的最大请求数
+            max_users: 最多跟踪的用户数（超出后淘汰最久未访问的用户）
+            cache_ttl: 降级回复缓存的有效期（秒）
+            write_commands: 写命令，降级时不重放缓存的回复
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.max_users = max_users
+        self.cache_ttl = cache_ttl
+        self.write_commands = frozenset(write_commands)
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._replies = OrderedDict()
+        self._inflight = 0
+
+        # 监控计数
+        self.counters = {
+            'served': 0,
+            'shed_user': 0,
+            'shed_global': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'shed_write': 0,
+        }
+
+    def allow(self, user_name):
+        """
+        检查用户令牌桶是否允许本次请求
+
+        参数:
+            user_name: 用户的微信ID
+
+        返回:
+            bool: 允许返回True，超出限制返回False
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_name)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, now)
+                self._buckets[user_name] = bucket
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_name)
+            allowed = bucket.consume(now)
+            if not allowed:
+                self.counters['shed_user'] += 1
+            return allowed
+
+    def try_enter(self):
+        """
+        尝试占用一个全局并发名额（不阻塞）
+
+        返回:
+            bool: 成功占用返回True，已达上限返回False
+        """
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                self.counters['shed_global'] += 1
+                return False
+            self._inflight += 1
+            self.counters['served'] += 1
+            return True
+
+    def leave(self):
+        """释放一个全局并发名额"""
+        with self._lock:
+            if self._inflight > 0:
+                self._inflight -= 1
+
+    def is_write(self, key):
+        """
+        请求是否为写命令
+
+        参数:
+            key: 请求内容的标识（如标准化后的命令）
+
+        返回:
+            bool: 写命令返回True
+        """
+        return key_command(key) in self.write_commands
+
+    def remember(self, user_name, key, content):
+        """
+        缓存用户最近一次只读命令的回复，供降级时使用
+
+        参数:
+            user_name: 用户的微信ID
+            key: 请求内容的标识（如标准化后的命令）
+            content: 回复内容
+        """
+        if not content or self.is_write(key):
+            return
+        with self._lock:
+            self._replies[user_name] = (key, content, time.monotonic())
+            self._replies.move_to_end(user_name)
+            if len(self._replies) > self.max_users:
+                self._replies.popitem(last=False)
+
+    def shed_reply(self, user_name, key):
+        """
+        获取降级回复：只读命令优先返回相同请求的缓存回复，否则返回固定提示；
+        写命令没有执行，返回繁忙提示
+
+        参数:
+            user_name: 用户的微信ID
+            key: 请求内容的标识
+
+        返回:
+            str: 回复内容
+        """
+        if self.is_write(key):
+            with self._lock:
+                self.counters['shed_write'] += 1
+            return BUSY_REPLY
+        now = time.monotonic()
+        with self._lock:
+            cached = self._replies.get(user_name)
+            if cached and cached[0] == key and now - cached[2] <= self.cache_ttl:
+                self.counters['cache_hits'] += 1
+                reply = cached[1]
+            else:
+                self.counters['cache_misses'] += 1
+                reply = None
+        record_cache('shed_reply', reply is not None)
+        return reply or SHED_REPLY
+
+    def stats(self):
+        """
+        获取限流统计信息
+
+        返回:
+            dict: 计数器及当前状态
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['inflight'] = self._inflight
+            stats['tracked_users'] = len(self._buckets)
+        return stats
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+后台任务调度模块
+与Web服务同进程运行的定时任务（热门候选预热、模型快照检查与重建、隐式反馈聚合、分区维护等）：
+  - 一个调度线程按下次执行时间（最小堆）等待，到点后把任务交给独立的线程池执行，请求线程从不等待任务
+  - 支持固定间隔和cron表达式（分 时 日 月 周，支持 * */n a-b a,b），可加随机抖动错开多个进程
+  - 同一任务上一次尚未结束时跳过本次，不会重叠执行
+  - 每个任务的耗时、成功/失败/跳过次数和最近成功时间导出为监控指标
+作者：电影推荐系统团队
+日期：2025-07-26
+"""
+
+import time
+import heapq
+import random
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import movie_recommender_logger as logger
+from .metrics import REGISTRY
+
+JOB_RUNS = REGISTRY.counter('scheduler_job_runs_total', '后台任务执行次数（ok/error/skipped）', ('job', 'outcome'))
+JOB_DURATION = REGISTRY.histogram('scheduler_job_seconds', '后台任务耗时（秒）', ('job',))
+
+# cron各字段的取值范围
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"cron字段超出范围: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule(object):
+    """五段式cron表达式（分 时 日 月 周，周日为0）"""
+
+    def __init__(self, expression):
+        """
+        初始化
+
+        参数:
+            expression: 如 "30 3 * * *" 表示每天3:30
+
+        异常:
+            ValueError: 表达式格式错误
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式应有5个字段: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(text, low, high) for text, (low, high) in zip(fields, _CRON_FIELDS))
+        # 与标准cron一致：日和周都有限制时满足其一即可
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, ts):
+        """
+        某时刻之后的下一次触发时间（本地时间）
+
+        参数:
+            ts: 时间戳
+
+        返回:
+            float: 时间戳
+        """
+        moment = datetime.datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 4)
+        while moment < limit:
+            if moment.month not in self.months or not self._day_matches(moment):
+                moment = (moment + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if moment.hour not in self.hours:
+                moment = (moment + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+                continue
+            return moment.timestamp()
+        raise ValueError(f"cron表达式没有可触发的时间: {self.expression}")
+
+
+class Job(object):
+    """一个定时任务"""
+
+    def __init__(self, name, func, interval=None, cron=None, jitter=0.0, run_at_start=False):
+        """
+        初始化
+
+        参数:
+            name: 任务名（用于日志和指标）
+            func: 无参函数
+            interval: 执行间隔（秒），与cron二选一
+            cron: cron表达式
+            jitter: 每次执行时间随机推迟的最大秒数
+            run_at_start: 是否在调度器启动后立即执行一次
+        """
+        if (interval is None) == (cron is None):
+            raise ValueError(f"任务 {name} 需要且只能指定interval或cron之一")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.running = False
+        self.next_run = None
+        self.last_success = None
+        self.last_error = None
+
+    def schedule_after(self, now):
+        """计算并记录下一次执行时间"""
+        base = self.cron.next_after(now) if self.cron else now + self.interval
+        self.next_run = base + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        return self.next_run
+
+
+class Scheduler(object):
+    """调度线程 + 执行线程池"""
+
+    def __init__(self, max_workers=2):
+        """
+        初始化
+
+        参数:
+            max_workers: 同时执行的任务数上限
+        """
+        self.jobs = {}
+        self._heap = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler-job')
+        self._thread = None
+        self._stopped = False
+        REGISTRY.gauge('scheduler_job_last_success_timestamp', '后台任务最近一次成功的时间戳',
+            lambda: {(job.name,): job.last_success for job in list(self.jobs.values()) if job.last_success},
+            ('job',))
+
+    def add(self, name, func, interval=None, cron=None, jitter=0.0, run_at_start=False):
+        """
+        添加任务（启动前后都可以）
+
+        参数:
+            见Job
+
+        返回:
+            Job: 任务
+        """
+        job = Job(name, func, interval=interval, cron=cron, jitter=jitter, run_at_start=run_at_start)
+        with self._condition:
+            if name in self.jobs:
+                raise ValueError(f"任务 {name} 已存在")
+            self.jobs[name] = job
+            now = time.time()
+            if run_at_start:
+                job.next_run = now + (random.uniform(0, job.jitter) if job.jitter else 0.0)
+            else:
+                job.schedule_after(now)
+            heapq.heappush(self._heap, (job.next_run, name))
+            self._condition.notify()
+        return job
+
+    def start(self):
+        """启动调度线程（守护线程，不阻止进程退出）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"后台任务调度已启动：{', '.join(self.jobs) or '无任务'}")
+
+    def stop(self, wait=False):
+        """停止调度（正在执行的任务会执行完）"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._executor.shutdown(wait=wait)
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, name = heapq.heappop(self._heap)
+                job = self.jobs[name]
+                heapq.heappush(self._heap, (job.schedule_after(time.time()), name))
+                if job.running:
+                    # 上一次还没结束，跳过本次
+                    JOB_RUNS.inc((name, 'skipped'))
+                    logger.warning(f"后台任务 {name} 上一次尚未结束，跳过本次")
+                    continue
+                job.running = True
+            try:
+                self._executor.submit(self._run, job)
+            except RuntimeError:
+                job.running = False
+                return
+
+    def _run(self, job):
+        started = time.perf_counter()
+        try:
+            job.func()
+        except Exception as e:
+            job.last_error = f"{type(e).__name__}: {e}"
+            JOB_RUNS.inc((job.name, 'error'))
+            logger.error(f"后台任务 {job.name} 失败: {str(e)}", exc_info=True)
+        else:
+            job.last_success = time.time()
+            JOB_RUNS.inc((job.name, 'ok'))
+        finally:
+            JOB_DURATION.observe(time.perf_counter() - started, (job.name,))
+            job.running = False
+
+    def run_now(self, name):
+        """
+        立即在线程池中执行一次任务（上一次尚未结束时不执行）
+
+        返回:
+            bool: 是否已提交
+        """
+        with self._condition:
+            job = self.jobs[name]
+            if job.running:
+                return False
+            job.running = True
+        self._executor.submit(self._run, job)
+        return True
+
+    def stats(self):
+        """
+        返回:
+            dict: {任务名: 状态}
+        """
+        return {name: {
+            'schedule': job.cron.expression if job.cron else f'every {job.interval}s',
+            'next_run': job.next_run,
+            'running': job.running,
+            'last_success': job.last_success,
+            'last_error': job.last_error,
+        } for name, job in list(self.jobs.items())}
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+搜索记录分区维护模块
+seek_movie按seek_time（Unix时间戳）按月RANGE分区，分区名为pYYYYMM，另有一个空的pmax分区：
+  migrate   把未分区的旧表在线迁移为分区表（分块复制后RENAME TABLE原子替换）
+  maintain  提前创建未来几个月的分区、把已结束的日期汇总到日汇总表、删除过期分区（DROP PARTITION为O(1)）
+按sql/init_tables.sql新建的表只有pmax，第一次maintain从最早的记录所在月份起拆分，会把pmax中已有的数据
+全部重写一次（表为空时没有开销）；之后pmax保持为空，再拆分未来月份不移动数据
+统计和聚合任务读取日汇总表（seek_movie_daily_movie/_user/_user_movie），不再扫描原始记录
+作者：电影推荐系统团队
+日期：2025-07-18
+"""
+
+import time
+import argparse
+import datetime
+
+from .logger import movie_recommender_logger as logger
+from .config_parser import ConfigParser
+
+TABLE = 'seek_movie'
+DAY_SECONDS = 86400
+
+# 日汇总水位在etl_watermark表中的名称，last_id为下一个待汇总日期的零点时间戳
+ROLLUP_SOURCE = 'seek_movie_rollup'
+
+PARTITIONED_TABLE_SQL = '''CREATE TABLE `{table}` (
+    `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `user_id` INT NOT NULL,
+    `movie_id` INT NOT NULL,
+    `seek_time` BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (`id`, `seek_time`),
+    KEY `idx_user_id` (`user_id`),
+    KEY `idx_movie_id` (`movie_id`),
+    KEY `idx_seek_time` (`seek_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE (`seek_time`) (
+{partitions}
+)'''
+
+ROLLUP_TABLES_SQL = (
+    '''CREATE TABLE IF NOT EXISTS `etl_watermark` (
+        `source` VARCHAR(64) NOT NULL,
+        `last_id` BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (`source`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    '''CREATE TABLE IF NOT EXISTS `seek_movie_daily_movie` (
+        `day` DATE NOT NULL,
+        `movie_id` INT NOT NULL,
+        `searches` INT NOT NULL,
+        `users` INT NOT NULL,
+        PRIMARY KEY (`day`, `movie_id`),
+        KEY `idx_movie_id` (`movie_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    '''CREATE TABLE IF NOT EXISTS `seek_movie_daily_user` (
+        `day` DATE NOT NULL,
+        `user_id` INT NOT NULL,
+        `searches` INT NOT NULL,
+        `movies` INT NOT NULL,
+        PRIMARY KEY (`day`, `user_id`),
+        KEY `idx_user_id` (`user_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+    '''CREATE TABLE IF NOT EXISTS `seek_movie_daily_user_movie` (
+        `day` DATE NOT NULL,
+        `user_id` INT NOT NULL,
+        `movie_id` INT NOT NULL,
+        `searches` INT NOT NULL,
+        PRIMARY KEY (`day`, `user_id`, `movie_id`)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4''',
+)
+
+# 重新汇总某一天时整体覆盖（可重复执行）
+ROLLUP_SQL = (
+    '''INSERT INTO seek_movie_daily_movie (day, movie_id, searches, users)
+    SELECT %s, movie_id, COUNT(*), COUNT(DISTINCT user_id) FROM seek_movie
+    WHERE seek_time >= %s AND seek_time < %s GROUP BY movie_id
+    ON DUPLICATE KEY UPDATE searches = VALUES(searches), users = VALUES(users)''',
+    '''INSERT INTO seek_movie_daily_user (day, user_id, searches, movies)
+    SELECT %s, user_id, COUNT(*), COUNT(DISTINCT movie_id) FROM seek_movie
+    WHERE seek_time >= %s AND seek_time < %s GROUP BY user_id
+    ON DUPLICATE KEY UPDATE searches = VALUES(searches), movies = VALUES(movies)''',
+    '''INSERT INTO seek_movie_daily_user_movie (day, user_id, movie_id, searches)
+    SELECT %s, user_id, movie_id, COUNT(*) FROM seek_movie
+    WHERE seek_time >= %s AND seek_time < %s GROUP BY user_id, movie_id
+    ON DUPLICATE KEY UPDATE searches = VALUES(searches)''',
+)
+
+
+def month_start(ts):
+    """时间戳所在月份第一天零点（本地时间）的时间戳"""
+    t = time.localtime(ts)
+    return int(time.mktime((t.tm_year, t.tm_mon, 1, 0, 0, 0, 0, 0, -1)))
+
+
+def next_month(ts):
+    """下个月第一天零点的时间戳"""
+    t = time.localtime(month_start(ts))
+    year, month = (t.tm_year + 1, 1) if t.tm_mon == 12 else (t.tm_year, t.tm_mon + 1)
+    return int(time.mktime((year, month, 1, 0, 0, 0, 0, 0, -1)))
+
+
+def day_start(ts):
+    """时间戳所在日期零点（本地时间）的时间戳"""
+    t = time.localtime(ts)
+    return int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+
+def partition_name(ts):
+    """包含该时间戳的月分区名"""
+    return time.strftime('p%Y%m', time.localtime(ts))
+
+
+def month_partitions(start_ts, end_ts):
+    """
+    覆盖[start_ts所在月, end_ts所在月]的月分区
+
+    返回:
+        list: [(分区名, 上界时间戳), ...]
+    """
+    partitions = []
+    ts = month_start(start_ts)
+    while ts <= end_ts:
+        upper = next_month(ts)
+        partitions.append((partition_name(ts), upper))
+        ts = upper
+    return partitions
+
+
+def partition_clause(partitions):
+    """生成分区定义，最后附加pmax"""
+    lines = [f'    PARTITION {name} VALUES LESS THAN ({upper})' for name, upper in partitions]
+    lines.append('    PARTITION pmax VALUES LESS THAN MAXVALUE')
+    return ',\n'.join(lines)
+
+
+class SeekPartitions(object):
+    """seek_movie分区迁移、维护与日汇总"""
+
+    def __init__(self, db_manager, retention_months=12, months_ahead=2, copy_batch=20000):
+        """
+        初始化
+
+        参数:
+            db_manager: DatabaseManager对象
+            retention_months: 原始记录保留的月数（不含当月），0表示不删除
+            months_ahead: 提前创建的分区月数
+            copy_batch: 迁移时每批复制的id范围
+        """
+        self.db_manager = db_manager
+        self.retention_months = retention_months
+        self.months_ahead = months_ahead
+        self.copy_batch = copy_batch
+
+    def partitions(self, table=TABLE):
+        """
+        当前分区
+
+        返回:
+            list: [(分区名, 上界), ...]，按位置排序；未分区时为空列表
+        """
+        rows = self.db_manager.execute_query(
+            'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL '
+            'ORDER BY PARTITION_ORDINAL_POSITION', (table,), primary=True
+        )
+        return [(row['PARTITION_NAME'], row['PARTITION_DESCRIPTION']) for row in rows]
+
+    def migrate(self):
+        """
+        把未分区的seek_movie迁移为分区表：
+        新表按id分块复制旧数据，追上新写入后锁住两张表（LOCK TABLES，需要MySQL 8.0.13+），
+        在锁内复制最后一段并RENAME TABLE替换，期间的写入等待解锁后直接写入新表；
+        旧表保留为seek_movie_unpartitioned，核对行数无误后手动删除
+
+        返回:
+            bool: 新表行数与旧表一致
+        """
+        if self.partitions():
+            logger.info(f"{TABLE} 已经分区，无需迁移")
+            return True
+        new_table = f'{TABLE}_partitioned'
+        old_table = f'{TABLE}_unpartitioned'
+        stats = self.db_manager.execute_query(
+            f'SELECT MIN(NULLIF(seek_time, 0)) AS first_time, COALESCE(MAX(id), 0) AS max_id FROM {TABLE}',
+            primary=True)[0]
+        now = int(time.time())
+        first = int(stats['first_time'] or now)
+        partitions = month_partitions(first, self._ahead(now))
+        with self.db_manager.transaction() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {new_table}')
+            cursor.execute(PARTITIONED_TABLE_SQL.format(table=new_table, partitions=partition_clause(partitions)))
+        logger.info(f"已创建分区表 {new_table}，共 {len(partitions)} 个月分区")
+
+        # 不加锁复制两轮，锁内只剩最近几秒的写入；新表的自增值随显式写入的id增长，替换后不会与旧id重叠
+        last_id = self._copy(TABLE, new_table, 0)
+        last_id = self._copy(TABLE, new_table, last_id)
+        started = time.time()
+        with self.db_manager.transaction() as cursor:
+            cursor.execute(f'LOCK TABLES {TABLE} WRITE, {new_table} WRITE')
+            try:
+                cursor.execute(
+                    f'INSERT IGNORE INTO {new_table} (id, user_id, movie_id, seek_time) '
+                    f'SELECT id, user_id, movie_id, IFNULL(seek_time, 0) FROM {TABLE} WHERE id > %s',
+                    (last_id,)
+                )
+                cursor.execute(f'RENAME TABLE {TABLE} TO {old_table}, {new_table} TO {TABLE}')
+            finally:
+                cursor.execute('UNLOCK TABLES')
+        logger.info(f"{TABLE} 已迁移为分区表，写入阻塞 {time.time() - started:.2f} 秒，旧表保留为 {old_table}")
+        return self._verify(old_table, TABLE)
+
+    def _verify(self, source, target):
+        """旧表切换后不再有写入，核对新表中旧id范围内的行数"""
+        source_stats = self.db_manager.execute_query(
+            f'SELECT COUNT(*) AS total, COALESCE(MAX(id), 0) AS max_id FROM {source}', primary=True)[0]
+        copied = self.db_manager.execute_query(
+            f'SELECT COUNT(*) AS total FROM {target} WHERE id <= %s', (source_stats['max_id'],), primary=True)[0]
+        if copied['total'] != source_stats['total']:
+            logger.error(f"迁移后行数不一致: {source} {source_stats['total']} 行，{target} {copied['total']} 行")
+            return False
+        logger.info(f"迁移行数核对一致: {copied['total']} 行")
+        return True
+
+    def _copy(self, source, target, last_id):
+        """按id范围分块复制到本次开始时的最大id（之后的新写入留给下一轮或锁内的最后一段），返回已复制的最大id"""
+        max_id = self.db_manager.execute_query(
+            f'SELECT COALESCE(MAX(id), 0) AS max_id FROM {source}', primary=True)[0]['max_id']
+        while last_id < max_id:
+            upper = min(last_id + self.copy_batch, max_id)
+            self.db_manager.execute_update(
+                f'INSERT IGNORE INTO {target} (id, user_id, movie_id, seek_time) '
+                f'SELECT id, user_id, movie_id, IFNULL(seek_time, 0) FROM {source} WHERE id > %s AND id <= %s',
+                (last_id, upper)
+            )
+            last_id = upper
+        logger.info(f"已复制 {source} 到 id {last_id}")
+        return last_id
+
+    def _ahead(self, now):
+        ts = now
+        for _ in range(self.months_ahead):
+            ts = next_month(ts)
+        return ts
+
+    def ensure_future_partitions(self, now=None):
+        """
+        从pmax中拆出未来几个月的分区；只有pmax时从最早的记录所在月份拆起，
+        这一次会重写pmax中的全部数据，之后pmax为空，拆分不移动数据
+
+        返回:
+            int: 新建的分区数
+        """
+        current = self.partitions()
+        if not current:
+            logger.warning(f"{TABLE} 尚未分区，请先执行 migrate")
+            return 0
+        now = int(time.time()) if now is None else now
+        bounded = [int(upper) for name, upper in current if upper != 'MAXVALUE']
+        if bounded:
+            start = max(bounded)
+        else:
+            # 过去的记录各自落在所在月份的分区，过期后才能按月删除
+            first = self.db_manager.execute_query(
+                f'SELECT MIN(NULLIF(seek_time, 0)) AS first_time FROM {TABLE}', primary=True)[0]['first_time']
+            start = month_start(min(int(first), now) if first else now)
+            logger.warning(f"{TABLE} 只有pmax分区，从 {partition_name(start)} 起拆分，将重写pmax中的现有数据")
+        wanted = [p for p in month_partitions(start, self._ahead(now)) if p[1] > start]
+        if not wanted:
+            return 0
+        with self.db_manager.transaction() as cursor:
+            cursor.execute(f'ALTER TABLE {TABLE} REORGANIZE PARTITION pmax INTO (\n{partition_clause(wanted)}\n)')
+        logger.info(f"已为 {TABLE} 新建分区: {', '.join(name for name, _ in wanted)}")
+        return len(wanted)
+
+    def drop_expired(self, now=None):
+        """
+        删除整个月都早于保留期的分区
+
+        返回:
+            list: 删除的分区名
+        """
+        if not self.retention_months:
+            return []
+        now = int(time.time()) if now is None else now
+        cutoff = month_start(now)
+        for _ in range(self.retention_months):
+            cutoff = month_start(cutoff - 1)
+        expired = [name for name, upper in self.partitions()
+                   if upper != 'MAXVALUE' and int(upper) <= cutoff]
+        if expired:
+            with self.db_manager.transaction() as cursor:
+                cursor.execute(f'ALTER TABLE {TABLE} DROP PARTITION {", ".join(expired)}')
+            logger.info(f"已删除 {TABLE} 的过期分区: {', '.join(expired)}")
+        return expired
+
+    def rollup(self, now=None):
+        """
+        汇总水位之后所有已结束的日期，并刷新今天的部分汇总（今天不推进水位）
+
+        返回:
+            int: 汇总完成的日期数
+        """
+        now = int(time.time()) if now is None else now
+        today = day_start(now)
+        with self.db_manager.transaction() as cursor:
+            for sql in ROLLUP_TABLES_SQL:
+                cursor.execute(sql)
+            cursor.execute('SELECT last_id FROM etl_watermark WHERE source = %s', (ROLLUP_SOURCE,))
+            row = cursor.fetchone()
+            if row:
+                day = int(row['last_id'])
+            else:
+                cursor.execute(f'SELECT MIN(NULLIF(seek_time, 0)) AS first_time FROM {TABLE}')
+                first = cursor.fetchone()['first_time']
+                day = day_start(int(first)) if first else today
+        done = 0
+        while day <= today:
+            upper = day_start(day + DAY_SECONDS + 3600)  # 跨夏令时也落在下一天
+            with self.db_manager.transaction() as cursor:
+                date = datetime.date.fromtimestamp(day)
+                for sql in ROLLUP_SQL:
+                    cursor.execute(sql, (date, day, upper))
+                if upper <= now:
+                    cursor.execute(
+                        'INSERT INTO etl_watermark (source, last_id) VALUES (%s, %s) '
+                        'ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)', (ROLLUP_SOURCE, upper))
+                    done += 1
+            day = upper
+        return done
+
+    def maintain(self):
+        """日常维护：新建分区、日汇总、删除过期分区"""
+        created = self.ensure_future_partitions()
+        days = self.rollup()
+        dropped = self.drop_expired()
+        logger.info(f"{TABLE} 维护完成：新建 {created} 个分区，汇总 {days} 天，删除 {len(dropped)} 个分区")
+        return {'created': created, 'rolled_up_days': days, 'dropped': dropped}
+
+
+def create_seek_partitions(db_manager):
+    """按[database]配置创建SeekPartitions"""
+    config = ConfigParser().get_database_config()
+    return SeekPartitions(db_manager, retention_months=config.get('seek_retention_months', 12))
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='seek_movie按月分区的迁移与日常维护')
+    parser.add_argument('action', choices=('migrate', 'maintain'), help='migrate：迁移为分区表；maintain：日常维护')
+    args = parser.parse_args()
+
+    from .db_manager import db_manager
+    partitions = create_seek_partitions(db_manager)
+    if args.action == 'migrate':
+        if not partitions.migrate():
+            raise SystemExit(1)
+    else:
+        print(partitions.maintain())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共享内存片库与评分存储
+多个Web工作进程共享同一份douban_movie列数据和like_movie评分数组（multiprocessing.shared_memory），
+工作进程直接在共享内存上建立numpy视图，不复制、不序列化
+  - 由单独的加载进程（python -m web_server.shared_store）定期从数据库读取并发布
+  - 每次发布写入一个新的数据段（双缓冲：保留当前和上一代），写完后在控制段中用顺序锁（seqlock）
+    更新描述符：序号先变为奇数，写入描述符，再变为偶数；读者读到奇数或前后序号不一致时重读
+  - 文本列存为UTF-8字节串加偏移数组，只在取某几行时解码
+作者：电影推荐系统团队
+日期：2025-07-24
+"""
+
+import json
+import time
+import struct
+import argparse
+import threading
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from .logger import movie_recommender_logger as logger
+from .hybrid_ranker import RatingData
+
+DEFAULT_NAME = 'movie_recommender'
+CONTROL_SIZE = 64 * 1024
+# 控制段头部：序号(uint64)、描述符长度(uint32)
+_HEADER = struct.Struct('<QI')
+# 各列在数据段中按8字节对齐
+ALIGN = 8
+
+CATALOG_SQL = 'select id, title, score, num, link, time, address, other_release, actors from douban_movie'
+CATALOG_NUMERIC = {'id': np.int64, 'score': np.float32, 'num': np.int64}
+CATALOG_TEXT = ('title', 'link', 'time', 'address', 'other_release', 'actors')
+RATINGS_SQL = 'select user_id, movie_id, liking from like_movie'
+
+
+def _untrack(shm):
+    """从resource_tracker中注销，进程退出时不自动删除该段"""
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+def _attach(name):
+    """连接已有的共享内存段（读者只映射不删除，否则3.13之前的Python会在读者退出时把段删除）"""
+    return _untrack(shared_memory.SharedMemory(name=name))
+
+
+def encode_text(values):
+    """
+    文本列编码为 (偏移数组, UTF-8字节数组)，第i行为 data[offsets[i]:offsets[i+1]]，None存为空串
+    """
+    encoded = [('' if v is None else str(v)).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def catalog_columns(rows):
+    """
+    把douban_movie的行转换为列数组
+
+    参数:
+        rows: CATALOG_SQL查询出的字典行
+
+    返回:
+        dict: {列名: 数组}，文本列拆成 <列名>.offsets 和 <列名>.data
+    """
+    rows = sorted(rows, key=lambda r: r['id'])
+    columns = {}
+    for name, dtype in CATALOG_NUMERIC.items():
+        fill = np.nan if np.issubdtype(dtype, np.floating) else 0
+        columns[name] = np.array([fill if r[name] is None else r[name] for r in rows], dtype=dtype)
+    for name in CATALOG_TEXT:
+        columns[name + '.offsets'], columns[name + '.data'] = encode_text(r[name] for r in rows)
+    return columns
+
+
+class SharedStoreWriter(object):
+    """发布者：只应有一个进程持有"""
+
+    def __init__(self, name=DEFAULT_NAME):
+        """
+        初始化，创建（或接管已有的）控制段
+
+        参数:
+            name: 共享内存名前缀
+        """
+        self.name = name
+        try:
+            self.control = shared_memory.SharedMemory(name=name + '-ctl', create=True, size=CONTROL_SIZE)
+            _HEADER.pack_into(self.control.buf, 0, 0, 0)
+        except FileExistsError:
+            self.control = shared_memory.SharedMemory(name=name + '-ctl')
+        self._seq = self.control.buf.cast('Q')
+        self.generation = 0
+        # 上一次运行留下的两代数据段，发布新一代后删除
+        self._orphans = []
+        descriptor = self._descriptor()
+        if descriptor:
+            self.generation = descriptor['generation']
+            self._orphans = [f'{name}-{g}' for g in (self.generation - 1, self.generation) if g > 0]
+        self._segments = []
+
+    def _descriptor(self):
+        seq, length = _HEADER.unpack_from(self.control.buf, 0)
+        if not length or seq % 2:
+            return None
+        return json.loads(bytes(self.control.buf[_HEADER.size:_HEADER.size + length]))
+
+    def publish(self, tables):
+        """
+        发布新一代数据
+
+        参数:
+            tables: {表名: {列名: numpy数组}}
+
+        返回:
+            int: 代号
+        """
+        layout = {}
+        offset = 0
+        for table, columns in tables.items():
+            for column, array in columns.items():
+                array = np.ascontiguousarray(array)
+                layout[f'{table}/{column}'] = [array.dtype.str, list(array.shape), offset]
+                offset += (array.nbytes + ALIGN - 1) // ALIGN * ALIGN
+        generation = self.generation + 1
+        segment_name = f'{self.name}-{generation}'
+        segment = shared_memory.SharedMemory(name=segment_name, create=True, size=max(offset, ALIGN))
+        for table, columns in tables.items():
+            for column, array in columns.items():
+                dtype, shape, start = layout[f'{table}/{column}']
+                view = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=start)
+                view[...] = array
+
+        descriptor = json.dumps({'generation': generation, 'segment': segment_name,
+                                 'published_at': time.time(), 'layout': layout}).encode('utf-8')
+        if _HEADER.size + len(descriptor) > CONTROL_SIZE:
+            segment.close()
+            segment.unlink()
+            raise ValueError(f"描述符过大: {len(descriptor)} 字节")
+        # 顺序锁：奇数表示正在写
+        seq = self._seq[0]
+        self._seq[0] = seq + 1
+        self.control.buf[_HEADER.size:_HEADER.size + len(descriptor)] = descriptor
+        struct.pack_into('<I', self.control.buf, 8, len(descriptor))
+        self._seq[0] = seq + 2
+        self.generation = generation
+
+        # 双缓冲：保留当前和上一代，更早的段删除名字（已映射的读者不受影响）
+        self._segments.append(segment)
+        while len(self._segments) > 2:
+            old = self._segments.pop(0)
+            old.close()
+            old.unlink()
+        for orphan in self._orphans:
+            try:
+                old = shared_memory.SharedMemory(name=orphan)
+                old.close()
+                old.unlink()
+            except FileNotFoundError:
+                pass
+        self._orphans = []
+        logger.info(f"已发布共享存储第 {generation} 代，{offset / 1024 / 1024:.1f} MB")
+        return generation
+
+    def close(self, unlink=True):
+        """关闭并（默认）删除全部共享内存段；unlink=False时保留，供之后启动的读者和加载进程使用"""
+        for shm in self._segments + [self.control]:
+            if not unlink:
+                _untrack(shm)
+        self._seq.release()
+        for shm in self._segments + [self.control]:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        self._segments = []
+
+
+class SharedCatalog(object):
+    """某一代数据上的只读视图"""
+
+    def __init__(self, segment, descriptor):
+        self.segment = segment
+        self.generation = descriptor['generation']
+        self.published_at = descriptor['published_at']
+        tables = {}
+        for key, (dtype, shape, offset) in descriptor['layout'].items():
+            table, column = key.split('/', 1)
+            array = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+            array.flags.writeable = False
+            tables.setdefault(table, {})[column] = array
+        self.movies = tables.get('movies', {})
+        self.ratings = RatingData.from_columns(tables['ratings']) if 'ratings' in tables else None
+
+    def __len__(self):
+        return len(self.movies.get('id', ()))
+
+    def text(self, column, index):
+        offsets, data = self.movies[column + '.offsets'], self.movies[column + '.data']
+        return bytes(data[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def rows(self, movie_ids):
+        """
+        按电影id取行（与数据库查询的字典行字段一致，缺失值为None）
+
+        参数:
+            movie_ids: 电影id列表
+
+        返回:
+            dict: {电影id: 行}
+        """
+        ids = self.movies['id']
+        if not len(ids):
+            return {}
+        wanted = np.asarray(movie_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        result = {}
+        for movie_id, index in zip(wanted.tolist(), pos.tolist()):
+            if ids[index] != movie_id:
+                continue
+            score = float(self.movies['score'][index])
+            row = {'id': movie_id, 'score': None if np.isnan(score) else round(score, 1),
+                   'num': int(self.movies['num'][index])}
+            for column in CATALOG_TEXT:
+                row[column] = self.text(column, index) or None
+            result[movie_id] = row
+        return result
+
+
+class SharedStoreReader(object):
+    """工作进程中的读者：按顺序锁读取描述符，代号变化时重新建立视图"""
+
+    def __init__(self, name=DEFAULT_NAME):
+        self.name = name
+        self.control = None
+        self.view = None
+        self._lock = threading.Lock()
+
+    def _read_descriptor(self, retries=100):
+        buf = self.control.buf
+        for _ in range(retries):
+            before, length = _HEADER.unpack_from(buf, 0)
+            if before % 2 or not length:
+                time.sleep(0.0001)
+                continue
+            raw = bytes(buf[_HEADER.size:_HEADER.size + length])
+            after, _ = _HEADER.unpack_from(buf, 0)
+            if before == after:
+                return json.loads(raw)
+        return None
+
+    def get(self):
+        """
+        当前一代数据的视图，加载进程未运行或尚未发布时为None
+
+        返回:
+            SharedCatalog: 只读视图
+        """
+        with self._lock:
+            try:
+                if self.control is None:
+                    self.control = _attach(self.name + '-ctl')
+                descriptor = self._read_descriptor()
+                if descriptor is None:
+                    return self.view
+                if self.view is None or self.view.generation != descriptor['generation']:
+                    # 旧视图的映射在没有引用后随垃圾回收关闭
+                    self.view = SharedCatalog(_attach(descriptor['segment']), descriptor)
+            except FileNotFoundError:
+                # 尚未发布，或读描述符与连接数据段之间已发布了两代（下次重读）
+                pass
+            except Exception as e:
+                logger.error(f"读取共享存储失败: {str(e)}")
+            return self.view
+
+
+def load_tables(db_manager):
+    """
+    从数据库读取片库和评分
+
+    返回:
+        dict: {'movies': 列, 'ratings': 列}
+    """
+    movies = catalog_columns(db_manager.execute_query(CATALOG_SQL))
+    ratings = RatingData((r['user_id'], r['movie_id'], r['liking']) for r in db_manager.execute_query(RATINGS_SQL))
+    return {'movies': movies, 'ratings': ratings.columns()}
+
+
+def main():
+    """加载进程：定期从数据库读取并发布到共享内存"""
+    parser = argparse.ArgumentParser(description='把片库和评分发布到共享内存，供Web工作进程读取')
+    parser.add_argument('--name', default='', help='共享内存名前缀，默认使用[service] shared_store_name')
+    parser.add_argument('--interval', type=float, default=60, help='刷新间隔（秒），0表示只发布一次')
+    args = parser.parse_args()
+
+    from .config_parser import ConfigParser
+    from .db_manager import db_manager
+
+    name = args.name or ConfigParser().get_service_config().get('shared_store_name') or DEFAULT_NAME
+    writer = SharedStoreWriter(name)
+    try:
+        while True:
+            try:
+                writer.publish(load_tables(db_manager))
+            except Exception as e:
+                logger.error(f"发布共享存储失败: {str(e)}")
+            if not args.interval:
+                # 只发布一次时保留共享内存，供之后启动的工作进程使用
+                writer.close(unlink=False)
+                return
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SQL追踪模块
+为每条SQL计时并归一化为指纹，统计最慢的指纹、捕获慢查询的EXPLAIN，
+并识别同一请求内重复执行同一指纹的N+1模式
+作者：电影推荐系统团队
+日期：2025-06-09
+"""
+
+import re
+import time
+import heapq
+import threading
+from collections import deque, OrderedDict
+
+from .logger import movie_recommender_logger as logger
+from .config_parser import ConfigParser
+from . import metrics
+
+# SQL归一化用的正则
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"\b-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST_RE = re.compile(r"(values\s*\(\?[^)]*\))(?:\s*,\s*\(\?[^)]*\))+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """
+    将SQL归一化为指纹：字面量替换为?，IN列表与多行VALUES折叠，空白压缩
+
+    参数:
+        sql: SQL语句
+
+    返回:
+        str: SQL指纹
+    """
+    text = _STRING_RE.sub('?', sql)
+    text = _NUMBER_RE.sub('?', text)
+    text = text.replace('%s', '?')
+    text = _SPACE_RE.sub(' ', text).strip().rstrip(';').lower()
+    text = _IN_LIST_RE.sub('(?+)', text)
+    text = _VALUES_LIST_RE.sub(r'\1+', text)
+    return text
+
+
+class _FingerprintStats:
+    """单个指纹的统计"""
+
+    __slots__ = ('count', 'total', 'max', 'sample')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = ''
+
+    def merge(self, other):
+        """合并另一个窗口的统计"""
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+            self.sample = other.sample
+
+
+class SQLTracer:
+    """SQL追踪器"""
+
+    def __init__(self, slow_ms=200, top_n=20, explain_slow=False, n_plus_one_threshold=10,
+                 window=300, max_fingerprints=2000, slow_log_size=100):
+        """
+        初始化SQL追踪器
+
+        参数:
+            slow_ms: 慢查询阈值（毫秒）
+            top_n: 导出时保留的最慢指纹数
+            explain_slow: 是否对慢查询捕获EXPLAIN输出
+            n_plus_one_threshold: 同一请求内同一指纹重复多少次视为N+1
+            window: 统计窗口长度（秒），保留当前与上一个窗口
+            max_fingerprints: 每个窗口最多跟踪的指纹数
+            slow_log_size: 保留的慢查询记录条数
+        """
+        self.slow_seconds = slow_ms / 1000.0
+        self.top_n = top_n
+        self.explain_slow = explain_slow
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._window_start = time.time()
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._explained = {}
+        self._n_plus_one = {}
+        self._fingerprint_cache = OrderedDict()
+        self._request = threading.local()
+
+    def _fingerprint(self, sql):
+        """带缓存的指纹计算（同一SQL文本只归一化一次）"""
+        with self._lock:
+            fp = self._fingerprint_cache.get(sql)
+            if fp is not None:
+                self._fingerprint_cache.move_to_end(sql)
+                return fp
+        fp = fingerprint(sql)
+        with self._lock:
+            self._fingerprint_cache[sql] = fp
+            if len(self._fingerprint_cache) > self.max_fingerprints:
+                self._fingerprint_cache.popitem(last=False)
+        return fp
+
+    def _rotate(self, now):
+        """窗口到期时轮换统计"""
+        if now - self._window_start >= self.window:
+            self._previous = self._current
+            self._current = {}
+            self._explained = {}
+            self._window_start = now
+
+    def record(self, sql, elapsed, explain=None):
+        """
+        记录一条SQL的执行
+
+        参数:
+            sql: 实际执行的SQL语句
+            elapsed: 执行耗时（秒）
+            explain: 可选的函数，调用后返回该语句的EXPLAIN结果
+        """
+        fp = self._fingerprint(sql)
+        now = time.time()
+        need_explain = False
+        with self._lock:
+            self._rotate(now)
+            stats = self._current.get(fp)
+            if stats is None:
+                if len(self._current) >= self.max_fingerprints:
+                    # 指纹过多时丢弃新指纹，避免内存无限增长
+                    stats = None
+                else:
+                    stats = _FingerprintStats()
+                    self._current[fp] = stats
+            if stats is not None:
+                stats.count += 1
+                stats.total += elapsed
+                if elapsed >= stats.max:
+                    stats.max = elapsed
+                    stats.sample = sql[:1000]
+            if elapsed >= self.slow_seconds:
+                need_explain = (self.explain_slow and explain is not None
+                                and fp not in self._explained
+                                and fp.startswith('select'))
+                if need_explain:
+                    self._explained[fp] = None
+
+        if elapsed >= self.slow_seconds:
+            plan = None
+            if need_explain:
+                try:
+                    plan = explain()
+                except Exception as e:
+                    plan = f"EXPLAIN失败: {str(e)}"
+                with self._lock:
+                    self._explained[fp] = plan
+            self._slow_log.append({
+                'time': now,
+                'elapsed_ms': round(elapsed * 1000, 3),
+                'fingerprint': fp,
+                'sql': sql[:1000],
+                'explain': plan,
+            })
+            logger.warning(f"慢查询 {elapsed * 1000:.1f}ms: {sql[:200]}")
+
+        self._count_in_request(fp)
+
+    def _count_in_request(self, fp):
+        """统计当前请求内的指纹重复次数"""
+        counts = getattr(self._request, 'counts', None)
+        if counts is None:
+            return
+        count = counts.get(fp, 0) + 1
+        counts[fp] = count
+        if count == self.n_plus_one_threshold:
+            logger.warning(f"疑似N+1查询（{self._request.label}）: {fp[:200]}")
+
+    def begin_request(self, label=''):
+        """
+        开始一个请求范围，用于N+1检测
+
+        参数:
+            label: 请求标识（如命令名称）
+        """
+        self._request.counts = {}
+        self._request.label = label
+
+    def end_request(self):
+        """结束请求范围，汇总本请求中的N+1模式"""
+        counts = getattr(self._request, 'counts', None)
+        if counts is None:
+            return
+        label = self._request.label
+        self._request.counts = None
+        flagged = [(fp, n) for fp, n in counts.items() if n >= self.n_plus_one_threshold]
+        if not flagged:
+            return
+        with self._lock:
+            for fp, n in flagged:
+                entry = self._n_plus_one.get(fp)
+                if entry is None:
+                    if len(self._n_plus_one) >= self.max_fingerprints:
+                        continue
+                    entry = {'requests': 0, 'max_repeats': 0, 'labels': {}}
+                    self._n_plus_one[fp] = entry
+                entry['requests'] += 1
+                entry['max_repeats'] = max(entry['max_repeats'], n)
+                entry['labels'][label] = entry['labels'].get(label, 0) + 1
+
+    def dump(self):
+        """
+        导出当前追踪结果
+
+        返回:
+            dict: 最慢指纹、慢查询记录、N+1模式
+        """
+        with self._lock:
+            self._rotate(time.time())
+            merged = {}
+            for window in (self._previous, self._current):
+                for fp, stats in window.items():
+                    total = merged.get(fp)
+                    if total is None:
+                        total = _FingerprintStats()
+                        merged[fp] = total
+                    total.merge(stats)
+            explained = dict(self._explained)
+            n_plus_one = {fp: dict(entry, labels=dict(entry['labels']))
+                          for fp, entry in self._n_plus_one.items()}
+            slow_log = list(self._slow_log)
+
+        slowest = heapq.nlargest(self.top_n, merged.items(), key=lambda item: item[1].max)
+        return {
+            'window_seconds': self.window,
+            'slowest': [{
+                'fingerprint': fp,
+                'count': stats.count,
+                'total_ms': round(stats.total * 1000, 3),
+                'avg_ms': round(stats.total * 1000 / stats.count, 3) if stats.count else 0,
+                'max_ms': round(stats.max * 1000, 3),
+                'sample': stats.sample,
+                'explain': explained.get(fp),
+            } for fp, stats in slowest],
+            'slow_queries': slow_log,
+            'n_plus_one': n_plus_one,
+        }
+
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self._current = {}
+            self._previous = {}
+            self._explained = {}
+            self._n_plus_one = {}
+            self._slow_log.clear()
+            self._window_start = time.time()
+
+
+def explain_with(connection, sql, params=None):
+    """
+    返回一个在指定连接上执行EXPLAIN的函数
+
+    参数:
+        connection: 数据库连接
+        sql: SQL语句
+        params: SQL参数
+
+    返回:
+        function: 调用后返回EXPLAIN结果列表
+    """
+    def run():
+        cursor = connection.cursor()
+        try:
+            cursor.execute('EXPLAIN ' + sql, params)
+            return [row if isinstance(row, dict) else list(row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    return run
+
+
+class TracedCursor(object):
+    """为数据库游标计时的代理，结果计入当前请求的监控指标与SQL追踪"""
+
+    def __init__(self, cursor):
+        """
+        初始化游标代理
+
+        参数:
+            cursor: 原始数据库游标
+        """
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        """执行SQL并计时"""
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.record_db(elapsed)
+            sql_tracer.record(sql, elapsed, explain_with(self._cursor.connection, sql, params))
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _create_tracer():
+    """根据配置文件创建全局追踪器"""
+    db_config = ConfigParser().get_database_config()
+    return SQLTracer(
+        slow_ms=db_config.get('slow_query_ms', 200),
+        top_n=db_config.get('trace_top_n', 20),
+        explain_slow=db_config.get('explain_slow_queries', False),
+        n_plus_one_threshold=db_config.get('n_plus_one_threshold', 10)
+    )
+
+# 全局SQL追踪器实例
+sql_tracer = _create_tracer()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SQLite存储后端
+单机部署和测试时代替MySQL（[database] backend = sqlite），没有网络往返：
+  - 表结构由sql/init_tables.sql转换而来，与MySQL保持同一份定义
+  - 连接开启WAL（读写互不阻塞）、synchronous=NORMAL、较大的页缓存和mmap
+  - 连接与游标的接口与pymysql的DictCursor一致，执行前把本项目用到的MySQL写法转换为SQLite写法
+作者：电影推荐系统团队
+日期：2025-07-20
+"""
+
+import os
+import re
+import math
+import sqlite3
+import argparse
+
+from .logger import movie_recommender_logger as logger
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'sql', 'init_tables.sql')
+DEFAULT_DB_PATH = os.path.join(PROJECT_ROOT, 'data', 'douban.sqlite3')
+
+# 从MySQL导入的表（按依赖顺序）
+IMPORT_TABLES = ('douban_movie', 'user_info', 'like_movie', 'seek_movie')
+
+_DUPLICATE_KEY = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.I)
+_VALUES_REF = re.compile(r'\bVALUES\s*\(\s*`?(\w+)`?\s*\)', re.I)
+_INSERT_IGNORE = re.compile(r'^\s*INSERT\s+IGNORE\b', re.I)
+_EXPLAIN = re.compile(r'^\s*EXPLAIN\s+', re.I)
+_CREATE_TABLE = re.compile(r'^\s*CREATE\s+TABLE\b', re.I)
+
+
+def translate(sql):
+    """
+    把本项目使用的MySQL语句转换为SQLite语句
+
+    参数:
+        sql: MySQL语句（%s占位符）
+
+    返回:
+        str: SQLite语句（?占位符）
+    """
+    sql = sql.replace('%s', '?')
+    sql = _INSERT_IGNORE.sub('INSERT OR IGNORE', sql)
+    sql = _EXPLAIN.sub('EXPLAIN QUERY PLAN ', sql)
+    match = _DUPLICATE_KEY.search(sql)
+    if match:
+        # 冲突目标省略时对任意唯一约束生效（SQLite 3.35+），VALUES(col)对应excluded.col
+        update = _VALUES_REF.sub(r'excluded.\1', sql[match.end():])
+        sql = sql[:match.start()] + 'ON CONFLICT DO UPDATE SET' + update
+    return sql
+
+
+def create_table_statements(statement):
+    """把一条MySQL的CREATE TABLE转换为SQLite的建表和建索引语句"""
+    # 去掉表选项和分区定义（SQLite不支持，也不需要）
+    statement = re.split(r'\)\s*ENGINE\s*=', statement.strip().rstrip(';'), flags=re.I)[0] + ')'
+    head, _, rest = statement.partition('(')
+    table = re.search(r'`(\w+)`', head).group(1)
+    body = rest[:rest.rindex(')')]
+    columns, constraints, indexes = [], [], []
+    auto_increment = None
+    for line in body.split('\n'):
+        line = line.strip().rstrip(',')
+        if not line:
+            continue
+        key = re.match(r'(UNIQUE\s+)?KEY\s+`(\w+)`\s*\((.*)\)', line, re.I)
+        if key:
+            if key.group(1):
+                constraints.append(f'UNIQUE ({key.group(3)})')
+            else:
+                indexes.append(f'CREATE INDEX IF NOT EXISTS `{table}_{key.group(2)}` ON `{table}` ({key.group(3)})')
+        elif line.upper().startswith('PRIMARY KEY'):
+            constraints.insert(0, line)
+        else:
+            line = re.sub(r'\bON UPDATE CURRENT_TIMESTAMP\b', '', line, flags=re.I)
+            line = re.sub(r'\s+UNSIGNED\b', '', line, flags=re.I)
+            if re.search(r'\bAUTO_INCREMENT\b', line, re.I):
+                # 自增列必须是INTEGER PRIMARY KEY（rowid别名）
+                auto_increment = re.match(r'`(\w+)`', line).group(1)
+                line = f'`{auto_increment}` INTEGER PRIMARY KEY AUTOINCREMENT'
+            columns.append(line.strip())
+    if auto_increment:
+        constraints = [c for c in constraints if not c.upper().startswith('PRIMARY KEY')]
+    create = f'CREATE TABLE IF NOT EXISTS `{table}` (\n    ' + ',\n    '.join(columns + constraints) + '\n)'
+    return [create] + indexes
+
+
+def schema_statements(path=SCHEMA_PATH):
+    """
+    读取sql/init_tables.sql并转换为SQLite语句
+
+    返回:
+        list: 建表与建索引语句
+    """
+    with open(path, encoding='utf-8') as f:
+        text = '\n'.join(line for line in f.read().split('\n') if not line.lstrip().startswith('--'))
+    statements = []
+    for statement in text.split(';'):
+        statement = statement.strip()
+        if _CREATE_TABLE.match(statement):
+            statements.extend(create_table_statements(statement))
+    return statements
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor(object):
+    """与pymysql DictCursor接口一致的游标"""
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        """执行一条语句，返回受影响的行数（查询语句返回0）"""
+        if _CREATE_TABLE.match(sql):
+            # 模块内联的MySQL建表语句（如ensure_tables）同样转换
+            for statement in create_table_statements(sql):
+                self._cursor.execute(statement)
+            return 0
+        self._cursor.execute(translate(sql), tuple(params) if params is not None else ())
+        return max(self._cursor.rowcount, 0)
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        return max(self._cursor.rowcount, 0)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection(object):
+    """与pymysql连接接口一致的SQLite连接"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self):
+        return SQLiteCursor(self._connection.cursor(), self)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def ping(self, reconnect=True):
+        """本地文件没有断线，保持与pymysql接口一致"""
+        return True
+
+    def close(self):
+        self._connection.close()
+
+
+class SQLiteBackend(object):
+    """SQLite数据库文件及其连接参数"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, cache_mb=64, mmap_mb=256, busy_timeout=5.0):
+        """
+        初始化
+
+        参数:
+            path: 数据库文件路径
+            cache_mb: 每个连接的页缓存（MB）
+            mmap_mb: 内存映射读取的上限（MB）
+            busy_timeout: 等待写锁的秒数
+        """
+        self.path = path
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.busy_timeout = busy_timeout
+        self._schema_ready = False
+
+    def connect(self):
+        """
+        创建一个新连接（可在线程间传递，由连接池保证同一时刻只被一个线程使用）
+
+        返回:
+            SQLiteConnection: 数据库连接对象
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        connection.row_factory = _dict_row
+        for pragma in (
+            'PRAGMA journal_mode=WAL',
+            'PRAGMA synchronous=NORMAL',
+            f'PRAGMA cache_size=-{int(self.cache_mb * 1024)}',
+            f'PRAGMA mmap_size={int(self.mmap_mb * 1024 * 1024)}',
+            'PRAGMA temp_store=MEMORY',
+        ):
+            connection.execute(pragma)
+        # MySQL中可用而SQLite内置缺少（或未编译进来）的数学函数
+        connection.create_function('ln', 1, lambda x: math.log(x) if x and x > 0 else None, deterministic=True)
+        connection.create_function('exp', 1, lambda x: math.exp(x) if x is not None else None, deterministic=True)
+        if not self._schema_ready:
+            self.ensure_schema(connection)
+        return SQLiteConnection(connection)
+
+    def ensure_schema(self, connection):
+        """按sql/init_tables.sql建表（已存在的表不变）"""
+        for statement in schema_statements():
+            connection.execute(statement)
+        connection.commit()
+        self._schema_ready = True
+
+    def import_from_mysql(self, db_config, batch_size=5000):
+        """
+        从MySQL复制数据（覆盖同名表中的现有数据）
+
+        参数:
+            db_config: [database]配置
+            batch_size: 每批复制的行数
+
+        返回:
+            dict: {表名: 行数}
+        """
+        import pymysql
+        from pymysql.cursors import SSCursor
+
+        source = pymysql.connect(
+            host=db_config.get('host', 'localhost'),
+            port=db_config.get('port', 3306),
+            user=db_config.get('user', 'douban_user'),
+            password=db_config.get('password', 'MySQL_20050816Zln@233'),
+            db=db_config.get('db', 'douban'),
+            charset=db_config.get('charset', 'utf8mb4'),
+            cursorclass=SSCursor
+        )
+        target = self.connect()
+        counts = {}
+        try:
+            for table in IMPORT_TABLES:
+                with source.cursor() as reader:
+                    reader.execute(f'SELECT * FROM `{table}`')
+                    columns = ', '.join(f'`{d[0]}`' for d in reader.description)
+                    placeholders = ', '.join(['%s'] * len(reader.description))
+                    cursor = target.cursor()
+                    cursor.execute(f'DELETE FROM `{table}`')
+                    counts[table] = 0
+                    while True:
+                        rows = reader.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        cursor.executemany(f'INSERT INTO `{table}` ({columns}) VALUES ({placeholders})',
+                                           [tuple(str(v) if hasattr(v, 'isoformat') else v for v in row) for row in rows])
+                        counts[table] += len(rows)
+                    target.commit()
+                logger.info(f"已从MySQL导入 {table}: {counts[table]} 行")
+        finally:
+            source.close()
+            target.close()
+        return counts
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='初始化SQLite数据库，或从MySQL导入数据')
+    parser.add_argument('action', choices=('init', 'import-mysql'), help='init：建表；import-mysql：从[database]的MySQL复制数据')
+    parser.add_argument('--path', default='', help='数据库文件路径，默认使用[database] sqlite_path')
+    args = parser.parse_args()
+
+    from .config_parser import ConfigParser
+    config = ConfigParser().get_database_config()
+    backend = SQLiteBackend(args.path or config.get('sqlite_path') or DEFAULT_DB_PATH,
+                            cache_mb=config.get('sqlite_cache_mb', 64))
+    if args.action == 'init':
+        backend.connect().close()
+        print(f"已初始化 {backend.path}")
+    else:
+        print(backend.import_from_mysql(config))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+热门电影统计模块
+搜索和评价事件写入滑动窗口计数草图（Count-Min Sketch），同时维护一个有界的候选集，
+查询时只对候选集估计计数取前K个，不需要对seek_movie做GROUP BY
+内存占用只取决于窗口分段数、草图大小和候选集大小，与流量无关
+作者：电影推荐系统团队
+日期：2025-07-16
+"""
+
+import time
+import heapq
+import threading
+from array import array
+
+# 各类事件的权重
+EVENT_WEIGHTS = {
+    'search': 1,
+    'rate': 2,
+}
+
+
+class SlidingCountMinSketch(object):
+    """
+    滑动窗口计数草图
+    窗口分为slots段，每段一个depth×width的计数矩阵，另维护全部段之和；
+    进入新的一段时从总和中减去最老一段并清零，计数只会高估、不会低估
+    （每次只更新depth个计数器，用array逐元素访问比numpy花式索引快数倍）
+    """
+
+    def __init__(self, window=3600, slots=12, depth=4, width=2048):
+        """
+        初始化
+
+        参数:
+            window: 窗口长度（秒）
+            slots: 窗口分段数（过期粒度为window/slots秒）
+            depth: 哈希函数个数
+            width: 每行计数器个数
+        """
+        self.slot_seconds = float(window) / slots
+        self.depth = depth
+        self.width = width
+        self.slots = [[array('q', bytes(8 * width)) for _ in range(depth)] for _ in range(slots)]
+        self.total = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self._seeds = [hash(('trending', i)) for i in range(depth)]
+        self._current = int(time.time() // self.slot_seconds)
+
+    def _columns(self, item):
+        width = self.width
+        return [hash((seed, item)) % width for seed in self._seeds]
+
+    @property
+    def nbytes(self):
+        """计数器占用的字节数"""
+        rows = [row for slot in self.slots for row in slot] + self.total
+        return sum(row.itemsize * len(row) for row in rows)
+
+    def advance(self, now=None):
+        """
+        过期已滑出窗口的分段
+
+        返回:
+            bool: 是否进入了新的分段
+        """
+        epoch = int((time.time() if now is None else now) // self.slot_seconds)
+        steps = epoch - self._current
+        if steps <= 0:
+            return False
+        count = len(self.slots)
+        for step in range(1, min(steps, count) + 1):
+            slot = self.slots[(self._current + step) % count]
+            for total_row, slot_row in zip(self.total, slot):
+                for column, value in enumerate(slot_row):
+                    if value:
+                        total_row[column] -= value
+                        slot_row[column] = 0
+        self._current = epoch
+        return True
+
+    def add(self, item, amount=1, now=None):
+        """
+        计数
+
+        参数:
+            item: 可哈希的元素
+            amount: 增加量
+            now: 事件时间，默认当前时间
+
+        返回:
+            int: 加入后的估计计数
+        """
+        self.advance(now)
+        slot = self.slots[self._current % len(self.slots)]
+        estimate = None
+        for row, column in enumerate(self._columns(item)):
+            slot[row][column] += amount
+            value = self.total[row][column] + amount
+            self.total[row][column] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, item):
+        """窗口内的估计计数（可能高估）"""
+        return min(self.total[row][column] for row, column in enumerate(self._columns(item)))
+
+
+class TrendingTracker(object):
+    """热门电影：计数草图 + 有界候选集（最小堆淘汰）"""
+
+    def __init__(self, window=3600, slots=12, depth=4, width=2048, capacity=200, cache_seconds=1.0):
+        """
+        初始化
+
+        参数:
+            window, slots, depth, width: 见SlidingCountMinSketch
+            capacity: 候选集大小（应明显大于查询的K）
+            cache_seconds: 查询结果的缓存秒数
+        """
+        self.sketch = SlidingCountMinSketch(window, slots, depth, width)
+        self.capacity = capacity
+        self.cache_seconds = cache_seconds
+        # 候选：电影id -> 最近一次估计计数（进入新分段时全部重新估计）；堆中可能有过时的条目，弹出时与字典比对
+        self._candidates = {}
+        self._titles = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._cache = None
+        self._cache_expires = 0.0
+
+    def record(self, movie_id, title=None, event='search', now=None):
+        """
+        记录一次事件
+
+        参数:
+            movie_id: 电影id
+            title: 电影名（用于直接生成回复，不必再查数据库）
+            event: 事件类型（search/rate）
+            now: 事件时间，默认当前时间
+        """
+        amount = EVENT_WEIGHTS.get(event, 1)
+        with self._lock:
+            if self.sketch.advance(now):
+                # 旧分段过期后候选的计数会下降，淘汰比较前先更新
+                self._refresh()
+            count = self.sketch.add(movie_id, amount, now)
+            if movie_id in self._candidates or len(self._candidates) < self.capacity:
+                self._admit(movie_id, title, count)
+                return
+            # 候选集已满：新元素的计数超过当前最小者时替换它
+            while self._heap:
+                smallest, victim = self._heap[0]
+                if self._candidates.get(victim) != smallest:
+                    heapq.heappop(self._heap)
+                    continue
+                if count <= smallest:
+                    return
+                heapq.heappop(self._heap)
+                del self._candidates[victim]
+                self._titles.pop(victim, None)
+                break
+            self._admit(movie_id, title, count)
+
+    def _refresh(self):
+        """按草图重新估计全部候选的计数并重建堆"""
+        counts = [(self.sketch.estimate(m), m) for m in self._candidates]
+        for count, movie_id in counts:
+            self._candidates[movie_id] = count
+        self._heap = counts
+        heapq.heapify(self._heap)
+        return counts
+
+    def _admit(self, movie_id, title, count):
+        self._candidates[movie_id] = count
+        if title:
+            self._titles[movie_id] = title
+        heapq.heappush(self._heap, (count, movie_id))
+        # 过时条目过多时重建堆，堆的大小保持与候选集同阶
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, m) for m, c in self._candidates.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, k=10):
+        """
+        窗口内计数最高的电影
+
+        参数:
+            k: 返回数量
+
+        返回:
+            list: [(电影id, 电影名, 估计计数), ...]，按计数降序
+        """
+        now = time.time()
+        cache = self._cache
+        if cache is not None and now < self._cache_expires and cache[0] >= k:
+            return cache[1][:k]
+        with self._lock:
+            self.sketch.advance(now)
+            counts = list(self._refresh())
+            best = heapq.nlargest(k, (item for item in counts if item[0] > 0))
+            result = [(m, self._titles.get(m, ''), c) for c, m in best]
+            self._cache = (k, result)
+            self._cache_expires = now + self.cache_seconds
+        return result
+
+    def stats(self):
+        """
+        返回:
+            dict: 候选数、草图占用字节数
+        """
+        return {
+            'candidates': len(self._candidates),
+            'sketch_bytes': self.sketch.nbytes,
+        }
+
+
+# 全局热门统计（1小时窗口，5分钟过期粒度）
+trending = TrendingTracker()